@@ -0,0 +1,102 @@
+"""
+Профили DATABASES. Профиль выбирается переменной окружения SHOP_DB_PROFILE:
+
+* sqlite (по умолчанию) — файл db.sqlite3: писатели ждут друг друга до
+  busy_timeout вместо мгновенной ошибки «database is locked». С
+  SHOP_SQLITE_WAL=1 — ещё и режим WAL (читатели не ждут писателя); он
+  переписывает заголовок файла БД и оставляет рядом -wal/-shm, поэтому
+  включается только явно (для сервера, а не для разработки);
+* server — PostgreSQL по переменным DB_*: постоянные соединения с
+  проверкой перед использованием или пул соединений (psycopg 3), плюс
+  реплики для чтения из DB_REPLICA_HOSTS (маршрутизация — shop/db_router.py).
+  MySQL не поддерживается: корзина пишется через INSERT ... ON CONFLICT
+  ... RETURNING (shop/cart_items.py).
+"""
+import os
+
+#: PRAGMA на каждое новое соединение SQLite
+SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    # Отрицательное значение — в КиБ: 64 МБ кеша страниц на соединение
+    'cache_size': -64000,
+    'temp_store': 'MEMORY',
+}
+
+#: Дополнительно при SHOP_SQLITE_WAL=1
+SQLITE_WAL_PRAGMAS = {
+    'journal_mode': 'WAL',
+    # В режиме WAL fsync при каждом коммите не нужен для целостности, только при checkpoint
+    'synchronous': 'NORMAL',
+}
+
+
+def _env(name, default=None):
+    return os.environ.get(name, default)
+
+
+def sqlite(path, wal=False):
+    pragmas = {**SQLITE_WAL_PRAGMAS, **SQLITE_PRAGMAS} if wal else SQLITE_PRAGMAS
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in pragmas.items()),
+            # BEGIN IMMEDIATE: транзакция сразу берёт блокировку записи и ждёт её
+            # по busy_timeout, а не падает при попытке перейти от чтения к записи
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000,
+        },
+    }
+
+
+def server():
+    engine = _env('DB_ENGINE', 'django.db.backends.postgresql')
+    database = {
+        'ENGINE': engine,
+        'NAME': _env('DB_NAME', 'fishing_store'),
+        'USER': _env('DB_USER', ''),
+        'PASSWORD': _env('DB_PASSWORD', ''),
+        'HOST': _env('DB_HOST', 'localhost'),
+        'PORT': _env('DB_PORT', ''),
+        # Соединение живёт между запросами и проверяется перед повторным использованием
+        'CONN_MAX_AGE': int(_env('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
+    }
+    if engine.endswith('postgresql'):
+        database['OPTIONS']['connect_timeout'] = int(_env('DB_CONNECT_TIMEOUT', '5'))
+        if _env('DB_POOL', '0') == '1':
+            # Пул psycopg (pip install "psycopg[pool]"); с ним CONN_MAX_AGE должен быть 0
+            database['CONN_MAX_AGE'] = 0
+            database['OPTIONS']['pool'] = {
+                'min_size': int(_env('DB_POOL_MIN', '2')),
+                'max_size': int(_env('DB_POOL_MAX', '20')),
+                'timeout': int(_env('DB_POOL_TIMEOUT', '10')),
+            }
+    return database
+
+
+def replicas(primary):
+    """Реплики — копии основного соединения с другим хостом. Миграции на них не запускаются."""
+    hosts = [host.strip() for host in _env('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+    result = {}
+    for index, host in enumerate(hosts):
+        host, _, port = host.partition(':')
+        result[f'replica_{index}'] = {
+            **primary, 'HOST': host, 'PORT': port or primary['PORT'],
+            'OPTIONS': dict(primary['OPTIONS']),
+            'TEST': {'MIRROR': 'default'},
+        }
+    return result
+
+
+def build(base_dir):
+    """DATABASES для профиля SHOP_DB_PROFILE."""
+    profile = _env('SHOP_DB_PROFILE', 'sqlite')
+    if profile == 'sqlite':
+        return {'default': sqlite(_env('DB_NAME', base_dir / 'db.sqlite3'), wal=_env('SHOP_SQLITE_WAL', '0') == '1')}
+    if profile == 'server':
+        primary = server()
+        return {'default': primary, **replicas(primary)}
+    raise ValueError(f'Unknown SHOP_DB_PROFILE {profile!r}: use "sqlite" or "server"')
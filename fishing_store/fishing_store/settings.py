@@ -13,6 +13,8 @@ import os
 from pathlib import Path
 from datetime import timedelta
 
+from . import databases
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 # Добавьте следующие строки в settings.py
@@ -77,6 +79,8 @@ CORS_ALLOW_HEADERS = [
 CORS_ALLOW_CREDENTIALS = True
 
 MIDDLEWARE = [
+    'shop.metrics.MetricsMiddleware',
+    'shop.db_router.PinPrimaryMiddleware',
 	'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -85,6 +89,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'shop.tracing.SerializerTraceMiddleware',
 ]
 
 ROOT_URLCONF = 'fishing_store.urls'
@@ -111,12 +116,12 @@ WSGI_APPLICATION = 'fishing_store.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
-}
+# Профиль выбирается SHOP_DB_PROFILE: sqlite (по умолчанию; WAL — SHOP_SQLITE_WAL=1) или server
+# (PostgreSQL с постоянными соединениями или пулом и репликами) — см. databases.py
+DATABASES = databases.build(BASE_DIR)
+
+# Каталог читается с реплик (если они есть), корзина и заказы — с основной БД
+DATABASE_ROUTERS = ['shop.db_router.ReplicaRouter']
 
 
 # Password validation
@@ -150,6 +155,101 @@ USE_I18N = True
 USE_TZ = True
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+
+# Кеш ответов каталога (shop/response_cache.py). Для нескольких процессов
+# укажите в CACHES общий бэкенд (Redis/Memcached) и его алиас здесь
+SHOP_RESPONSE_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+}
+
+
+# Уменьшенные копии фото товаров (shop/images.py): строятся в пуле потоков
+# после сохранения товара; имена файлов зависят от содержимого
+SHOP_IMAGES = {
+    'ASYNC': True,
+    'WORKERS': 2,
+}
+
+# Трассировка сериализации (shop/tracing.py): для доли запросов SAMPLE_RATE
+# в лог 'shop.trace' пишется число объектов и время по каждому сериализатору
+SHOP_SERIALIZER_TRACE = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.01,
+}
+
+# Дерево категорий (shop/category_tree.py): при нескольких процессах укажите
+# общий кеш — иначе другие процессы видят изменения только через TIMEOUT секунд
+SHOP_CATEGORY_TREE = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 300,
+}
+
+# Метрики запросов (shop/metrics.py): гистограммы по представлениям на
+# /api/metrics/ (Prometheus) и лог медленных запросов 'shop.metrics'.
+# Метрики свои у каждого процесса — Prometheus должен опрашивать каждый
+SHOP_METRICS = {
+    'ENABLED': True,
+    'SLOW_REQUEST_MS': 500,
+    'SLOW_TOP_QUERIES': 5,
+    # Время сериализаторов в метриках: навсегда включает замеры @traced (shop/tracing.py)
+    'SERIALIZER_TIME': False,
+}
+
+# JWT без запроса пользователя на каждый запрос (shop/authentication.py):
+# данным из токена доверяем не дольше MAX_CLAIMS_AGE секунд, изменения
+# пользователя рассылаются через кеш CACHE_ALIAS (он должен быть общим)
+SHOP_JWT_AUTH = {
+    'CACHE_SIZE': 1024,
+    'MAX_CLAIMS_AGE': 300,
+    'CACHE_ALIAS': 'default',
+}
+
+# Async-представления для чтения каталога и корзины (shop/async_views.py).
+# asgi.py включает их по умолчанию; под WSGI они не нужны
+SHOP_ASYNC_VIEWS = os.environ.get('SHOP_ASYNC_VIEWS', '0') == '1'
+
+# Очередь фоновых задач в БД (shop/task_queue.py), воркер: manage.py run_tasks.
+# EAGER=True выполняет задачи сразу после коммита, без отдельного воркера
+SHOP_TASKS = {
+    'EAGER': os.environ.get('SHOP_TASKS_EAGER', '0') == '1',
+    'THREADS': 4,
+    'PROCESSES': 1,
+    'LEASE': 300,
+    'MAX_ATTEMPTS': 5,
+}
+
+# Остатки (shop/stock.py): товар в корзине бронируется на RESERVATION_TTL секунд.
+# Просроченные брони возвращает manage.py release_reservations
+SHOP_STOCK = {
+    'RESERVATION_TTL': 15 * 60,
+    'RESERVE_ON_ADD': True,
+}
+
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'shop@fishing-store.local')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'shop': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.1/howto/static-files/
 
@@ -163,6 +263,6 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'shop.authentication.StatelessJWTAuthentication',
     )
 }
@@ -1,6 +1,12 @@
+from django import forms
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import Brand, CustomUser, Product, Category, Cart, CartItem, Order
+from django.utils import timezone
+from .models import (
+    Brand, CustomUser, Product, Category, Cart, CartItem, Order, StockReservation, Task,
+    DailyBrandSales, DailyCategorySales, DailyProductSales, DailySales,
+)
+from . import stock
 
 # Регистрация кастомной модели пользователя
 class CustomUserAdmin(UserAdmin):
@@ -15,11 +21,57 @@ class CategoryAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'description', 'parent')
     search_fields = ('name',)
 
+class ProductAdminForm(forms.ModelForm):
+    # Версия товара на момент открытия формы: сохранение поверх чужих изменений (в том числе
+    # остатка после покупок) отклоняется, а не затирает их
+    expected_version = forms.IntegerField(widget=forms.HiddenInput, required=False)
+
+    class Meta:
+        model = Product
+        fields = '__all__'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['expected_version'].initial = self.instance.version
+        # В форме — физический остаток: свободные единицы плюс забронированные в корзинах
+        self.reserved = stock.reserved([self.instance.pk]).get(self.instance.pk, 0) if self.instance.pk else 0
+        if 'stock' in self.fields:
+            self.initial['stock'] = self.instance.stock + self.reserved
+            self.fields['stock'].help_text = f'На складе всего, включая {self.reserved} шт. в корзинах покупателей.'
+
+    def clean_stock(self):
+        value = self.cleaned_data['stock']
+        if value < self.reserved:
+            raise forms.ValidationError(f'Не меньше {self.reserved}: столько забронировано в корзинах.')
+        return value
+
+    def clean(self):
+        cleaned_data = super().clean()
+        expected = cleaned_data.get('expected_version')
+        if self.instance.pk and expected is not None:
+            current = Product.objects.filter(pk=self.instance.pk).values_list('version', flat=True).first()
+            if current != expected:
+                raise forms.ValidationError('Товар изменён с момента открытия формы (например, его купили). Откройте его заново.')
+        return cleaned_data
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('id','name', 'price', 'stock', 'available', 'category', 'created_at', 'updated_at')
+    form = ProductAdminForm
+    list_display = ('id', 'sku', 'name', 'price', 'stock', 'available', 'category', 'created_at', 'updated_at')
     list_filter = ('available', 'category')
-    search_fields = ('name', 'description')
+    search_fields = ('sku', 'name', 'description')
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            stock.lock_products([obj.pk])
+            expected = form.cleaned_data.get('expected_version')
+            stock.check_version(obj, obj.version if expected is None else expected)
+            # Брони с открытия формы могли только уйти в заказы — вычитаем текущие
+            obj.stock = max(obj.stock - stock.reserved([obj.pk]).get(obj.pk, 0), 0)
+        requested = obj.available if 'available' in form.changed_data or not change else None
+        obj.available, obj.sold_out = stock.availability(obj, obj.stock, requested)
+        super().save_model(request, obj, form, change)
 
 # Регистрация моделей Cart и CartItem
 @admin.register(Cart)
@@ -41,4 +93,71 @@ class BrandAdmin(admin.ModelAdmin):
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('user', 'address', 'status')
     search_fields = ('user',)
-    
\ No newline at end of file
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'max_attempts', 'run_at', 'created_at', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'idempotency_key')
+    readonly_fields = ('locked_by', 'locked_until', 'last_error', 'created_at', 'finished_at')
+    actions = ['requeue']
+
+    @admin.action(description='Поставить заново')
+    def requeue(self, request, queryset):
+        queryset.exclude(status=Task.RUNNING).update(status=Task.QUEUED, attempts=0, run_at=timezone.now())
+
+
+class SalesRollupAdmin(admin.ModelAdmin):
+    """Сводки только для чтения: их пересчитывает manage.py refresh_sales_rollups."""
+    date_hierarchy = 'day'
+    list_filter = ('status',)
+    ordering = ('-day', '-revenue')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(DailySales)
+class DailySalesAdmin(SalesRollupAdmin):
+    list_display = ('day', 'status', 'orders', 'quantity', 'revenue')
+
+
+@admin.register(DailyProductSales)
+class DailyProductSalesAdmin(SalesRollupAdmin):
+    list_display = ('day', 'product', 'status', 'orders', 'quantity', 'revenue')
+    list_select_related = ('product',)
+    search_fields = ('product__name', 'product__sku')
+
+
+@admin.register(DailyBrandSales)
+class DailyBrandSalesAdmin(SalesRollupAdmin):
+    list_display = ('day', 'brand', 'status', 'orders', 'quantity', 'revenue')
+    list_select_related = ('brand',)
+
+
+@admin.register(DailyCategorySales)
+class DailyCategorySalesAdmin(SalesRollupAdmin):
+    list_display = ('day', 'category', 'status', 'orders', 'quantity', 'revenue')
+    list_select_related = ('category',)
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'product', 'quantity', 'cart_item', 'expires_at')
+    raw_id_fields = ('product', 'cart_item')
+    actions = ['release']
+
+    def has_delete_permission(self, request, obj=None):
+        # Удаление брони без возврата единиц потеряло бы их со склада
+        return False
+
+    @admin.action(description='Вернуть на склад')
+    def release(self, request, queryset):
+        stock.release(queryset)
@@ -0,0 +1,282 @@
+import hashlib
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+import numpy as np
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .models import (
+    Brand, Category, DailyBrandSales, DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem, Product,
+)
+from . import response_cache, rollups
+
+PERIODS = ('day', 'week', 'month')
+STATUSES = [value for value, label in Order._meta.get_field('status').choices]
+NO_BRAND = -1
+#: Итоги прошедших периодов меняются только при правке старых заказов (тег 'order-history')
+CLOSED_TIMEOUT = 24 * 3600
+
+
+def _epoch_seconds(values):
+    return np.fromiter((value.timestamp() for value in values), dtype=np.float64, count=len(values)).astype(np.int64)
+
+
+def local_days(seconds):
+    """UTC-секунды -> локальные даты (datetime64[D]) текущего часового пояса.
+    Смещение считается для каждого уникального часа, а не для каждой строки."""
+    utc = seconds.astype('datetime64[s]')
+    hours, inverse = np.unique(utc.astype('datetime64[h]'), return_inverse=True)
+    zone = timezone.get_current_timezone()
+    offsets = np.array([
+        hour.astype(datetime).replace(tzinfo=dt_timezone.utc).astimezone(zone).utcoffset().total_seconds()
+        for hour in hours
+    ], dtype=np.int64)
+    return (utc + offsets[inverse].astype('timedelta64[s]')).astype('datetime64[D]')
+
+
+def truncate(days, period):
+    if period == 'day':
+        return days
+    if period == 'week':
+        # 1970-01-01 — четверг: сдвиг к понедельнику ISO-недели
+        return days - ((days.astype(np.int64) + 3) % 7).astype('timedelta64[D]')
+    return days.astype('datetime64[M]').astype('datetime64[D]')
+
+
+def load_columns(date_from, date_to, statuses=None):
+    """
+    Заказы и позиции за период в колоночном виде: по одному массиву numpy
+    на поле. Цена читается как float (без Decimal на строку) и переводится
+    в целые копейки; бренд и категория позиции берутся из справочника
+    товаров по индексу, без JOIN на каждую строку.
+    """
+    zone = timezone.get_current_timezone()
+    start = datetime.combine(date_from, time.min, tzinfo=zone)
+    end = datetime.combine(date_to + timedelta(days=1), time.min, tzinfo=zone)
+    orders = Order.objects.filter(created_at__gte=start, created_at__lt=end)
+    if statuses:
+        orders = orders.filter(status__in=statuses)
+
+    order_rows = list(orders.order_by('id').values_list('id', 'created_at', 'status'))
+    order_ids, created, status = zip(*order_rows) if order_rows else ((), (), ())
+    order_ids = np.array(order_ids, dtype=np.int64)
+    items = OrderItem.objects.filter(order__in=orders).annotate(price_float=Cast(F('price'), FloatField()))
+    item_rows = list(items.values_list('order_id', 'product_id', 'quantity', 'price_float'))
+    item_columns = np.array(item_rows, dtype=np.float64).reshape(-1, 4)
+
+    product_ids = item_columns[:, 1].astype(np.int64)
+    size = int(product_ids.max()) + 1 if len(product_ids) else 1
+    brand_of = np.full(size, NO_BRAND, dtype=np.int64)
+    category_of = np.zeros(size, dtype=np.int64)
+    for pk, brand, category in Product.objects.filter(pk__lt=size).values_list('id', 'brand_id', 'category_id'):
+        brand_of[pk] = NO_BRAND if brand is None else brand
+        category_of[pk] = category
+
+    return {
+        'order_id': order_ids,
+        'order_day': local_days(_epoch_seconds(created)) if len(created) else np.array([], dtype='datetime64[D]'),
+        'order_status': np.array([STATUSES.index(value) for value in status], dtype=np.int64),
+        'item_order': np.searchsorted(order_ids, item_columns[:, 0].astype(np.int64)),
+        'item_product': product_ids,
+        'item_brand': brand_of[product_ids],
+        'item_category': category_of[product_ids],
+        'item_quantity': item_columns[:, 2].astype(np.int64),
+        'item_revenue': item_columns[:, 2].astype(np.int64) * np.rint(item_columns[:, 3] * 100).astype(np.int64),
+    }
+
+
+def _groups(*columns):
+    """
+    Группы по сочетанию целочисленных колонок: колонки сводятся в один
+    int64-ключ, и дальше работает обычный np.unique. Возвращает индекс
+    первой строки каждой группы и номер группы для каждой строки.
+    """
+    combined = np.zeros(len(columns[0]), dtype=np.int64)
+    for column in columns:
+        column = column.astype(np.int64)
+        low = int(column.min()) if len(column) else 0
+        span = int(column.max()) - low + 1 if len(column) else 1
+        combined = combined * span + (column - low)
+    values, first, inverse = np.unique(combined, return_index=True, return_inverse=True)
+    return first, inverse
+
+
+def _bincount(inverse, weights, size):
+    return np.rint(np.bincount(inverse, weights=weights, minlength=size)).astype(np.int64)
+
+
+def facts_from_columns(columns):
+    """
+    Позиции заказов -> факты: суммы по (день, статус, ключ) для итогов,
+    товаров, брендов и категорий — в той же форме, что и сводные таблицы
+    (shop/rollups.py). Заказ относится к одному дню и статусу, поэтому число
+    заказов по дням можно потом складывать.
+    """
+    item_order = columns['item_order']
+    day = columns['order_day'].astype(np.int64)[item_order]
+    status = columns['order_status'][item_order]
+    quantity, revenue = columns['item_quantity'], columns['item_revenue']
+    base = int(item_order.max()) + 1 if len(item_order) else 1
+    facts = {}
+    for name, key in (
+        ('total', np.zeros(len(item_order), dtype=np.int64)), ('product', columns['item_product']),
+        ('brand', columns['item_brand']), ('category', columns['item_category']),
+    ):
+        first, inverse = _groups(day, status, key)
+        size = len(first)
+        # Разные заказы в группе: уникальные пары (группа, заказ)
+        pairs = np.unique(inverse.astype(np.int64) * base + item_order) // base
+        facts[name] = {
+            'day': day[first], 'status': status[first], 'key': key[first].astype(np.int64),
+            'quantity': _bincount(inverse, quantity, size), 'revenue': _bincount(inverse, revenue, size),
+            'orders': np.bincount(pairs, minlength=size).astype(np.int64),
+        }
+    return facts
+
+
+def facts_from_rollups(date_from, date_to, statuses=None):
+    """Те же факты, но из сводных таблиц за [date_from, date_to]."""
+    facts = {}
+    for name, model, field in (
+        ('total', DailySales, None), ('product', DailyProductSales, 'product_id'),
+        ('brand', DailyBrandSales, 'brand_id'), ('category', DailyCategorySales, 'category_id'),
+    ):
+        rows = model.objects.filter(day__gte=date_from, day__lte=date_to)
+        if statuses:
+            rows = rows.filter(status__in=statuses)
+        rows = list(rows.annotate(revenue_float=Cast(F('revenue'), FloatField())).values_list(
+            'day', 'status', 'quantity', 'revenue_float', 'orders', *([field] if field else []),
+        ))
+        days, status, quantity, revenue, orders, *keys = zip(*rows) if rows else ((),) * (5 + bool(field))
+        facts[name] = {
+            'day': np.array(days, dtype='datetime64[D]').astype(np.int64),
+            'status': np.array([STATUSES.index(value) for value in status], dtype=np.int64),
+            'key': np.array([NO_BRAND if key is None else key for key in keys[0]] if keys else [0] * len(rows), dtype=np.int64),
+            'quantity': np.array(quantity, dtype=np.int64),
+            'revenue': np.rint(np.array(revenue, dtype=np.float64) * 100).astype(np.int64),
+            'orders': np.array(orders, dtype=np.int64),
+        }
+    return facts
+
+
+def merge_facts(parts):
+    return {
+        name: {column: np.concatenate([part[name][column] for part in parts]) for column in parts[0][name]}
+        for name in parts[0]
+    }
+
+
+def _sum(keys, facts):
+    values, inverse = np.unique(keys, return_inverse=True)
+    size = len(values)
+    return {
+        'key': values,
+        'revenue': _bincount(inverse, facts['revenue'], size),
+        'units': _bincount(inverse, facts['quantity'], size),
+        'orders': _bincount(inverse, facts['orders'], size),
+    }
+
+
+def _rows(group, top=None, key='id', label=int):
+    order = np.argsort(-group['revenue'], kind='stable') if top else np.arange(len(group['key']))
+    return [
+        {
+            key: label(group['key'][index]), 'revenue': int(group['revenue'][index]),
+            'units': int(group['units'][index]), 'orders': int(group['orders'][index]),
+        }
+        for index in (order[:top] if top else order)
+    ]
+
+
+def summarize(facts, period='day', top=10):
+    """Выручка (в копейках), штуки и число заказов по периодам, товарам, брендам, категориям и статусам."""
+    total = facts['total']
+    periods = truncate(total['day'].astype('datetime64[D]'), period)
+    return {
+        'totals': {
+            'revenue': int(total['revenue'].sum()), 'units': int(total['quantity'].sum()),
+            'orders': int(total['orders'].sum()),
+        },
+        'timeline': _rows(_sum(periods, total), key='period', label=str),
+        'products': _rows(_sum(facts['product']['key'], facts['product']), top),
+        'brands': _rows(_sum(facts['brand']['key'], facts['brand']), top),
+        'categories': _rows(_sum(facts['category']['key'], facts['category']), top),
+        'statuses': _rows(_sum(total['status'], total), key='status', label=lambda index: STATUSES[index]),
+    }
+
+
+def aggregate(columns, period='day', top=10):
+    return summarize(facts_from_columns(columns), period, top)
+
+
+def load_facts(date_from, date_to, statuses=None):
+    """
+    Факты за период: дни, уже посчитанные в сводных таблицах, читаются из
+    них, а остаток (обычно последние день-два) — из позиций заказов.
+    """
+    parts = []
+    until = rollups.covered_until()
+    if until is not None and date_from < until:
+        parts.append(facts_from_rollups(date_from, min(date_to, until - timedelta(days=1)), statuses))
+        date_from = until
+    if date_from <= date_to:
+        parts.append(facts_from_columns(load_columns(date_from, date_to, statuses)))
+    return merge_facts(parts)
+
+
+def _money(cents):
+    return str(Decimal(cents).scaleb(-2).quantize(Decimal('0.01')))
+
+
+def _present(rows, names=None):
+    for row in rows:
+        if names is not None:
+            row['name'] = names.get(row['id'])
+        else:
+            # Средний чек — для периодов и статусов; для товара он не имеет смысла
+            row['average_basket'] = _money(row['revenue'] // row['orders']) if row['orders'] else None
+        row['revenue'] = _money(row['revenue'])
+    return rows
+
+
+def _cache_key(date_from, date_to, period, statuses, top):
+    generation, = response_cache.get_generations(['order-history'])
+    parts = [str(date_from), str(date_to), period, ','.join(sorted(statuses or ())), str(top), generation]
+    return 'shop:analytics:' + hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+
+def order_analytics(date_from, date_to, period='day', statuses=None, top=10):
+    """
+    Аналитика заказов за [date_from, date_to]. Если период целиком в
+    прошлом, числа кешируются: новые заказы в него уже не попадут, а правка
+    старых заказов сбрасывает кеш (тег 'order-history'). Названия товаров,
+    брендов и категорий подставляются при каждом ответе.
+    """
+    closed = date_to < timezone.localdate()
+    key = _cache_key(date_from, date_to, period, statuses, top) if closed else None
+    result = response_cache.get_cache().get(key) if closed else None
+    if result is None:
+        result = summarize(load_facts(date_from, date_to, statuses), period, top)
+        if closed:
+            response_cache.get_cache().set(key, result, CLOSED_TIMEOUT)
+
+    def names(model, rows, extra=None):
+        found = dict(model.objects.filter(pk__in=[row['id'] for row in rows]).values_list('id', 'name'))
+        return {**found, **(extra or {})}
+
+    totals = dict(result['totals'])
+    totals['average_basket'] = _money(totals['revenue'] // totals['orders']) if totals['orders'] else None
+    totals['revenue'] = _money(totals['revenue'])
+    return {
+        'date_from': str(date_from),
+        'date_to': str(date_to),
+        'period': period,
+        'totals': totals,
+        'timeline': _present([dict(row) for row in result['timeline']]),
+        'products': _present([dict(row) for row in result['products']], names(Product, result['products'])),
+        'brands': _present([dict(row) for row in result['brands']], names(Brand, result['brands'], {NO_BRAND: None})),
+        'categories': _present([dict(row) for row in result['categories']], names(Category, result['categories'])),
+        'statuses': _present([dict(row) for row in result['statuses']]),
+    }
@@ -0,0 +1,184 @@
+from functools import update_wrapper
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from rest_framework import exceptions
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .pagination import apaginate_queryset
+
+
+async def aget_jwt_user(authenticator, validated_token):
+    """JWTAuthentication.get_user через async ORM (те же проверки и ошибки)."""
+    try:
+        user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+    except KeyError:
+        raise InvalidToken('Token contained no recognizable user identification')
+
+    model = authenticator.user_model
+    try:
+        user = await model.objects.aget(**{jwt_settings.USER_ID_FIELD: user_id})
+    except model.DoesNotExist:
+        raise AuthenticationFailed('User not found', code='user_not_found')
+
+    if not user.is_active:
+        raise AuthenticationFailed('User is inactive', code='user_inactive')
+    if jwt_settings.CHECK_REVOKE_TOKEN and (
+        validated_token.get(jwt_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password)
+    ):
+        raise AuthenticationFailed("The user's password has been changed.", code='password_changed')
+    return user
+
+
+async def aauthenticate(authenticator, request):
+    if hasattr(authenticator, 'aauthenticate'):
+        return await authenticator.aauthenticate(request)
+    if isinstance(authenticator, JWTAuthentication):
+        # Разбор и проверка подписи токена не ходят в БД — только загрузка пользователя
+        header = authenticator.get_header(request)
+        if header is None:
+            return None
+        raw_token = authenticator.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = authenticator.get_validated_token(raw_token)
+        return await aget_jwt_user(authenticator, validated_token), validated_token
+    return await sync_to_async(authenticator.authenticate)(request)
+
+
+class AsyncReadMixin:
+    """
+    Async-версии list/retrieve для ViewSet'ов: выборка страницы, COUNT и
+    загрузка объекта идут через async ORM, а аутентификация по JWT — без
+    перехода в поток. Фильтры (django-filter, поиск, дерево категорий)
+    остаются синхронными и выполняются через sync_to_async.
+
+    Подключается в маршрутах через async_viewset_view (см. shop/urls.py);
+    остальные действия и обычный WSGI-путь работают как раньше.
+    """
+
+    async def adispatch(self, request, *args, **kwargs):
+        # Повторяет APIView.dispatch, но пользователь определяется до initial()
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.aperform_authentication(request)
+            self.initial(request, *args, **kwargs)
+            handler = getattr(self, f'a{self.action}')
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def aperform_authentication(self, request):
+        for authenticator in request.authenticators:
+            try:
+                user_auth_tuple = await aauthenticate(authenticator, request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+        request._not_authenticated()
+
+    async def afilter_queryset(self):
+        return await sync_to_async(self.filter_queryset)(self.get_queryset())
+
+    async def aget_object(self):
+        queryset = await self.afilter_queryset()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        return await apaginate_queryset(self.paginator, queryset, self.request, view=self)
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.acached_response(request, self.alist_response, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.acached_response(request, self.aretrieve_response, *args, **kwargs)
+
+    async def acached_response(self, request, handler, *args, **kwargs):
+        if hasattr(self, 'aget_cached_response'):  # CachedResponseMixin
+            return await self.aget_cached_response(request, handler, *args, **kwargs)
+        return await handler(request, *args, **kwargs)
+
+    async def alist_response(self, request, *args, **kwargs):
+        queryset = await self.afilter_queryset()
+        compiled = self.get_compiled_serializer() if hasattr(self, 'get_compiled_serializer') else None
+        if compiled is not None:
+            queryset = compiled.values(queryset)
+
+        page = await self.apaginate_queryset(queryset)
+        objects = page if page is not None else [obj async for obj in queryset]
+        if compiled is not None:
+            data = await compiled.aserialize(objects, request)
+        else:
+            data = self.get_serializer(objects, many=True).data
+
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    async def aretrieve_response(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        return Response(self.get_serializer(instance).data)
+
+
+def async_viewset_view(callback):
+    """
+    Оборачивает view из роутера DRF: GET/HEAD-запросы к действиям, у которых
+    есть async-версия (list -> alist), обрабатываются корутиной, остальные —
+    исходным синхронным view через sync_to_async.
+    """
+    cls = getattr(callback, 'cls', None)
+    actions = getattr(callback, 'actions', None)
+    if not actions or not issubclass(cls, AsyncReadMixin):
+        return callback
+    if not any(hasattr(cls, f'a{action}') for method, action in actions.items() if method in ('get', 'head')):
+        return callback
+
+    sync_view = sync_to_async(callback)
+
+    async def view(request, *args, **kwargs):
+        method = request.method.lower()
+        action = actions.get(method) or (actions.get('get') if method == 'head' else None)
+        if action is None or not hasattr(cls, f'a{action}'):
+            return await sync_view(request, *args, **kwargs)
+
+        # Как в ViewSetMixin.as_view
+        self = cls(**callback.initkwargs)
+        self.action_map = dict(actions)
+        if 'get' in actions and 'head' not in actions:
+            self.action_map['head'] = actions['get']
+        for http_method, name in self.action_map.items():
+            setattr(self, http_method, getattr(self, name))
+        self.request = request
+        return await self.adispatch(request, *args, **kwargs)
+
+    update_wrapper(view, callback, assigned=('__module__', '__name__', '__qualname__', '__doc__'), updated=())
+    view.cls = cls
+    view.initkwargs = callback.initkwargs
+    view.actions = actions
+    view.csrf_exempt = True
+    return view
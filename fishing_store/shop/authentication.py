@@ -0,0 +1,167 @@
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .async_views import aget_jwt_user
+
+DEFAULTS = {
+    # Сколько проверенных токенов держать в памяти процесса
+    'CACHE_SIZE': 1024,
+    # Сколько секунд доверять данным пользователя из claims (или из последней
+    # проверки в БД), прежде чем перечитать его из БД
+    'MAX_CLAIMS_AGE': 300,
+    # Кеш, через который процессы узнают об изменении пользователя
+    'CACHE_ALIAS': 'default',
+}
+
+#: Claim с моментом, на который username/email/is_staff в токене актуальны.
+#: Access-токен, выпущенный по refresh, копирует его из refresh-токена
+CLAIMS_AT = 'claims_at'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SHOP_JWT_AUTH', {})}
+
+
+def _revoked_key(user_id):
+    return f'shop:auth:revoked:{user_id}'
+
+
+def revoke_user(user_id):
+    """
+    Помечает закешированные данные пользователя устаревшими: следующий
+    запрос с любым его токеном перечитает пользователя из БД.
+    """
+    config = get_config()
+    # Хранить дольше MAX_CLAIMS_AGE незачем — такие данные и так перечитываются
+    caches[config['CACHE_ALIAS']].set(_revoked_key(user_id), time(), config['MAX_CLAIMS_AGE'] + 60)
+
+
+class ClaimsUser(TokenUser):
+    """Пользователь без обращения к БД: id, username, email, is_staff из claims."""
+
+    @classmethod
+    def from_user(cls, user):
+        return cls({
+            jwt_settings.USER_ID_CLAIM: getattr(user, jwt_settings.USER_ID_FIELD),
+            'username': user.get_username(),
+            'email': user.email,
+            'is_staff': user.is_staff,
+            'is_superuser': user.is_superuser,
+        })
+
+
+class _Entry:
+    __slots__ = ('token', 'user', 'checked_at', 'expires_at')
+
+    def __init__(self, token, user, checked_at):
+        self.token = token
+        self.user = user
+        self.checked_at = checked_at
+        self.expires_at = token['exp']
+
+
+class TokenCache:
+    """Потокобезопасный LRU: сырой токен -> проверенный токен и пользователь."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWT-аутентификация без запроса пользователя на каждый запрос.
+
+    Проверка подписи кешируется в LRU по сырому токену до его exp. Пользователь
+    собирается из claims (ClaimsUser), которые кладёт CustomTokenObtainPairSerializer;
+    им доверяем не дольше MAX_CLAIMS_AGE с момента claims_at, дальше пользователь
+    перечитывается из БД и снова кешируется на MAX_CLAIMS_AGE. Сохранение или
+    удаление пользователя (shop/signals.py) сразу отзывает кеш через общий
+    Django-кеш, поэтому снятый is_staff или блокировка действуют со следующего
+    запроса. Токены без claims_at всегда идут через БД, как в JWTAuthentication.
+    """
+    token_cache = TokenCache(get_config()['CACHE_SIZE'])
+
+    def authenticate(self, request):
+        raw_token = self.get_request_token(request)
+        if raw_token is None:
+            return None
+        entry, now = self.get_entry(raw_token)
+        revoked_at = caches[get_config()['CACHE_ALIAS']].get(_revoked_key(entry.user.id))
+        if self.is_stale(entry, revoked_at, now):
+            self.refresh(entry, self.get_user(entry.token), now)
+        return entry.user, entry.token
+
+    async def aauthenticate(self, request):
+        raw_token = self.get_request_token(request)
+        if raw_token is None:
+            return None
+        entry, now = self.get_entry(raw_token)
+        revoked_at = await caches[get_config()['CACHE_ALIAS']].aget(_revoked_key(entry.user.id))
+        if self.is_stale(entry, revoked_at, now):
+            self.refresh(entry, await aget_jwt_user(self, entry.token), now)
+        return entry.user, entry.token
+
+    def get_request_token(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        return self.get_raw_token(header)
+
+    def get_entry(self, raw_token):
+        now = time()
+        entry = self.token_cache.get(raw_token)
+        if entry is not None and entry.expires_at <= now:
+            self.token_cache.pop(raw_token)
+            entry = None
+        if entry is None:
+            # Истёкший или поддельный токен даст InvalidToken здесь
+            token = self.get_validated_token(raw_token)
+            if jwt_settings.USER_ID_CLAIM not in token:
+                raise AuthenticationFailed('Token contained no recognizable user identification')
+            # Без claims_at данным из токена не доверяем: checked_at = 0 — сразу в БД
+            entry = _Entry(token, ClaimsUser(token), token.get(CLAIMS_AT, 0))
+            self.token_cache.set(raw_token, entry)
+        return entry, now
+
+    @staticmethod
+    def is_stale(entry, revoked_at, now):
+        if revoked_at is not None and revoked_at >= entry.checked_at:
+            return True
+        return now - entry.checked_at > get_config()['MAX_CLAIMS_AGE']
+
+    @staticmethod
+    def refresh(entry, user, now):
+        entry.user = ClaimsUser.from_user(user)
+        entry.checked_at = now
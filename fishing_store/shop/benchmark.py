@@ -0,0 +1,264 @@
+import random
+from decimal import Decimal
+from statistics import mean, quantiles
+from time import perf_counter
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import Client
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import Brand, Cart, CartItem, Category, CustomUser, Order, OrderItem, Product
+from .cart_items import upsert_cart_items
+from .category_tree import invalidate_category_tree
+from .search import get_search_backend
+from . import cart_totals
+
+STATUSES = [value for value, label in Order._meta.get_field('status').choices]
+
+#: Размеры синтетического каталога. tiny — для тестов и быстрой проверки
+SCALES = {
+    'tiny': {'categories': 6, 'brands': 3, 'products': 60, 'users': 4, 'orders': 20},
+    'small': {'categories': 30, 'brands': 15, 'products': 2000, 'users': 50, 'orders': 1000},
+    'medium': {'categories': 120, 'brands': 60, 'products': 20_000, 'users': 500, 'orders': 10_000},
+    'large': {'categories': 400, 'brands': 200, 'products': 100_000, 'users': 5000, 'orders': 100_000},
+}
+
+KINDS = ['Спиннинг', 'Катушка', 'Воблер', 'Леска', 'Блесна', 'Крючок', 'Фидер', 'Поплавок', 'Садок', 'Эхолот']
+WORDS = ['карповый', 'морской', 'зимний', 'ультралёгкий', 'плетёный', 'тонущий', 'плавающий', 'телескопический']
+#: Запросы поиска: виды товаров и слова из названий, в том числе префиксные
+SEARCH_TERMS = ['спиннинг', 'катушка', 'воблер плавающий', 'леска', 'зимний', 'блес', 'фидер карповый']
+
+
+class Dataset:
+    """Что создал generate(): id для сценариев, без загрузки объектов."""
+
+    def __init__(self, category_ids, brand_ids, product_ids, user_ids):
+        self.category_ids = category_ids
+        self.brand_ids = brand_ids
+        self.product_ids = product_ids
+        self.user_ids = user_ids
+
+
+def generate(scale='small', seed=0):
+    """
+    Синтетический магазин заданного размера: дерево категорий, бренды,
+    товары с правдоподобными названиями, покупатели с корзинами и история
+    заказов. Пишется bulk_create'ами, поэтому поисковый индекс, кеш дерева
+    категорий и итоги корзин обновляются явно. Один seed — одни и те же данные.
+    """
+    size = SCALES[scale]
+    rng = random.Random(seed)
+
+    categories = []
+    for i in range(size['categories']):
+        # Первая пятая часть — корни, остальные — подкатегории уже созданных
+        parent = rng.choice(categories) if i >= max(1, size['categories'] // 5) else None
+        categories.append(Category.objects.create(name=f'Категория {i}', parent=parent))
+    invalidate_category_tree()
+    brands = Brand.objects.bulk_create(Brand(name=f'Бренд {i}') for i in range(size['brands']))
+
+    products = Product.objects.bulk_create(
+        (
+            Product(
+                category=rng.choice(categories), brand=rng.choice(brands), sku=f'bench-{seed}-{i}',
+                name=f'{rng.choice(KINDS)} {rng.choice(WORDS)} {i}',
+                description=f'{rng.choice(WORDS).capitalize()} {rng.choice(KINDS).lower()} для рыбалки. ' * 4,
+                # Остатков с запасом: оформление заказов в сценариях не должно упираться в склад
+                price=Decimal(rng.randint(100, 50_000)), stock=1_000_000,
+            )
+            for i in range(size['products'])
+        ),
+        batch_size=2000,
+    )
+    get_search_backend().index(products)
+
+    password = make_password('bench')  # Хеш один на всех: PBKDF2 на каждого — секунды
+    users = CustomUser.objects.bulk_create(
+        CustomUser(username=f'bench-{seed}-{i}', email=f'bench{i}@example.com', password=password)
+        for i in range(size['users'])
+    )
+    carts = Cart.objects.bulk_create(Cart(user=user) for user in users)
+    CartItem.objects.bulk_create(
+        CartItem(cart=cart, product=product, quantity=rng.randint(1, 3))
+        for cart in carts for product in rng.sample(products, min(3, len(products)))
+    )
+    cart_totals.recalculate(Cart.objects.filter(pk__in=[cart.pk for cart in carts]))
+
+    orders = Order.objects.bulk_create(
+        (
+            Order(user=rng.choice(users), address='Москва', personal_info={'name': 'Bench'}, status=rng.choice(STATUSES))
+            for _ in range(size['orders'])
+        ),
+        batch_size=2000,
+    )
+    OrderItem.objects.bulk_create(
+        (
+            OrderItem(order=order, product=product, quantity=rng.randint(1, 3), price=product.price)
+            for order in orders for product in rng.sample(products, min(rng.randint(1, 4), len(products)))
+        ),
+        batch_size=2000,
+    )
+    return Dataset(
+        [category.pk for category in categories], [brand.pk for brand in brands],
+        [product.pk for product in products], [user.pk for user in users],
+    )
+
+
+class QueryCounter:
+    """execute_wrapper, который только считает запросы (без DEBUG и сохранения SQL)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Scenario:
+    """
+    Сценарий — одно действие покупателя, то есть один HTTP-запрос. prepare()
+    готовит состояние вне замера (например, наполняет корзину перед оформлением).
+    """
+    name = None
+    authenticated = False
+
+    def __init__(self, dataset, rng):
+        self.dataset = dataset
+        self.rng = rng
+
+    def prepare(self, user_id):
+        pass
+
+    def request(self, client, headers):
+        raise NotImplementedError
+
+
+class Browse(Scenario):
+    name = 'browse'
+
+    def request(self, client, headers):
+        pages = max(1, len(self.dataset.product_ids) // 24)
+        return client.get(f'/api/products/?page={self.rng.randint(1, min(pages, 20))}&page_size=24', headers=headers)
+
+
+class Detail(Scenario):
+    name = 'detail'
+
+    def request(self, client, headers):
+        return client.get(f'/api/products/{self.rng.choice(self.dataset.product_ids)}/', headers=headers)
+
+
+class Search(Scenario):
+    name = 'search'
+
+    def request(self, client, headers):
+        return client.get('/api/products/', {'search': self.rng.choice(SEARCH_TERMS)}, headers=headers)
+
+
+class Filter(Scenario):
+    name = 'filter'
+
+    def request(self, client, headers):
+        params = {
+            'category': self.rng.choice(self.dataset.category_ids),
+            'brands': ','.join(map(str, self.rng.sample(self.dataset.brand_ids, min(2, len(self.dataset.brand_ids))))),
+            'price_min': 500, 'price_max': 30_000, 'ordering': '-price',
+        }
+        return client.get('/api/products/', params, headers=headers)
+
+
+class AddToCart(Scenario):
+    name = 'add_to_cart'
+    authenticated = True
+
+    def request(self, client, headers):
+        data = {'product_id': self.rng.choice(self.dataset.product_ids), 'quantity': 1}
+        return client.post('/api/cart-items/', data, content_type='application/json', headers=headers)
+
+
+class Checkout(Scenario):
+    name = 'checkout'
+    authenticated = True
+
+    def prepare(self, user_id):
+        user = CustomUser(pk=user_id)
+        upsert_cart_items(user, {pk: 1 for pk in self.rng.sample(self.dataset.product_ids, 3)})
+
+    def request(self, client, headers):
+        data = {'address': 'Москва, ул. Рыбацкая, 1', 'personal_info': {'name': 'Bench', 'phone': '+70000000000'}}
+        return client.post('/api/orders/', data, content_type='application/json', headers=headers)
+
+
+SCENARIOS = {scenario.name: scenario for scenario in (Browse, Detail, Search, Filter, AddToCart, Checkout)}
+
+
+def percentile(sorted_values, value):
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    return quantiles(sorted_values, n=100, method='inclusive')[value - 1]
+
+
+def run_scenario(scenario_class, dataset, iterations, warmup=5, seed=0):
+    """
+    Прогоняет сценарий warmup + iterations раз и возвращает перцентили
+    задержки (мс), среднее и максимальное число SQL-запросов и
+    пропускную способность одного клиента (операций в секунду).
+    """
+    rng = random.Random(f'{seed}:{scenario_class.name}')
+    scenario = scenario_class(dataset, rng)
+    client = Client()
+    latencies, queries = [], []
+    for i in range(warmup + iterations):
+        headers = {}
+        if scenario.authenticated:
+            user_id = dataset.user_ids[i % len(dataset.user_ids)]
+            headers['Authorization'] = f'Bearer {AccessToken.for_user(CustomUser(pk=user_id))}'
+            scenario.prepare(user_id)
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            start = perf_counter()
+            response = scenario.request(client, headers)
+            elapsed = perf_counter() - start
+        if response.status_code >= 400:
+            raise RuntimeError(f'{scenario.name}: HTTP {response.status_code} {response.content[:300]!r}')
+        if i >= warmup:
+            latencies.append(elapsed * 1000)
+            queries.append(counter.count)
+
+    latencies.sort()
+    return {
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p90_ms': round(percentile(latencies, 90), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'queries': round(mean(queries), 2),
+        'max_queries': max(queries),
+        'ops_per_second': round(len(latencies) / (sum(latencies) / 1000), 1),
+    }
+
+
+def query_counts(results):
+    """Только число запросов: не зависит от машины, поэтому годится для базовой линии в репозитории."""
+    return {name: {'queries': result['queries'], 'max_queries': result['max_queries']} for name, result in results.items()}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Регрессии относительно базовой линии: больше SQL-запросов, чем было
+    (их число детерминировано, допуск не нужен), или p90 дольше базового
+    больше чем в (1 + tolerance) раз. Сравнивается то, что есть в базовой
+    линии; сценарии без неё пропускаются.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if 'queries' in base and result['queries'] > base['queries']:
+            regressions.append(f'{name}: {result["queries"]} queries per request, baseline {base["queries"]}')
+        if 'p90_ms' in base and result['p90_ms'] > base['p90_ms'] * (1 + tolerance):
+            regressions.append(
+                f'{name}: p90 {result["p90_ms"]:.1f} ms, baseline {base["p90_ms"]:.1f} ms (+{tolerance:.0%} allowed)'
+            )
+    return regressions
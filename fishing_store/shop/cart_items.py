@@ -0,0 +1,80 @@
+from collections import Counter
+
+from django.db import connection, transaction
+from rest_framework.exceptions import ValidationError
+
+from .models import Cart, CartItem, Product
+from . import cart_totals, stock
+
+ADD, SET = 'add', 'set'
+
+
+def _upsert_sql(rows, mode):
+    table = connection.ops.quote_name(CartItem._meta.db_table)
+    quantity = f'{table}.quantity + excluded.quantity' if mode == ADD else 'excluded.quantity'
+    # INSERT ... SELECT ... WHERE — WHERE обязателен: без него SQLite путает ON CONFLICT с JOIN
+    return (
+        f'INSERT INTO {table} (cart_id, product_id, quantity) '
+        f'SELECT cart.id, line.column1, line.column2 '
+        f'FROM {connection.ops.quote_name(Cart._meta.db_table)} cart, '
+        f'(VALUES {", ".join(["(%s, %s)"] * rows)}) line '
+        f'WHERE cart.user_id = %s '
+        f'ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {quantity} '
+        f'RETURNING id, cart_id, product_id, quantity'
+    )
+
+
+def upsert_cart_items(user, quantities, mode=ADD):
+    """
+    Добавляет товары в корзину пользователя одним INSERT ... ON CONFLICT:
+    в режиме ADD количество прибавляется к уже лежащему в корзине, в режиме
+    SET — заменяет его. Корзина находится в том же запросе по user_id и
+    создаётся, только если её ещё нет. Количество сверх
+    CartItem.MAX_QUANTITY (в том числе сумма при ADD) — 400 и откат. Итоги
+    корзины меняются на разницу (shop/cart_totals.py), бронь остатка
+    доводится до нового количества (shop/stock.py). Возвращает id
+    затронутых позиций.
+    """
+    prices = dict(Product.objects.filter(pk__in=quantities).values_list('pk', 'price'))
+    missing = set(quantities) - set(prices)
+    if missing:
+        raise ValidationError({'product_id': [f'Invalid pk "{pk}" - object does not exist.' for pk in sorted(missing)]})
+
+    params = [value for pk, quantity in quantities.items() for value in (pk, quantity)]
+    sql = _upsert_sql(len(quantities), mode)
+    with transaction.atomic():
+        old = {}
+        if mode == SET:
+            # Прежние количества нужны для разницы итогов: корзина блокируется, как при оформлении заказа
+            cart_id = Cart.objects.select_for_update().filter(user_id=user.pk).values_list('pk', flat=True).first()
+            if cart_id is not None:
+                old = dict(CartItem.objects.filter(cart_id=cart_id, product_id__in=quantities).values_list('product_id', 'quantity'))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [*params, user.pk])
+            rows = cursor.fetchall()
+            if not rows:
+                Cart.objects.get_or_create(user_id=user.pk)
+                cursor.execute(sql, [*params, user.pk])
+                rows = cursor.fetchall()
+        if any(quantity > CartItem.MAX_QUANTITY for pk, cart_id, product_id, quantity in rows):
+            raise ValidationError({'quantity': [f'Ensure this value is less than or equal to {CartItem.MAX_QUANTITY}.']})
+        new = {product_id: quantity for pk, cart_id, product_id, quantity in rows}
+        if mode == ADD:
+            # Добавка известна и без чтения: было на неё меньше (0 — позиция новая)
+            old = {product_id: quantity - quantities[product_id] for product_id, quantity in new.items()}
+        cart_totals.items_upserted(rows[0][1], old, new, prices)
+        ids = [pk for pk, cart_id, product_id, quantity in rows]
+        stock.reserve(ids)
+    return ids
+
+
+def merge_lines(lines, mode=ADD):
+    """Строки запроса -> {product_id: quantity}; повторы товара складываются (ADD) или последняя побеждает (SET)."""
+    quantities = Counter() if mode == ADD else {}
+    for line in lines:
+        pk = line['product_id'].pk if isinstance(line['product_id'], Product) else line['product_id']
+        if mode == ADD:
+            quantities[pk] += line['quantity']
+        else:
+            quantities[pk] = line['quantity']
+    return dict(quantities)
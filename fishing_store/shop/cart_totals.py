@@ -0,0 +1,102 @@
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Cart, CartItem
+
+ZERO = Decimal('0.00')
+MONEY = DecimalField(max_digits=20, decimal_places=2)
+
+
+def _apply(cart_id, items=0, quantity=0, subtotal=ZERO):
+    # Одним UPDATE с F(): параллельные изменения одной корзины не теряются
+    Cart.objects.filter(pk=cart_id).update(
+        item_count=F('item_count') + items,
+        quantity_total=F('quantity_total') + quantity,
+        subtotal=ExpressionWrapper(F('subtotal') + subtotal, output_field=MONEY),
+    )
+
+
+def item_added(item):
+    _apply(item.cart_id, 1, item.quantity, item.quantity * item.product.price)
+
+
+def item_removed(item):
+    _apply(item.cart_id, -1, -item.quantity, -item.quantity * item.product.price)
+
+
+def item_changed(item, old_quantity, old_price):
+    """Позиция изменилась: old_price — цена прежнего товара (product_id мог смениться)."""
+    _apply(
+        item.cart_id,
+        quantity=item.quantity - old_quantity,
+        subtotal=item.quantity * item.product.price - old_quantity * old_price,
+    )
+
+
+def items_upserted(cart_id, old, new, prices):
+    """
+    Пачка позиций добавлена или изменена (shop/cart_items.py): old и new —
+    {product_id: количество} до и после, 0 или нет ключа — позиции не было.
+    """
+    _apply(
+        cart_id,
+        items=sum(1 for product_id in new if not old.get(product_id)),
+        quantity=sum(new[product_id] - old.get(product_id, 0) for product_id in new),
+        subtotal=sum(((new[product_id] - old.get(product_id, 0)) * prices[product_id] for product_id in new), ZERO),
+    )
+
+
+def items_removed(items):
+    """Удаление нескольких позиций (например, при оформлении заказа)."""
+    by_cart = {}
+    for item in items:
+        count, quantity, subtotal = by_cart.get(item.cart_id, (0, 0, ZERO))
+        by_cart[item.cart_id] = (count - 1, quantity - item.quantity, subtotal - item.quantity * item.product.price)
+    for cart_id, delta in by_cart.items():
+        _apply(cart_id, *delta)
+
+
+def _product_lines(product_id, *aggregates):
+    lines = CartItem.objects.filter(cart=OuterRef('pk'), product_id=product_id).values('cart')
+    return [Subquery(lines.annotate(value=aggregate).values('value')) for aggregate in aggregates]
+
+
+def product_price_changed(product_id, old_price, new_price):
+    """
+    Новая цена товара во всех корзинах, где он лежит, — одним UPDATE
+    с подзапросом количества, без загрузки корзин в память.
+    """
+    if old_price == new_price:
+        return
+    quantity, = _product_lines(product_id, Sum('quantity'))
+    Cart.objects.filter(items__product_id=product_id).update(
+        subtotal=ExpressionWrapper(F('subtotal') + quantity * Value(new_price - old_price), output_field=MONEY),
+    )
+
+
+def product_removed(product_id, price):
+    """Товар удаляется вместе с позициями (CASCADE) — вычитаем их из корзин."""
+    count, quantity = _product_lines(product_id, Count('id'), Sum('quantity'))
+    Cart.objects.filter(items__product_id=product_id).update(
+        item_count=F('item_count') - count,
+        quantity_total=F('quantity_total') - quantity,
+        subtotal=ExpressionWrapper(F('subtotal') - quantity * Value(price), output_field=MONEY),
+    )
+
+
+def recalculate(carts=None):
+    """Полный пересчёт итогов (для миграции и проверки расхождений)."""
+    lines = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+
+    def total(aggregate, output_field=None):
+        subquery = Subquery(lines.annotate(value=aggregate).values('value'), output_field=output_field)
+        return Coalesce(subquery, Value(0) if output_field is None else Value(ZERO), output_field=output_field)
+
+    carts = Cart.objects.all() if carts is None else carts
+    carts.update(
+        item_count=total(Count('id')),
+        quantity_total=total(Sum('quantity')),
+        subtotal=total(Sum(F('quantity') * F('product__price'), output_field=MONEY), MONEY),
+    )
@@ -0,0 +1,76 @@
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Category
+
+CACHE_KEY = 'shop:category-tree'
+
+DEFAULTS = {
+    # Сброс при изменении категории виден всем процессам, только если кеш общий
+    # (Redis/Memcached); с LocMemCache у каждого процесса своя копия
+    'CACHE_ALIAS': 'default',
+    # Сколько секунд другой процесс может отдавать старое дерево при локальном кеше
+    'TIMEOUT': 300,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SHOP_CATEGORY_TREE', {})}
+
+
+def get_cache():
+    return caches[get_config()['CACHE_ALIAS']]
+
+
+class CategoryTree:
+    """
+    Материализованное дерево категорий: для каждой категории заранее
+    посчитан список всех потомков (включая её саму), поэтому запрос
+    «все потомки X» — это один поиск в словаре без рекурсивных SQL-запросов.
+    """
+
+    def __init__(self, pairs):
+        self.parents = dict(pairs)
+        self.children = defaultdict(list)
+        for category_id, parent_id in self.parents.items():
+            if parent_id is not None:
+                self.children[parent_id].append(category_id)
+
+        # Обход в ширину от корней, затем сборка потомков снизу вверх
+        order = []
+        queue = deque(pk for pk, parent_id in self.parents.items() if parent_id is None)
+        while queue:
+            pk = queue.popleft()
+            order.append(pk)
+            queue.extend(self.children[pk])
+
+        self.descendants = {pk: (pk,) for pk in self.parents}
+        for pk in reversed(order):
+            self.descendants[pk] = (pk,) + tuple(
+                descendant for child in self.children[pk] for descendant in self.descendants[child]
+            )
+        self.children = dict(self.children)
+
+    def __contains__(self, category_id):
+        return category_id in self.parents
+
+    def get_descendant_ids(self, category_id):
+        return self.descendants.get(category_id, ())
+
+    def get_children_ids(self, category_id):
+        return tuple(self.children.get(category_id, ()))
+
+
+def get_category_tree():
+    cache = get_cache()
+    tree = cache.get(CACHE_KEY)
+    if tree is None:
+        tree = CategoryTree(Category.objects.values_list('id', 'parent_id'))
+        cache.set(CACHE_KEY, tree, get_config()['TIMEOUT'])
+    return tree
+
+
+def invalidate_category_tree():
+    get_cache().delete(CACHE_KEY)
@@ -0,0 +1,118 @@
+from collections import Counter
+
+from django.core.mail import send_mail
+from django.db import transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .models import Cart, CartItem, Order, OrderItem, Product
+from . import cart_totals, response_cache, stock
+from .task_queue import task
+
+
+class EmptyCart(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = 'Cart is empty'
+    default_code = 'empty_cart'
+
+
+class OutOfStock(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Not enough stock'
+    default_code = 'out_of_stock'
+
+    def __init__(self, product_ids):
+        super().__init__()
+        self.detail = {'detail': self.detail, 'products': product_ids}
+
+
+def reserve_stock(quantities):
+    """
+    Списывает остатки заказа (stock.take). Если хотя бы одного товара не
+    хватает даже после возврата просроченных броней — ничего не
+    списывается и поднимается OutOfStock.
+    """
+    if stock.take(quantities) or (stock.release_expired(list(quantities)) and stock.take(quantities)):
+        # Заказ меняет остатки в списке каталога — сбрасываем и его
+        response_cache.invalidate('product')
+        return
+    needed = stock.per_product(quantities)
+    short = Product.objects.filter(pk__in=quantities).exclude(available=True, stock__gte=needed)
+    raise OutOfStock(sorted(short.values_list('pk', flat=True)))
+
+
+def validate_delivery(address, personal_info):
+    """Адрес и данные покупателя проверяются до транзакции: ошибка — 400, а не IntegrityError при записи заказа."""
+    errors = {}
+    if not isinstance(address, str) or not address.strip():
+        errors['address'] = ['This field is required.']
+    if not isinstance(personal_info, dict):
+        errors['personal_info'] = ['Expected a JSON object.']
+    if errors:
+        raise ValidationError(errors)
+
+
+def place_order(user, address, personal_info):
+    """
+    Оформляет заказ из корзины пользователя в одной транзакции: строки
+    товаров блокируются в порядке id (цены и остатки читаются под
+    блокировкой), брони корзины забираются, недостающее списывается,
+    позиции заказа пишутся bulk_create, корзина очищается. Строка корзины
+    блокируется раньше товаров. Число запросов не зависит от размера корзины.
+    """
+    validate_delivery(address, personal_info)
+    with transaction.atomic():
+        # Блокировка корзины: второе оформление той же корзины ждёт первое и
+        # видит её уже пустой, а не создаёт второй заказ из тех же позиций
+        cart_id = Cart.objects.select_for_update().filter(user_id=user.pk).values_list('pk', flat=True).first()
+        cart_items = list(CartItem.objects.filter(cart_id=cart_id).order_by('product_id')) if cart_id else []
+        if not cart_items:
+            raise EmptyCart()
+
+        quantities = Counter()
+        for item in cart_items:
+            quantities[item.product_id] += item.quantity
+        products = stock.lock_products(quantities)
+        for item in cart_items:
+            item.product = products[item.product_id]
+
+        held = stock.consume([item.pk for item in cart_items])
+        # Counter: вычитание отбрасывает неположительные — остаётся только недостающее
+        missing = quantities - held
+        if missing:
+            reserve_stock(missing)
+        stock.put_back(held - quantities)
+
+        order = Order.objects.create(
+            user_id=user.pk,
+            total_amount=sum(item.quantity * item.product.price for item in cart_items),
+            address=address,
+            personal_info=personal_info,
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=item.product_id, quantity=item.quantity, price=item.product.price)
+            for item in cart_items
+        ])
+
+        # Удаляем только то, что попало в заказ
+        CartItem.objects.filter(pk__in=[item.pk for item in cart_items]).delete()
+        cart_totals.items_removed(cart_items)
+
+        # Письмо уходит из воркера после коммита; клиент его не ждёт
+        send_order_confirmation.enqueue({'order_id': order.pk}, key=f'order-confirmation:{order.pk}')
+
+    return order
+
+
+@task(max_attempts=8)
+def send_order_confirmation(order_id):
+    order = Order.objects.select_related('user').prefetch_related('items__product').filter(pk=order_id).first()
+    if order is None or not order.user.email:
+        return
+    lines = '\n'.join(f'{item.product.name} x {item.quantity} — {item.price}' for item in order.items.all())
+    send_mail(
+        f'Заказ №{order.pk} оформлен',
+        f'{lines}\n\nИтого: {order.total_amount}\nАдрес доставки: {order.address}',
+        None,
+        [order.user.email],
+    )
@@ -0,0 +1,98 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+DEFAULTS = {
+    'PRIMARY': 'default',
+    # None — все алиасы DATABASES, кроме основного
+    'REPLICAS': None,
+    # Каталог читается с реплик; корзина, заказы, пользователи и очередь задач — только с основной
+    'REPLICA_MODELS': ['shop.product', 'shop.category', 'shop.brand', 'shop.productneighbours', 'shop.copurchase'],
+}
+
+_pinned = ContextVar('shop_db_pinned', default=False)
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'SHOP_DATABASE_ROUTING', {})}
+    if config['REPLICAS'] is None:
+        config['REPLICAS'] = [alias for alias in settings.DATABASES if alias != config['PRIMARY']]
+    return config
+
+
+@contextmanager
+def use_primary():
+    """Все чтения внутри блока — с основной БД (нужно прочитать только что записанное)."""
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Чтение каталога — со случайной реплики, всё остальное — с основной БД.
+    На основную уходят и чтения внутри транзакции (read-modify-write вроде
+    пересчёта рекомендаций не должен видеть отстающую реплику), и чтения
+    связанных объектов того, что уже прочитано с основной. Без реплик
+    роутер всегда отвечает основной БД. Настройки читаются один раз — при
+    создании роутера.
+    """
+
+    def __init__(self):
+        self.config = get_config()
+        self.replica_models = frozenset(self.config['REPLICA_MODELS'])
+
+    def db_for_read(self, model, **hints):
+        primary, replicas = self.config['PRIMARY'], self.config['REPLICAS']
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if (
+            not replicas or _pinned.get() or model._meta.label_lower not in self.replica_models
+            or connections[primary].in_atomic_block
+        ):
+            return primary
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return self.config['PRIMARY']
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики — копии основной БД
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in self.config['REPLICAS']
+
+
+class PinPrimaryMiddleware:
+    """Запросы, меняющие данные (не GET/HEAD/OPTIONS), целиком читают с основной БД."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return self.get_response(request)
+        with use_primary():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return await self.get_response(request)
+        # contextvar доходит и до кода в sync_to_async
+        with use_primary():
+            return await self.get_response(request)
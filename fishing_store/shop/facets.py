@@ -0,0 +1,102 @@
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import BooleanField, Case, Count, IntegerField, Q, Value, When
+from django_filters.utils import translate_validation
+
+from .category_tree import get_category_tree
+from .filters import ProductFilter
+from .models import Category
+
+#: Границы ценовых диапазонов: [0, 500), [500, 1000), ..., [10000, ∞)
+PRICE_BUCKETS = (0, 500, 1000, 2500, 5000, 10000)
+
+
+def get_price_buckets():
+    return tuple(Decimal(edge) for edge in getattr(settings, 'SHOP_PRICE_BUCKETS', PRICE_BUCKETS))
+
+
+def get_facets(queryset, params):
+    """
+    Счётчики товаров по брендам, поддеревьям категорий и ценовым диапазонам.
+    Параметры разбираются тем же ProductFilter, что и в списке товаров, а
+    счётчики каждого фасета не учитывают его собственный фильтр (чтобы можно
+    было выбрать ещё один бренд или другой диапазон цен).
+
+    Всё считается одним GROUP BY (бренд, категория, диапазон, попадание в
+    фильтр цены) — таких строк немного, дальше свёртка идёт в памяти.
+    """
+    filterset = ProductFilter(params, queryset=queryset)
+    if not filterset.is_valid():
+        raise translate_validation(filterset.errors)
+    data = filterset.form.cleaned_data
+
+    edges = get_price_buckets()
+    bucket = Case(
+        *[When(price__lt=edge, then=Value(i)) for i, edge in enumerate(edges[1:])],
+        default=Value(len(edges) - 1),
+        output_field=IntegerField(),
+    )
+    price_filter = Q()
+    if data.get('price_min') is not None:
+        price_filter &= Q(price__gte=data['price_min'])
+    if data.get('price_max') is not None:
+        price_filter &= Q(price__lte=data['price_max'])
+    in_price = (
+        Case(When(price_filter, then=Value(True)), default=Value(False), output_field=BooleanField())
+        if price_filter else Value(True)
+    )
+
+    rows = (
+        queryset.order_by()
+        .annotate(bucket=bucket, in_price=in_price)
+        .values('brand_id', 'brand__name', 'category_id', 'bucket', 'in_price')
+        .annotate(count=Count('id'))
+    )
+
+    tree = get_category_tree()
+    brands = {int(pk) for pk in data.get('brands') or () if str(pk).isdigit()}
+    categories = set(tree.get_descendant_ids(int(data['category']))) if data.get('category') is not None else None
+
+    brand_counts, brand_names = Counter(), {}
+    category_counts = Counter()
+    bucket_counts = Counter()
+    for row in rows:
+        brand_ok = not brands or row['brand_id'] in brands
+        category_ok = categories is None or row['category_id'] in categories
+        price_ok = row['in_price']
+        if category_ok and price_ok and row['brand_id'] is not None:
+            brand_counts[row['brand_id']] += row['count']
+            brand_names[row['brand_id']] = row['brand__name']
+        if brand_ok and price_ok:
+            category_counts[row['category_id']] += row['count']
+        if brand_ok and category_ok:
+            bucket_counts[row['bucket']] += row['count']
+
+    # Счётчик категории — сумма по всему её поддереву
+    subtree_counts = {
+        pk: sum(category_counts[descendant] for descendant in tree.get_descendant_ids(pk))
+        for pk in tree.parents
+    }
+    subtree_counts = {pk: count for pk, count in subtree_counts.items() if count}
+    names = dict(Category.objects.filter(id__in=subtree_counts).values_list('id', 'name'))
+
+    return {
+        'brands': [
+            {'id': pk, 'name': brand_names[pk], 'count': count}
+            for pk, count in brand_counts.most_common()
+        ],
+        'categories': [
+            {'id': pk, 'name': names.get(pk), 'parent': tree.parents[pk], 'count': count}
+            for pk, count in sorted(subtree_counts.items())
+        ],
+        'price': [
+            {
+                'min': str(edge),
+                'max': str(edges[i + 1]) if i + 1 < len(edges) else None,
+                'count': bucket_counts[i],
+            }
+            for i, edge in enumerate(edges)
+        ],
+    }
@@ -0,0 +1,226 @@
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.fields import empty
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from . import tracing
+
+
+class NotCompilable(Exception):
+    """Сериализатор использует поля, которые быстрый путь не умеет повторить."""
+
+
+# Что делать, если по пути source встретился None (см. Field.get_attribute в DRF)
+SKIP, NULL = object(), object()
+
+
+def _missing(field):
+    if field.default is not empty:
+        return field.get_default()
+    if field.allow_null:
+        return NULL
+    if not field.required:
+        return SKIP
+    raise NotCompilable(field.field_name)
+
+
+class CompiledSerializer:
+    """
+    Read-only аналог ModelSerializer для списков: строки берутся через
+    .values(), а словари собираются заранее подготовленными функциями
+    to_representation полей DRF — без get_attribute, PKOnlyObject и обхода
+    полей для каждого объекта. Результат совпадает с обычным сериализатором
+    байт в байт; на неподдерживаемых полях конструктор бросает NotCompilable.
+
+    Вложенный many=True сериализатор по обратной связи подгружается одним
+    дополнительным запросом на всю страницу.
+    """
+
+    def __init__(self, serializer_class, prefix=''):
+        self.name = serializer_class.__name__
+        self.model = serializer_class.Meta.model
+        self.prefix = prefix
+        self.pk_column = prefix + self.model._meta.pk.name
+        self.columns = [self.pk_column]
+        self.entries = []
+        self.children = []
+
+        for field in serializer_class().fields.values():
+            if field.write_only:
+                continue
+            self._compile_field(field)
+
+    def _get_field(self, model, attr):
+        try:
+            return model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            raise NotCompilable(f'{self.name}.{attr}')
+
+    def _column(self, path):
+        column = self.prefix + '__'.join(path)
+        if column not in self.columns:
+            self.columns.append(column)
+        return column
+
+    def _compile_field(self, field):
+        if field.source == '*':
+            raise NotCompilable(f'{self.name}.{field.field_name}')
+        model, path, guards = self.model, [], []
+        for attr in field.source_attrs[:-1]:
+            relation = self._get_field(model, attr)
+            if not (relation.many_to_one or relation.one_to_one) or not relation.concrete:
+                raise NotCompilable(f'{self.name}.{field.field_name}')
+            path.append(attr)
+            guards.append(self._column(path))
+            model = relation.related_model
+        model_field = self._get_field(model, field.source_attrs[-1])
+        path.append(field.source_attrs[-1])
+        missing = _missing(field) if guards else None
+
+        if isinstance(field, serializers.ListSerializer):
+            if guards or not model_field.one_to_many or not isinstance(field.child, serializers.ModelSerializer):
+                raise NotCompilable(f'{self.name}.{field.field_name}')
+            child = CompiledSerializer(type(field.child))
+            fk = model_field.field.name
+            child.columns.append(fk)
+            self.children.append((field.field_name, child, fk))
+            self.entries.append(('many', field.field_name, None, None, None))
+        elif isinstance(field, serializers.ModelSerializer):
+            if guards or not (model_field.many_to_one or model_field.one_to_one) or not model_field.concrete:
+                raise NotCompilable(f'{self.name}.{field.field_name}')
+            nested = CompiledSerializer(type(field), prefix=self.prefix + model_field.name + '__')
+            if nested.children:
+                raise NotCompilable(f'{self.name}.{field.field_name}')
+            for column in nested.columns:
+                if column not in self.columns:
+                    self.columns.append(column)
+            self.entries.append(('nested', field.field_name, self._column(path), nested, None))
+        elif isinstance(field, serializers.RelatedField):
+            if len(path) != 1 or not field.use_pk_only_optimization() or not model_field.concrete:
+                raise NotCompilable(f'{self.name}.{field.field_name}')
+            self.entries.append(('value', field.field_name, self._column(path), None, None))
+        elif model_field.is_relation or isinstance(field, serializers.ManyRelatedField):
+            raise NotCompilable(f'{self.name}.{field.field_name}')
+        elif getattr(field, 'needs_request', False):
+            # Поле само строит представление из значения и запроса (например, URL)
+            self.entries.append(('request', field.field_name, self._column(path), field.represent, guards))
+        elif isinstance(field, serializers.FileField):
+            use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+            self.entries.append(('file', field.field_name, self._column(path), (model_field.storage, use_url), guards))
+        else:
+            self.entries.append(('value', field.field_name, self._column(path), field.to_representation, guards))
+        if guards:
+            self.entries[-1] = self.entries[-1][:4] + ((guards, missing),)
+
+    def values(self, queryset):
+        """Queryset строк для этого сериализатора (порядок и фильтры сохраняются)."""
+        return queryset.prefetch_related(None).values(*self.columns)
+
+    def build(self, row, request, children):
+        ret = {}
+        for kind, key, column, convert, guard in self.entries:
+            if guard and any(row[column] is None for column in guard[0]):
+                missing = guard[1]
+                if missing is SKIP:
+                    continue
+                ret[key] = None if missing is NULL else missing
+                continue
+            if kind == 'many':
+                ret[key] = children[key].get(row[self.pk_column], [])
+                continue
+            value = row[column]
+            if value is None:
+                ret[key] = None
+            elif kind == 'value':
+                ret[key] = convert(value) if convert is not None else value
+            elif kind == 'nested':
+                ret[key] = convert.build(row, request, None)
+            elif kind == 'request':
+                ret[key] = convert(value, request)
+            else:
+                storage, use_url = convert
+                if not value:
+                    ret[key] = None
+                elif use_url:
+                    url = storage.url(value)
+                    ret[key] = request.build_absolute_uri(url) if request is not None else url
+                else:
+                    ret[key] = value
+        return ret
+
+    def _child_querysets(self, rows):
+        pks = [row[self.pk_column] for row in rows]
+        for key, child, fk in self.children:
+            queryset = child.model._default_manager.filter(**{f'{fk}__in': pks}).order_by(fk, 'pk')
+            yield key, child, fk, child.values(queryset)
+
+    @staticmethod
+    def _group(fk_values, data):
+        grouped = defaultdict(list)
+        for fk_value, item in zip(fk_values, data):
+            grouped[fk_value].append(item)
+        return grouped
+
+    def _build_all(self, rows, request, children):
+        trace = tracing._current.get()
+        if trace is None:
+            return [self.build(row, request, children) for row in rows]
+        # В трассу — только сборка словарей, без чтения строк из БД
+        with trace.span(f'{self.name}[compiled]', objects=len(rows)):
+            return [self.build(row, request, children) for row in rows]
+
+    def serialize(self, rows, request=None):
+        rows = list(rows)
+        children = {}
+        for key, child, fk, queryset in self._child_querysets(rows):
+            child_rows = list(queryset)
+            children[key] = self._group([row[fk] for row in child_rows], child.serialize(child_rows, request))
+        return self._build_all(rows, request, children)
+
+    async def aserialize(self, rows, request=None):
+        """serialize() для async-представлений: вложенные списки читаются через async ORM."""
+        rows = rows if isinstance(rows, list) else [row async for row in rows]
+        children = {}
+        for key, child, fk, queryset in self._child_querysets(rows):
+            child_rows = [row async for row in queryset]
+            children[key] = self._group([row[fk] for row in child_rows], await child.aserialize(child_rows, request))
+        return self._build_all(rows, request, children)
+
+
+@lru_cache(maxsize=None)
+def compile_serializer(serializer_class):
+    """Скомпилированный сериализатор или None, если его не повторить."""
+    try:
+        return CompiledSerializer(serializer_class)
+    except NotCompilable:
+        return None
+
+
+class FastListMixin:
+    """
+    list() через CompiledSerializer: страница выбирается как .values(),
+    без создания моделей и полей DRF на каждый объект. Отключается
+    настройкой SHOP_FAST_SERIALIZERS = False; сериализаторы с
+    неподдерживаемыми полями автоматически идут обычным путём.
+    """
+
+    def get_compiled_serializer(self):
+        if not getattr(settings, 'SHOP_FAST_SERIALIZERS', True):
+            return None
+        return compile_serializer(self.get_serializer_class())
+
+    def list(self, request, *args, **kwargs):
+        compiled = self.get_compiled_serializer()
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = compiled.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(compiled.serialize(page, request))
+        return Response(compiled.serialize(queryset, request))
@@ -0,0 +1,19 @@
+from django_filters import rest_framework as filters  # Импортируем фильтры
+
+from .category_tree import get_category_tree
+from .models import Product
+
+
+class ProductFilter(filters.FilterSet):
+    price_min = filters.NumberFilter(field_name="price", lookup_expr='gte')
+    price_max = filters.NumberFilter(field_name="price", lookup_expr='lte')
+    brands = filters.BaseInFilter(field_name='brand__id', lookup_expr='in')
+    category = filters.NumberFilter(method='filter_category')
+    
+    class Meta:
+        model = Product
+        fields = ['price_min', 'price_max', 'brands', 'category']
+
+    def filter_category(self, queryset, name, value):
+        # Товары категории и всех её подкатегорий любой глубины
+        return queryset.filter(category__id__in=get_category_tree().get_descendant_ids(int(value)))
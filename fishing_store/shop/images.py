@@ -0,0 +1,157 @@
+import hashlib
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from PIL import Image, ImageOps
+
+from .models import Product
+from . import response_cache
+
+logger = logging.getLogger('shop.images')
+
+DEFAULTS = {
+    # Имя варианта -> максимальные ширина и высота (пропорции сохраняются)
+    'VARIANTS': {
+        'thumb': (160, 160),
+        'card': (480, 480),
+        'large': (1200, 1200),
+    },
+    'FORMATS': {'webp': {'quality': 80, 'method': 4}, 'jpeg': {'quality': 82, 'optimize': True, 'progressive': True}},
+    'DIRECTORY': 'products/variants',
+    # False — варианты строятся сразу в запросе (тесты, отладка)
+    'ASYNC': True,
+    'WORKERS': 2,
+}
+
+PIL_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SHOP_IMAGES', {})}
+
+
+def _spec(config):
+    return repr((sorted(config['VARIANTS'].items()), sorted((k, sorted(v.items())) for k, v in config['FORMATS'].items())))
+
+
+def variant_name(source_hash, variant, fmt, config):
+    # Имя зависит от содержимого и настроек: файл никогда не меняется, его можно кешировать навсегда
+    digest = hashlib.sha1(f'{source_hash}:{_spec(config)}'.encode()).hexdigest()[:16]
+    return posixpath.join(config['DIRECTORY'], f'{digest}-{variant}.{fmt}')
+
+
+def render(image, size, fmt, options):
+    copy = image.copy()
+    copy.thumbnail(size, Image.LANCZOS)
+    buffer = BytesIO()
+    copy.save(buffer, PIL_FORMATS[fmt], **options)
+    return copy.size, buffer.getvalue()
+
+
+def build_variants(field_file):
+    """
+    Строит все варианты изображения. Возвращает
+    {'thumb': {'width': 160, 'height': 120, 'webp': 'путь', 'jpeg': 'путь'}, ...}.
+    Уже существующие файлы (то же содержимое и настройки) не пересоздаются.
+    """
+    config = get_config()
+    storage = field_file.storage
+    with field_file.open('rb') as source:
+        data = source.read()
+    source_hash = hashlib.sha1(data).hexdigest()
+
+    image = Image.open(BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'L'):
+        # JPEG без прозрачности: подкладываем белый фон
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+        image = background
+    elif image.mode == 'L':
+        image = image.convert('RGB')
+
+    variants = {}
+    for variant, size in config['VARIANTS'].items():
+        entry = {}
+        for fmt, options in config['FORMATS'].items():
+            name = variant_name(source_hash, variant, fmt, config)
+            if storage.exists(name):
+                with storage.open(name, 'rb') as existing:
+                    width, height = Image.open(existing).size  # читается только заголовок
+            else:
+                (width, height), content = render(image, size, fmt, options)
+                name = storage.save(name, ContentFile(content))
+            entry[fmt] = name
+        entry['width'], entry['height'] = width, height
+        variants[variant] = entry
+    return variants
+
+
+def generate_variants(product_id):
+    """Строит варианты изображения товара и сохраняет их пути в image_variants."""
+    product = Product.objects.filter(pk=product_id).only('id', 'image').first()
+    if product is None:
+        return None
+    if not product.image:
+        variants = {}
+    else:
+        try:
+            variants = build_variants(product.image)
+        except FileNotFoundError:
+            logger.warning('Image of product %s is missing: %s', product_id, product.image.name)
+            return None
+        except (OSError, ValueError, Image.DecompressionBombError):
+            logger.exception('Cannot build image variants for product %s', product_id)
+            return None
+    # Условие по image: если за это время загрузили новое фото, не затираем его варианты
+    same_image = Q(image=product.image.name) if product.image else Q(image='') | Q(image__isnull=True)
+    updated = Product.objects.filter(same_image, pk=product_id).update(image_variants=variants)
+    if updated:
+        response_cache.invalidate('product', f'product:{product_id}')
+    return variants
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    return ThreadPoolExecutor(get_config()['WORKERS'], thread_name_prefix='shop-images')
+
+
+def _run(product_id):
+    try:
+        generate_variants(product_id)
+    except Exception:
+        logger.exception('Image variants failed for product %s', product_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(product_id):
+    """Ставит построение вариантов в пул воркеров после коммита (или строит сразу при ASYNC=False)."""
+    if not get_config()['ASYNC']:
+        generate_variants(product_id)
+        return
+    transaction.on_commit(lambda: get_executor().submit(_run, product_id))
+
+
+def variant_urls(variants, request=None):
+    """image_variants -> те же словари, но с URL вместо путей в хранилище."""
+    if not variants:
+        return {}
+    storage = Product._meta.get_field('image').storage
+    result = {}
+    for variant, entry in variants.items():
+        urls = {}
+        for key, value in entry.items():
+            if key in PIL_FORMATS:
+                url = storage.url(value)
+                value = request.build_absolute_uri(url) if request is not None else url
+            urls[key] = value
+        result[variant] = urls
+    return result
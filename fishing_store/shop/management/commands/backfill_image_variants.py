@@ -0,0 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from shop.images import generate_variants
+from shop.models import Product
+
+
+def _generate(product_id):
+    try:
+        return generate_variants(product_id) is not None
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные копии фото товаров, у которых их ещё нет, в несколько потоков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--force', action='store_true', help='Перестроить и уже готовые')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['force']:
+            products = products.filter(image_variants={})
+        ids = list(products.values_list('id', flat=True))  # читаем до начала записи из потоков
+
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(options['workers']) as pool:
+                results = list(pool.map(_generate, ids))
+        else:
+            results = [generate_variants(pk) is not None for pk in ids]
+        done = results.count(True)
+        failed = len(results) - done
+        self.stdout.write(self.style.SUCCESS(f'Built variants for {done} products, failed {failed}'))
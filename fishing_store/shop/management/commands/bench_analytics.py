@@ -0,0 +1,140 @@
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from time import perf_counter
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+
+from shop import analytics
+from shop.models import Brand, Category, CustomUser, Order, OrderItem, Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Бенчмарк аналитики заказов: векторная агрегация numpy против цикла Python на '
+        'синтетической таблице (по умолчанию миллион позиций). С --db те же данные пишутся '
+        'в БД в транзакции, которая откатывается, и замеряется полный путь с загрузкой.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1_000_000)
+        parser.add_argument('--items-per-order', type=int, default=4)
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--db', action='store_true', help='Записать данные в БД и замерить load_columns')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        columns = self.synthetic(options)
+        self.stdout.write(f'{len(columns["item_order"])} items, {len(columns["order_id"])} orders')
+        for period in analytics.PERIODS:
+            vectorized = self.measure(options['repeat'], lambda: analytics.aggregate(columns, period))
+            naive = self.measure(1, lambda: self.naive(columns, period))
+            self.stdout.write(
+                f'{period:<6} numpy {vectorized * 1000:>8.1f} ms   python loop {naive * 1000:>8.1f} ms   '
+                f'x{naive / vectorized:.1f}'
+            )
+        if options['db']:
+            with transaction.atomic():
+                self.populate(columns, options)
+                self.measure_db(options)
+                transaction.set_rollback(True)
+
+    def measure(self, repeat, func):
+        best = None
+        for _ in range(repeat):
+            start = perf_counter()
+            func()
+            elapsed = perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def synthetic(self, options):
+        rng = np.random.default_rng(options['seed'])
+        orders = max(1, options['items'] // options['items_per_order'])
+        start = np.datetime64(date.today() - timedelta(days=options['days']), 's')
+        seconds = np.sort(rng.integers(0, options['days'] * 86400, orders))
+        products = rng.zipf(1.3, options['items']) % options['products']
+        prices = rng.integers(100, 500_000, options['products'])  # копейки
+        quantity = rng.integers(1, 4, options['items'])
+        return {
+            'order_id': np.arange(1, orders + 1),
+            'order_day': (start + seconds.astype('timedelta64[s]')).astype('datetime64[D]'),
+            'order_status': rng.integers(0, len(analytics.STATUSES), orders),
+            'item_order': np.sort(rng.integers(0, orders, options['items'])),
+            'item_product': products,
+            'item_brand': products % 50,
+            'item_category': products % 120,
+            'item_quantity': quantity,
+            'item_revenue': quantity * prices[products],
+        }
+
+    def naive(self, columns, period):
+        """То же, что analytics.aggregate, но циклом по строкам — как это делалось бы выгрузкой в Python."""
+        days = analytics.truncate(columns['order_day'], period).tolist()
+        statuses = columns['order_status'].tolist()
+        groups = {name: defaultdict(lambda: [0, 0, set()]) for name in ('period', 'product', 'brand', 'category', 'status')}
+        rows = zip(
+            columns['item_order'].tolist(), columns['item_product'].tolist(), columns['item_brand'].tolist(),
+            columns['item_category'].tolist(), columns['item_quantity'].tolist(), columns['item_revenue'].tolist(),
+        )
+        for order, product, brand, category, quantity, revenue in rows:
+            for name, key in (('period', days[order]), ('product', product), ('brand', brand),
+                              ('category', category), ('status', statuses[order])):
+                group = groups[name][key]
+                group[0] += revenue
+                group[1] += quantity
+                group[2].add(order)
+        return groups
+
+    def populate(self, columns, options):
+        self.stdout.write('Populating the database...')
+        category = Category.objects.create(name='bench')
+        brand = Brand.objects.create(name='bench')
+        products = Product.objects.bulk_create(
+            Product(category=category, brand=brand, name=f'bench {i}', description='', price=Decimal('10.00'), stock=0)
+            for i in range(options['products'])
+        )
+        user = CustomUser.objects.create(username='bench-analytics')
+        orders = Order.objects.bulk_create(
+            (Order(user=user, address='bench', personal_info={}, status=analytics.STATUSES[status])
+             for status in columns['order_status'].tolist()),
+            batch_size=5000,
+        )
+        # created_at — auto_now_add, поэтому даты проставляются отдельным update
+        zone = timezone.get_current_timezone()
+        by_day = defaultdict(list)
+        for order, day in zip(orders, columns['order_day'].tolist()):
+            by_day[day].append(order.pk)
+        for day, pks in by_day.items():
+            Order.objects.filter(pk__in=pks).update(created_at=datetime.combine(day, time(12), tzinfo=zone))
+        quantities = columns['item_quantity'].tolist()
+        cents = (columns['item_revenue'] // columns['item_quantity']).tolist()
+        OrderItem.objects.bulk_create(
+            (OrderItem(order_id=orders[order].pk, product_id=products[product].pk, quantity=quantities[i],
+                       price=Decimal(cents[i]).scaleb(-2))
+             for i, (order, product) in enumerate(zip(columns['item_order'].tolist(), columns['item_product'].tolist()))),
+            batch_size=5000,
+        )
+
+    def measure_db(self, options):
+        date_to = timezone.localdate()
+        date_from = date_to - timedelta(days=options['days'])
+        loaded = {}
+        load = self.measure(1, lambda: loaded.update(analytics.load_columns(date_from, date_to)))
+        compute = self.measure(options['repeat'], lambda: analytics.aggregate(loaded, 'day'))
+        sql = self.measure(1, lambda: list(
+            OrderItem.objects.filter(order__created_at__date__gte=date_from)
+            .annotate(day=TruncDay('order__created_at')).values('day')
+            .annotate(revenue=Sum(F('quantity') * F('price')), units=Sum('quantity')).order_by('day')
+        ))
+        self.stdout.write(
+            f'db     load_columns {load * 1000:.0f} ms + aggregate {compute * 1000:.0f} ms '
+            f'(all groupings)   SQL GROUP BY day only {sql * 1000:.0f} ms'
+        )
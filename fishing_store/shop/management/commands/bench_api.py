@@ -0,0 +1,108 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+
+from shop import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Воспроизводимый бенчмарк API: синтетический магазин заданного размера и сценарии '
+        'покупателя (каталог, карточка, поиск, фильтры, корзина, оформление) через тестовый '
+        'клиент. Для каждого сценария — p50/p90/p99, число SQL-запросов и операций в секунду. '
+        'Результат сравнивается с базовыми линиями; регрессия завершает команду с ошибкой: '
+        'число запросов — с базовой линией в репозитории (от машины не зависит), время — с '
+        'локальной, которая пишется при первом запуске и в git не попадает. '
+        'Данные создаются в транзакции, которая откатывается.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=list(benchmark.SCALES), default='small')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--scenarios', default=','.join(benchmark.SCENARIOS), help='Через запятую')
+        parser.add_argument('--baseline', default=str(Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'))
+        parser.add_argument(
+            '--timings', default=str(Path(settings.BASE_DIR) / 'benchmarks' / 'timings.local.json'),
+            help='Локальная базовая линия времени (в .gitignore)',
+        )
+        parser.add_argument('--update-baseline', action='store_true', help='Записать результат как новые базовые линии')
+        parser.add_argument('--tolerance', type=float, default=0.5, help='Допустимый рост p90 (0.5 = +50%%)')
+        parser.add_argument('--output', help='Сохранить результат в JSON')
+        parser.add_argument('--cache', action='store_true', help='Не отключать кеш ответов')
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(names) - set(benchmark.SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+
+        overrides = {'ALLOWED_HOSTS': ['testserver']}
+        if not options['cache']:
+            overrides.update({
+                'CACHES': {**settings.CACHES, 'bench': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+                'SHOP_RESPONSE_CACHE': {**getattr(settings, 'SHOP_RESPONSE_CACHE', {}), 'ALIAS': 'bench'},
+            })
+        results = {}
+        with override_settings(**overrides), transaction.atomic():
+            dataset = benchmark.generate(options['scale'], options['seed'])
+            for name in names:
+                results[name] = benchmark.run_scenario(
+                    benchmark.SCENARIOS[name], dataset, options['iterations'], options['warmup'], options['seed'],
+                )
+                self.report(name, results[name])
+            transaction.set_rollback(True)
+
+        run = {
+            'scale': options['scale'], 'seed': options['seed'], 'iterations': options['iterations'],
+            'cache': options['cache'], 'scenarios': results,
+        }
+        if options['output']:
+            self.write(options['output'], run)
+        baseline_path, timings_path = Path(options['baseline']), Path(options['timings'])
+        if options['update_baseline']:
+            self.write(baseline_path, {**run, 'scenarios': benchmark.query_counts(results)})
+            self.write(timings_path, run)
+            self.stdout.write(f'Baseline written to {baseline_path}, timings to {timings_path}')
+            return
+
+        baseline = {}
+        if baseline_path.exists():
+            baseline = {name: dict(counts) for name, counts in self.load(baseline_path, run).items()}
+        else:
+            self.stdout.write(f'No baseline at {baseline_path}, query counts are not compared (use --update-baseline)')
+        if timings_path.exists():
+            for name, timings in self.load(timings_path, run).items():
+                # Из локального файла — только время: число запросов сверяется с базовой линией в репозитории
+                baseline.setdefault(name, {})['p90_ms'] = timings['p90_ms']
+        else:
+            self.write(timings_path, run)
+            self.stdout.write(f'Timings of this machine written to {timings_path}, compared from the next run')
+
+        regressions = benchmark.compare(results, baseline, options['tolerance'])
+        if regressions:
+            raise CommandError('Performance regressions:\n' + '\n'.join(f'  {line}' for line in regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions'))
+
+    def load(self, path, run):
+        recorded = json.loads(Path(path).read_text())
+        for key in ('scale', 'seed', 'cache'):
+            if recorded.get(key) != run[key]:
+                raise CommandError(f'{path} was recorded with {key}={recorded.get(key)!r}, this run has {run[key]!r}')
+        return recorded['scenarios']
+
+    def report(self, name, result):
+        self.stdout.write(
+            f'{name:<12} p50 {result["p50_ms"]:>7.1f} ms   p90 {result["p90_ms"]:>7.1f} ms   '
+            f'p99 {result["p99_ms"]:>7.1f} ms   {result["queries"]:>5} queries   {result["ops_per_second"]:>7.0f} op/s'
+        )
+
+    def write(self, path, run):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(run, indent=2, ensure_ascii=False) + '\n')
@@ -0,0 +1,131 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from statistics import quantiles
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test import AsyncClient, Client, override_settings
+from django.urls import include, path
+from rest_framework_simplejwt.tokens import AccessToken
+
+from shop.models import Brand, Cart, CartItem, Category, CustomUser, Product
+from shop.urls import build_urlpatterns
+
+
+class SyncURLConf:
+    urlpatterns = [path('api/', include(build_urlpatterns(use_async=False)))]
+
+
+class AsyncURLConf:
+    urlpatterns = [path('api/', include(build_urlpatterns(use_async=True)))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочное сравнение чтения каталога и корзины: синхронные view в пуле потоков '
+        '(как WSGI-воркер с потоками) и async-view под asyncio (как ASGI). Кеш ответов '
+        'по умолчанию отключён. Тестовые данные создаются и удаляются после замера.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['wsgi', 'asgi', 'both'], default='both')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--cache', action='store_true', help='Не отключать кеш ответов')
+
+    def handle(self, *args, **options):
+        user, brand, category = self.populate(options)
+        token = f'Bearer {AccessToken.for_user(user)}'
+        product = Product.objects.filter(brand=brand).first()
+        self.urls = [
+            ('/api/products/?page_size=24', {}),
+            (f'/api/products/?brands={brand.id}&ordering=-price&page=2', {}),
+            (f'/api/products/{product.id}/', {}),
+            ('/api/categories/', {}),
+            ('/api/brands/', {}),
+            ('/api/cart/', {'Authorization': token}),
+        ]
+
+        overrides = {'ALLOWED_HOSTS': ['testserver']}
+        if not options['cache']:
+            overrides.update({
+                'CACHES': {
+                    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                    'bench': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+                },
+                'SHOP_RESPONSE_CACHE': {'ALIAS': 'bench'},
+            })
+        try:
+            with override_settings(**overrides):
+                if options['mode'] in ('wsgi', 'both'):
+                    with override_settings(ROOT_URLCONF=SyncURLConf):
+                        self.report('wsgi', *self.run_threads(options))
+                if options['mode'] in ('asgi', 'both'):
+                    with override_settings(ROOT_URLCONF=AsyncURLConf):
+                        self.report('asgi', *asyncio.run(self.run_async(options)))
+        finally:
+            Product.objects.filter(brand=brand).delete()
+            category.delete()
+            brand.delete()
+            user.delete()
+
+    def request_plan(self, options):
+        return [self.urls[i % len(self.urls)] for i in range(options['requests'])]
+
+    def run_threads(self, options):
+        def worker(url, headers):
+            client = Client()
+            start = perf_counter()
+            response = client.get(url, headers=headers)
+            elapsed = perf_counter() - start
+            close_old_connections()
+            return response.status_code, elapsed
+
+        start = perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            results = list(pool.map(lambda item: worker(*item), self.request_plan(options)))
+        return results, perf_counter() - start
+
+    async def run_async(self, options):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def worker(url, headers):
+            async with semaphore:
+                start = perf_counter()
+                response = await client.get(url, headers=headers)
+                return response.status_code, perf_counter() - start
+
+        start = perf_counter()
+        results = await asyncio.gather(*(worker(url, headers) for url, headers in self.request_plan(options)))
+        return results, perf_counter() - start
+
+    def report(self, mode, results, total):
+        errors = sum(1 for status, _ in results if status != 200)
+        latencies = sorted(elapsed * 1000 for _, elapsed in results)
+        p50, p95, p99 = (quantiles(latencies, n=100)[i - 1] for i in (50, 95, 99))
+        self.stdout.write(
+            f'{mode:<5} {len(results) / total:>8.0f} req/s   '
+            f'p50 {p50:>7.1f} ms   p95 {p95:>7.1f} ms   p99 {p99:>7.1f} ms   errors {errors}'
+        )
+
+    def populate(self, options):
+        category = Category.objects.create(name='bench')
+        brand = Brand.objects.create(name='bench')
+        Product.objects.bulk_create(
+            Product(
+                category=category, brand=brand, name=f'bench {i}', description='Описание ' * 20,
+                price=Decimal(100 + i), stock=10, image='products/1.jpg',
+            )
+            for i in range(options['products'])
+        )
+        user = CustomUser.objects.create(username='bench-concurrency')
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.bulk_create(
+            CartItem(cart=cart, product=product, quantity=1)
+            for product in Product.objects.filter(brand=brand)[:10]
+        )
+        return user, brand, category
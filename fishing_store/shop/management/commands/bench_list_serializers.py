@@ -0,0 +1,73 @@
+from decimal import Decimal
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIRequestFactory
+
+from shop.fast_serializers import compile_serializer
+from shop.models import Brand, Category, CustomUser, Order, OrderItem, Product
+from shop.prefetch import prefetch_for_serializer
+from shop.serializers import OrderSerializer, ProductSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность list-эндпоинтов: обычный ModelSerializer '
+        'и скомпилированный путь через .values(). Данные создаются в транзакции и откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--orders', type=int, default=300)
+        parser.add_argument('--items', type=int, default=5, help='Позиций в заказе')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.populate(options)
+            request = APIRequestFactory().get('/api/', HTTP_HOST='localhost')
+            for serializer_class, queryset, count in [
+                (ProductSerializer, Product.objects.all(), options['products']),
+                (OrderSerializer, Order.objects.all(), options['orders']),
+            ]:
+                regular = self.measure(options['repeat'], lambda: serializer_class(
+                    prefetch_for_serializer(queryset, serializer_class), many=True, context={'request': request},
+                ).data)
+                compiled = compile_serializer(serializer_class)
+                fast = self.measure(options['repeat'], lambda: compiled.serialize(compiled.values(queryset), request))
+                self.stdout.write(
+                    f'{serializer_class.__name__:<20} regular {count / regular:>9.0f} obj/s   '
+                    f'compiled {count / fast:>9.0f} obj/s   x{regular / fast:.1f}'
+                )
+            transaction.set_rollback(True)
+
+    def measure(self, repeat, func):
+        best = None
+        for _ in range(repeat):
+            start = perf_counter()
+            func()
+            elapsed = perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def populate(self, options):
+        category = Category.objects.create(name='bench')
+        brand = Brand.objects.create(name='bench')
+        products = Product.objects.bulk_create(
+            Product(
+                category=category, brand=brand, name=f'bench {i}', description='Описание ' * 50,
+                price=Decimal('1999.90'), stock=10, image='products/1.jpg',
+            )
+            for i in range(options['products'])
+        )
+        user = CustomUser.objects.create(username='bench-user')
+        orders = Order.objects.bulk_create(
+            Order(user=user, address='bench', personal_info={'name': 'bench'}, total_amount=Decimal('100.00'))
+            for _ in range(options['orders'])
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=products[(i + j) % len(products)], quantity=1, price=Decimal('1999.90'))
+            for i, order in enumerate(orders)
+            for j in range(options['items'])
+        )
@@ -0,0 +1,66 @@
+import contextlib
+import os
+from decimal import Decimal
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shop import tracing
+from shop.models import Brand, Category, Product
+from shop.serializers import ProductSerializer
+
+
+class DebugPrintProductSerializer(ProductSerializer):
+    """Поведение до удаления отладочного print — только для сравнения."""
+
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        print(f"[DEBUG] Serialized Product Data: {representation}")
+        return representation
+
+
+class Command(BaseCommand):
+    help = 'Замеряет пропускную способность сериализации списка товаров (объектов в секунду)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objects', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        # Объекты в памяти: меряем только сериализацию, без базы
+        category = Category(id=1, name='Удочки')
+        brand = Brand(id=1, name='Shimano')
+        now = timezone.now()
+        products = [
+            Product(
+                id=i, category=category, brand=brand, name=f'Удочка {i}', description='Описание ' * 50,
+                price=Decimal('1999.90'), stock=10, created_at=now, updated_at=now,
+            )
+            for i in range(options['objects'])
+        ]
+
+        def run(serializer_class):
+            best = None
+            for _ in range(options['repeat']):
+                start = perf_counter()
+                serializer_class(products, many=True).data
+                elapsed = perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            return len(products) / best
+
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            before = run(DebugPrintProductSerializer)
+        after = run(ProductSerializer)
+        tracing.install()
+        untraced_request = run(ProductSerializer)
+        with tracing.collect():
+            traced_request = run(ProductSerializer)
+
+        for label, rate in [
+            ('debug print (before)', before),
+            ('no tracing (after)', after),
+            ('tracing installed, request not sampled', untraced_request),
+            ('tracing installed, request sampled', traced_request),
+        ]:
+            self.stdout.write(f'{label:<42} {rate:>10.0f} objects/s')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from shop import product_io
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка всего каталога в CSV/JSONL (в файл или stdout)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=product_io.FORMATS, default='csv')
+        parser.add_argument('--output', '-o', help='Файл; по умолчанию stdout')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rows = product_io.export_products(options['format'], chunk_size=options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as stream:
+                stream.writelines(rows)
+        else:
+            for row in rows:
+                self.stdout.write(row, ending='')
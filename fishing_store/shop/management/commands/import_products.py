@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import product_io
+
+
+class Command(BaseCommand):
+    help = (
+        'Потоковый импорт товаров из CSV/JSONL (ключ — sku): новые создаются, '
+        'существующие обновляются пачками. Ошибочные строки пропускаются и выводятся в отчёте.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=product_io.FORMATS, help='По умолчанию — по расширению файла')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--max-errors', type=int, default=1000, help='Сколько ошибок выводить')
+        parser.add_argument('--no-create-brands', action='store_true', help='Неизвестный бренд — ошибка строки')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if fmt not in product_io.FORMATS:
+            raise CommandError(f'Cannot detect format of {path}, use --format')
+        with open(path, encoding='utf-8-sig', newline='') as stream:
+            report = product_io.import_products(
+                stream, fmt, chunk_size=options['chunk_size'],
+                create_brands=not options['no_create_brands'], max_errors=options['max_errors'],
+            )
+        for error in report.errors:
+            self.stderr.write(json.dumps(error, ensure_ascii=False))
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {report.created}, updated {report.updated}, errors {report.error_count}'
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from shop import response_cache
+from shop.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Полностью пересобирает поисковый индекс товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        total = backend.rebuild(chunk_size=options['chunk_size'])
+        response_cache.invalidate('product')  # Закешированная выдача поиска устарела
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} products with {type(backend).__name__}'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from shop import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        'Добавляет новые заказы в матрицу совместных покупок и пересчитывает '
+        'рекомендации затронутых товаров (shop/recommendations.py). Запускать по расписанию.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Построить матрицу заново по всем заказам')
+
+    def handle(self, *args, **options):
+        count = recommendations.refresh(rebuild=options['rebuild'])
+        self.stdout.write(self.style.SUCCESS(f'Updated recommendations for {count} products'))
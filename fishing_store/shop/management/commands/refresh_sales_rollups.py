@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from shop import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        'Дозаполняет дневные сводки продаж (shop/rollups.py): дни новых заказов после '
+        'отметки и дни, где менялись старые заказы. Запускать по расписанию, например раз в 5 минут.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Пересчитать сводки за всё время')
+
+    def handle(self, *args, **options):
+        days = rollups.refresh(rebuild=options['rebuild'])
+        self.stdout.write(self.style.SUCCESS(f'Refreshed {days} days'))
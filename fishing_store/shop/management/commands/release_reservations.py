@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from shop import stock
+
+
+class Command(BaseCommand):
+    help = (
+        'Возвращает на склад просроченные брони корзин и брони удалённых позиций '
+        '(shop/stock.py). Запускать по расписанию, например раз в минуту; при нехватке '
+        'товара оформление и так забирает просроченные брони этого товара.'
+    )
+
+    def handle(self, *args, **options):
+        units = stock.release_expired()
+        self.stdout.write(self.style.SUCCESS(f'Released {units} units'))
@@ -0,0 +1,58 @@
+import multiprocessing
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from shop import task_queue
+
+
+class Command(BaseCommand):
+    help = (
+        'Воркер фоновых задач из таблицы shop_task: --processes процессов по --threads потоков. '
+        'Останавливается по SIGINT/SIGTERM, дождавшись текущих задач.'
+    )
+
+    def add_arguments(self, parser):
+        config = task_queue.get_config()
+        parser.add_argument('--threads', type=int, default=config['THREADS'])
+        parser.add_argument('--processes', type=int, default=config['PROCESSES'])
+        parser.add_argument('--poll-interval', type=float, default=config['POLL_INTERVAL'])
+        parser.add_argument('--once', action='store_true', help='Выполнить готовые задачи и выйти')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            count = task_queue.run_pending()
+            self.stdout.write(self.style.SUCCESS(f'Ran {count} tasks'))
+            return
+
+        threads, processes = max(1, options['threads']), max(1, options['processes'])
+        if processes == 1:
+            stop = threading.Event()
+            workers = []
+        else:
+            # fork: дочерние процессы наследуют настроенный Django, но не соединения с БД
+            context = multiprocessing.get_context('fork')
+            stop = context.Event()
+            connections.close_all()
+            workers = [
+                context.Process(target=task_queue.serve, args=(threads, options['poll_interval'], stop))
+                for _ in range(processes)
+            ]
+
+        def shutdown(signum, frame):
+            self.stdout.write('Stopping task workers...')
+            stop.set()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+        self.stdout.write(f'Task workers: {processes} x {threads} threads')
+
+        if workers:
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        else:
+            task_queue.serve(threads, options['poll_interval'], stop)
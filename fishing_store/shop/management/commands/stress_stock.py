@@ -0,0 +1,136 @@
+import random
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from time import perf_counter, sleep
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+
+from shop import stock
+from shop.cart_items import upsert_cart_items
+from shop.checkout import EmptyCart, OutOfStock, place_order
+from shop.models import Brand, Cart, CartItem, Category, CustomUser, Order, OrderItem, Product, StockReservation
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочная проверка остатков: потоки покупателей одновременно кладут в корзину, '
+        'убирают и покупают несколько дефицитных товаров, а «администратор» параллельно '
+        'правит эти товары с проверкой version. Работает с БД из настроек (SQLite, лучше с '
+        'SHOP_SQLITE_WAL=1, или сервер — см. SHOP_DB_PROFILE). В конце проверяется, что ничего не продано '
+        'сверх остатка и ни одна единица не потерялась; тестовые данные удаляются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--operations', type=int, default=100, help='Операций на поток')
+        parser.add_argument('--products', type=int, default=3)
+        parser.add_argument('--stock', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        category = Category.objects.create(name='stress')
+        brand = Brand.objects.create(name='stress')
+        products = Product.objects.bulk_create(
+            Product(category=category, brand=brand, name=f'stress {i}', description='', price=Decimal('10.00'),
+                    stock=options['stock'])
+            for i in range(options['products'])
+        )
+        run = uuid4().hex[:8]
+        users = CustomUser.objects.bulk_create(
+            CustomUser(username=f'stress-{run}-{i}') for i in range(options['threads'])
+        )
+        Cart.objects.bulk_create(Cart(user=user) for user in users)
+        product_ids = [product.pk for product in products]
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        try:
+            stop = threading.Event()
+            admin = threading.Thread(target=self.admin, args=(product_ids, stop))
+            admin.start()
+            start = perf_counter()
+            with ThreadPoolExecutor(options['threads']) as pool:
+                list(pool.map(lambda index: self.shopper(users[index], product_ids, options, index), range(len(users))))
+            elapsed = perf_counter() - start
+            stop.set()
+            admin.join()
+            self.verify(product_ids, options, elapsed)
+        finally:
+            Order.objects.filter(user__in=users).delete()
+            CustomUser.objects.filter(pk__in=[user.pk for user in users]).delete()
+            Product.objects.filter(pk__in=product_ids).delete()
+            category.delete()
+            brand.delete()
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def shopper(self, user, product_ids, options, index):
+        rng = random.Random(f'{options["seed"]}:{index}')
+        try:
+            for _ in range(options['operations']):
+                action = rng.choices(['add', 'remove', 'checkout'], weights=[5, 1, 2])[0]
+                try:
+                    if action == 'add':
+                        upsert_cart_items(user, {rng.choice(product_ids): rng.randint(1, 3)})
+                    elif action == 'remove':
+                        item = CartItem.objects.filter(cart__user=user).order_by('?').first()
+                        if item is not None:
+                            with transaction.atomic():
+                                stock.release(StockReservation.objects.filter(cart_item=item))
+                                item.delete()
+                    else:
+                        place_order(user, 'stress', {})
+                    self.count(action)
+                except (OutOfStock, EmptyCart) as error:
+                    self.count(type(error).__name__)
+                except OperationalError:
+                    # SQLite: не дождались блокировки за busy_timeout
+                    self.count('locked')
+        finally:
+            connection.close()
+
+    def admin(self, product_ids, stop):
+        """Читает товар, «думает» и сохраняет всю строку целиком — как форма редактирования."""
+        rng = random.Random(0)
+        try:
+            while not stop.is_set():
+                product = Product.objects.get(pk=rng.choice(product_ids))
+                sleep(0.005)
+                product.price += Decimal('0.01')
+                try:
+                    with transaction.atomic():
+                        stock.check_version(product, product.version)
+                        product.save()
+                    self.count('admin_saved')
+                except stock.StaleVersion:
+                    self.count('admin_conflict')
+                except OperationalError:
+                    self.count('locked')
+        finally:
+            connection.close()
+
+    def verify(self, product_ids, options, elapsed):
+        initial = options['stock'] * len(product_ids)
+        remaining = sum(Product.objects.filter(pk__in=product_ids).values_list('stock', flat=True))
+        sold = sum(OrderItem.objects.filter(product_id__in=product_ids).values_list('quantity', flat=True))
+        held = sum(StockReservation.objects.filter(product_id__in=product_ids).values_list('quantity', flat=True))
+        negative = Product.objects.filter(pk__in=product_ids, stock__lt=0).count()
+        wrong_flag = (
+            Product.objects.filter(pk__in=product_ids, stock=0, available=True).count()
+            + Product.objects.filter(pk__in=product_ids, stock__gt=0, available=False).count()
+        )
+
+        operations = sum(self.counts[name] for name in ('add', 'remove', 'checkout', 'OutOfStock', 'EmptyCart'))
+        self.stdout.write(
+            f'{connection.vendor}: {operations / elapsed:.0f} op/s, '
+            + ', '.join(f'{name} {count}' for name, count in sorted(self.counts.items()))
+        )
+        self.stdout.write(f'initial {initial} = remaining {remaining} + sold {sold} + reserved {held}')
+        if negative or wrong_flag or remaining + sold + held != initial:
+            raise CommandError(f'Stock invariant violated: negative={negative} wrong_available={wrong_flag}')
+        self.stdout.write(self.style.SUCCESS('OK: no oversell, no lost units'))
@@ -0,0 +1,273 @@
+import json
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import tracing
+
+logger = logging.getLogger('shop.metrics')
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Медленные запросы пишутся в лог вместе с самыми долгими SQL
+    'SLOW_REQUEST_MS': 500,
+    'SLOW_TOP_QUERIES': 5,
+    # Время сериализации: навсегда включает замеры во всех @traced сериализаторах
+    # (см. shop/tracing.py), поэтому по умолчанию выключено
+    'SERIALIZER_TIME': False,
+}
+
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+#: Имя метрики, описание и границы корзин
+HISTOGRAMS = {
+    'shop_request_duration_seconds': ('Request wall time', SECONDS),
+    'shop_request_db_queries': ('Database queries per request', QUERIES),
+    'shop_request_db_seconds': ('Time spent in database queries per request', SECONDS),
+    'shop_request_serializer_seconds': ('Time spent in serializers per request', SECONDS),
+    'shop_response_size_bytes': ('Response body size', BYTES),
+}
+LABELS = ('view', 'action', 'method')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SHOP_METRICS', {})}
+
+
+class Histogram:
+    """Гистограмма Prometheus: накопительные корзины считаются при выводе."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    """Метрики процесса: гистограммы по (метрика, метки) и счётчик запросов по статусу."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.histograms = {}
+        self.requests = {}
+
+    def record(self, labels, status, values):
+        with self.lock:
+            for name, value in values.items():
+                key = (name, labels)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(HISTOGRAMS[name][1])
+                self.histograms[key].observe(value)
+            key = labels + (str(status),)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.requests.clear()
+
+    def render(self):
+        """Текстовый формат Prometheus 0.0.4."""
+        lines = []
+        with self.lock:
+            lines += ['# HELP shop_requests_total Requests by view, action and status', '# TYPE shop_requests_total counter']
+            for key, count in sorted(self.requests.items()):
+                lines.append(f'shop_requests_total{{{_labels(LABELS + ("status",), key)}}} {count}')
+            for name, (description, buckets) in HISTOGRAMS.items():
+                lines += [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+                for (metric, labels), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    base = _labels(LABELS, labels)
+                    cumulative = 0
+                    for bound, count in zip((*buckets, '+Inf'), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{base},le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{{base}}} {histogram.sum:.6f}')
+                    lines.append(f'{name}_count{{{base}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(names, values):
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+
+registry = Registry()
+
+
+class QueryRecorder:
+    """execute_wrapper: время и текст каждого SQL-запроса за время запроса."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((perf_counter() - start, sql))
+
+    @property
+    def seconds(self):
+        return sum(duration for duration, sql in self.queries)
+
+
+_recorder = ContextVar('shop_metrics_queries', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Постоянная execute_wrapper каждого соединения: пишет запрос в QueryRecorder
+    текущего HTTP-запроса. Recorder хранится в contextvar, поэтому запросы из
+    sync_to_async под ASGI тоже попадают в него, а соединения не нужно искать
+    в чужом потоке.
+    """
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    # В начало списка: execute_wrapper() как контекстный менеджер снимает последнюю обёртку
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def view_labels(request):
+    """(view, action, method): класс представления и действие ViewSet'а, а не путь с id."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched', '', request.method
+    func = match.func
+    view = getattr(func, 'cls', None) or getattr(func, 'view_class', None)
+    view = view.__name__ if view is not None else match.view_name or func.__name__
+    actions = getattr(func, 'actions', None) or {}
+    method = request.method.lower()
+    action = actions.get(method) or (actions.get('get', '') if method == 'head' else '')
+    return view, action, request.method
+
+
+class MetricsMiddleware:
+    """
+    Собирает для каждого запроса время, число и время SQL-запросов (через
+    connection.execute_wrapper), время сериализации и размер ответа в
+    гистограммы по представлению и действию. Метрики отдаёт MetricsView.
+    Медленные запросы (дольше SLOW_REQUEST_MS) пишутся в лог 'shop.metrics'
+    с самыми долгими SQL. Работает и под ASGI без перехода в поток.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.serializer_time = config['SERIALIZER_TIME']
+        if self.serializer_time:
+            tracing.install()
+        # Новые соединения (в т.ч. в потоках запросов под ASGI) — по сигналу, уже открытые — сразу
+        connection_created.connect(install_query_recorder, dispatch_uid='shop.metrics')
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+        self.get_response = get_response
+        self.slow_seconds = config['SLOW_REQUEST_MS'] / 1000
+        self.top_queries = config['SLOW_TOP_QUERIES']
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        start = perf_counter()
+        with self.measure() as (recorder, trace):
+            response = self.get_response(request)
+        return self.finish(request, response, perf_counter() - start, recorder, trace)
+
+    async def __acall__(self, request):
+        start = perf_counter()
+        with self.measure() as (recorder, trace):
+            response = await self.get_response(request)
+        return self.finish(request, response, perf_counter() - start, recorder, trace)
+
+    @contextmanager
+    def measure(self):
+        recorder = QueryRecorder()
+        token = _recorder.set(recorder)
+        try:
+            with tracing.collect() if self.serializer_time else nullcontext() as trace:
+                yield recorder, trace
+        finally:
+            _recorder.reset(token)
+
+    def finish(self, request, response, elapsed, recorder, trace):
+        labels = view_labels(request)
+        values = {
+            'shop_request_duration_seconds': elapsed,
+            'shop_request_db_queries': len(recorder.queries),
+            'shop_request_db_seconds': recorder.seconds,
+        }
+        if trace is not None:
+            values['shop_request_serializer_seconds'] = trace.total
+        if not response.streaming:
+            values['shop_response_size_bytes'] = len(response.content)
+        registry.record(labels, response.status_code, values)
+
+        if elapsed >= self.slow_seconds:
+            self.log_slow(request, labels, response, elapsed, recorder, trace)
+        return response
+
+    def log_slow(self, request, labels, response, elapsed, recorder, trace):
+        slowest = sorted(recorder.queries, key=lambda query: query[0], reverse=True)[:self.top_queries]
+        logger.warning(
+            'Slow request %s %s (%s.%s) %s: %.0f ms, %s queries in %.0f ms, serializers %s\n%s',
+            request.method, request.get_full_path(), labels[0], labels[1], response.status_code,
+            elapsed * 1000, len(recorder.queries), recorder.seconds * 1000,
+            f'{trace.total * 1000:.0f} ms' if trace is not None else 'not measured',
+            '\n'.join(f'  {duration * 1000:.1f} ms: {sql[:500]}' for duration, sql in slowest),
+            extra={
+                'view': labels[0], 'action': labels[1], 'duration_ms': round(elapsed * 1000, 1),
+                'queries': len(recorder.queries), 'db_ms': round(recorder.seconds * 1000, 1),
+            },
+        )
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Ошибки (403 и т. п.) приходят словарём
+        return (data if isinstance(data, str) else json.dumps(data)).encode()
+
+
+class MetricsView(APIView):
+    """Метрики этого процесса в формате Prometheus (только для администраторов)."""
+    permission_classes = [IsAdminUser]
+    renderer_classes = [PrometheusRenderer]
+
+    def get(self, request):
+        return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts "
+        "USING fts5(name, description, brand, tokenize='unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        "INSERT INTO shop_product_fts (rowid, name, description, brand) "
+        "SELECT p.id, p.name, p.description, COALESCE(b.name, '') "
+        "FROM shop_product p LEFT JOIN shop_brand b ON b.id = p.brand_id"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS shop_product_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_alter_order_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:43
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    # Склеиваем повторы товара в корзине в одну позицию с суммарным количеством
+    CartItem = apps.get_model('shop', 'CartItem')
+    duplicates = list(
+        CartItem.objects.values('cart_id', 'product_id')
+        .annotate(lines=Count('id'), keep=Min('id'), total=Sum('quantity'))
+        .filter(lines__gt=1)
+    )
+    for row in duplicates:
+        CartItem.objects.filter(pk=row['keep']).update(quantity=row['total'])
+        CartItem.objects.filter(cart_id=row['cart_id'], product_id=row['product_id']).exclude(pk=row['keep']).delete()
+    # item_count корзин теперь считает склеенные позиции (см. 0013)
+    Cart = apps.get_model('shop', 'Cart')
+    for cart_id in {row['cart_id'] for row in duplicates}:
+        Cart.objects.filter(pk=cart_id).update(item_count=CartItem.objects.filter(cart_id=cart_id).count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_cart_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='cartitem_cart_product_uniq'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:58
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0020_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cartitem',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1, validators=[django.core.validators.MaxValueValidator(9999)]),
+        ),
+    ]
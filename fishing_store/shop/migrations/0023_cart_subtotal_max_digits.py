@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0022_product_sold_out'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:12
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_index(apps, schema_editor):
+    # Как FTS5-индекс в 0011, но для PostgreSQL: документ с весами name > brand > description
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE TABLE IF NOT EXISTS shop_product_search ("
+        "product_id bigint PRIMARY KEY REFERENCES shop_product (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+        "document tsvector NOT NULL)"
+    )
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS shop_product_search_document_idx ON shop_product_search USING GIN (document)"
+    )
+    schema_editor.execute(
+        "INSERT INTO shop_product_search (product_id, document) "
+        "SELECT p.id, setweight(to_tsvector('simple', COALESCE(p.name, '')), 'A') "
+        "|| setweight(to_tsvector('simple', COALESCE(b.name, '')), 'B') "
+        "|| setweight(to_tsvector('simple', COALESCE(p.description, '')), 'C') "
+        "FROM shop_product p LEFT JOIN shop_brand b ON b.id = p.brand_id "
+        "ON CONFLICT (product_id) DO NOTHING"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS shop_product_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0023_cart_subtotal_max_digits'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_document', serialize=False, to='shop.product')),
+                ('document', django.contrib.postgres.search.SearchVectorField()),
+            ],
+            options={
+                'db_table': 'shop_product_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_index, drop_index),
+    ]
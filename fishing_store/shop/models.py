@@ -1,3 +1,5 @@
+from django.contrib.postgres.search import SearchVectorField
+from django.core.validators import MaxValueValidator
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth import get_user_model
@@ -27,32 +29,90 @@ class Brand(models.Model):
 class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     brand = models.ForeignKey(Brand, on_delete=models.CASCADE, related_name='products', null=True)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)  # Артикул поставщика, ключ импорта
     name = models.CharField(max_length=255)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.IntegerField()
     available = models.BooleanField(default=True)
+    # Снят с продажи автоматически, когда кончился свободный остаток: вернётся в продажу с остатком (shop/stock.py)
+    sold_out = models.BooleanField(default=False, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     image = models.ImageField(upload_to='products/', blank=True, null=True)  # Добавлено поле
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)  # Уменьшенные копии (shop/images.py)
+    # Растёт при каждом изменении товара и остатка: оптимистическая блокировка (shop/stock.py)
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # Каталог сортируется по цене (+ id для курсора), фильтры — по категории и бренду
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['category', 'price'], name='product_category_price_idx'),
+            models.Index(fields=['brand', 'price'], name='product_brand_price_idx'),
+        ]
 
     def __str__(self):
         return self.name
     
+class ProductSearchDocument(models.Model):
+    """
+    Поисковый документ товара для PostgreSQL (shop/search.py). Таблица с
+    GIN-индексом создаётся миграцией только на PostgreSQL, поэтому модель
+    неуправляемая, а связь с товаром не участвует в каскадном удалении Django
+    (строки удаляет ON DELETE CASCADE в БД).
+    """
+    product = models.OneToOneField(
+        Product, on_delete=models.DO_NOTHING, primary_key=True, db_constraint=False, related_name='search_document',
+    )
+    document = SearchVectorField()
+
+    class Meta:
+        managed = False
+        db_table = 'shop_product_search'
+
 class Cart(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Итоги корзины поддерживаются инкрементально (см. shop/cart_totals.py)
+    item_count = models.IntegerField(default=0)
+    quantity_total = models.IntegerField(default=0)
+    # С запасом: до CartItem.MAX_QUANTITY штук по максимальной цене в каждой позиции
+    subtotal = models.DecimalField(max_digits=20, decimal_places=2, default=0)
 
     def __str__(self):
         return f"Cart of {self.user.username}"
 
 class CartItem(models.Model):
+    #: Предел количества в позиции, в том числе после повторных добавлений
+    MAX_QUANTITY = 9999
+
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    quantity = models.PositiveIntegerField(default=1)
+    quantity = models.PositiveIntegerField(default=1, validators=[MaxValueValidator(MAX_QUANTITY)])
+
+    class Meta:
+        constraints = [
+            # Один товар — одна позиция; повторное добавление увеличивает количество
+            models.UniqueConstraint(fields=['cart', 'product'], name='cartitem_cart_product_uniq'),
+        ]
 
     def __str__(self):
         return f"{self.quantity} of {self.product.name} in cart"
+
+class StockReservation(models.Model):
+    """Единицы товара, отложенные под позицию корзины: они уже списаны с Product.stock."""
+    # Без каскада и внешнего ключа в БД: позиции корзины удаляются одним DELETE, как раньше,
+    # а бронь удалённой в обход shop/stock.py позиции осиротеет и вернётся при очистке
+    cart_item = models.OneToOneField(
+        CartItem, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='reservation',
+    )
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.quantity} of {self.product_id} until {self.expires_at:%Y-%m-%d %H:%M}"
     
 class Order(models.Model):
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
@@ -72,6 +132,14 @@ class Order(models.Model):
         default="pending",
     )
 
+    class Meta:
+        indexes = [
+            # Заказы пользователя и админский список — новые сверху, с фильтром по статусу
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='order_status_created_idx'),
+            models.Index(fields=['-created_at'], name='order_created_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.id} by {self.user.username}"
 
@@ -82,4 +150,115 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
 
     def __str__(self):
-        return f"{self.quantity} x {self.product.name} in Order {self.order.id}"
\ No newline at end of file
+        return f"{self.quantity} x {self.product.name} in Order {self.order.id}"
+
+class Task(models.Model):
+    """Фоновая задача в очереди (shop/task_queue.py)."""
+
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+    name = models.CharField(max_length=200)  # Путь к функции: 'shop.checkout.send_order_confirmation'
+    kwargs = models.JSONField(default=dict)
+    status = models.CharField(
+        max_length=10,
+        choices=[(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')],
+        default=QUEUED,
+    )
+    idempotency_key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField()
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Воркер выбирает готовые к запуску задачи по статусу и времени
+            models.Index(fields=['status', 'run_at'], name='task_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} [{self.status}]"
+
+
+class SalesRollup(models.Model):
+    """Продажи за день в разрезе статуса заказа (shop/rollups.py). Строки пересчитываются целыми днями."""
+
+    day = models.DateField()
+    status = models.CharField(max_length=20)
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class DailySales(SalesRollup):
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['day', 'status'], name='dailysales_day_status_uniq')]
+
+
+class DailyProductSales(SalesRollup):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status', 'product'], name='dailyproductsales_uniq'),
+        ]
+
+
+class DailyBrandSales(SalesRollup):
+    brand = models.ForeignKey(Brand, on_delete=models.CASCADE, related_name='+', null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status', 'brand'], name='dailybrandsales_uniq'),
+        ]
+
+
+class DailyCategorySales(SalesRollup):
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status', 'category'], name='dailycategorysales_uniq'),
+        ]
+
+
+class RollupState(models.Model):
+    """Отметка, до какого заказа (по id) сводные таблицы уже посчитаны."""
+
+    name = models.CharField(max_length=50, primary_key=True)
+    last_order_id = models.BigIntegerField(default=0)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+
+
+class RollupDirtyDay(models.Model):
+    """День, в котором изменились старые заказы (статус, позиции) и сводку нужно пересчитать."""
+
+    day = models.DateField(unique=True)
+
+
+class CoPurchase(models.Model):
+    """Разреженная матрица совместных покупок: в скольких заказах были оба товара (хранятся обе пары)."""
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['product', 'other'], name='copurchase_product_other_uniq')]
+
+
+class ProductNeighbours(models.Model):
+    """Готовые рекомендации товара: top-k соседей по совместным покупкам (shop/recommendations.py)."""
+
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='neighbours')
+    order_count = models.PositiveIntegerField(default=0)  # В скольких заказах был товар
+    neighbour_ids = models.JSONField(default=list)
+    scores = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,267 @@
+import base64
+import binascii
+import json
+from operator import attrgetter
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import InvalidPage, Page
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class ProductPageNumberPagination(PageNumberPagination):
+    """Классическая пагинация по номеру страницы (?page=2&page_size=48)."""
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """То же, что paginate_queryset, но COUNT и выборка страницы — через async ORM."""
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        paginator.count = await queryset.acount()  # count — cached_property, подставляем заранее
+        page_number = self.get_page_number(request, paginator)
+        if page_number in self.last_page_strings:
+            page_number = paginator.num_pages
+        try:
+            number = paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+
+        bottom = (number - 1) * paginator.per_page
+        object_list = [obj async for obj in queryset[bottom:bottom + paginator.per_page]]
+        self.page = Page(object_list, number, paginator)
+        return object_list
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по курсору (keyset): следующая страница выбирается условием
+    WHERE (price, id) > (последняя цена, последний id), а не OFFSET,
+    поэтому глубокие страницы стоят столько же, сколько первая.
+    К сортировке всегда добавляется id, чтобы позиция была уникальной
+    даже при одинаковых ценах.
+    """
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('price',)
+    tiebreaker = 'id'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        return self.set_page([obj async for obj in queryset])
+
+    def get_page_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.model = queryset.model
+
+        self.cursor = self.decode_cursor(request)
+        self.reverse = bool(self.cursor and self.cursor['r'])
+        order = [self._flip(field) for field in self.ordering] if self.reverse else list(self.ordering)
+
+        queryset = self.select_ordering(queryset.order_by(*order))
+        if self.cursor is not None:
+            queryset = queryset.filter(self._after(order, self.cursor['p']))
+        return queryset[:self.page_size + 1]
+
+    def select_ordering(self, queryset):
+        """
+        Поля сортировки нужны курсору, даже если ?fields=/?omit= убрали их из
+        ответа: они добавляются к .values()/.only(). В ответ они не попадают —
+        сериализатор выводит только свои поля.
+        """
+        names = [field.lstrip('-') for field in self.ordering]
+        if queryset._fields is not None:  # .values() быстрого сериализатора
+            missing = [name for name in names if name not in queryset._fields]
+            return queryset.values(*queryset._fields, *missing) if missing else queryset
+        loaded, deferred = queryset.query.deferred_loading
+        if loaded and not deferred:  # .only()
+            missing = [name for name in names if name not in loaded]
+            return queryset.only(*loaded, *missing) if missing else queryset
+        return queryset
+
+    def set_page(self, results):
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if self.reverse:
+            # Пришли назад со следующей страницы — значит, она существует
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size,
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if issubclass(backend, OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        ordering = list(ordering or self.ordering)
+        if not any(field.lstrip('-') in (self.tiebreaker, 'pk') for field in ordering):
+            ordering.append(self.tiebreaker)
+        return ordering
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, instance, reverse):
+        position = [self._value(instance, field) for field in self.ordering]
+        payload = json.dumps({'p': position, 'r': int(reverse)}, default=str)
+        encoded = base64.urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            if not isinstance(cursor, dict) or set(cursor) != {'p', 'r'} or cursor['r'] not in (0, 1):
+                raise ValueError
+            position = cursor['p']
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+            # Значения приводятся к типам полей здесь, а не падают потом в filter()
+            return {
+                'p': [self._to_python(field, value) for field, value in zip(self.ordering, position)],
+                'r': bool(cursor['r']),
+            }
+        except (TypeError, ValueError, binascii.Error, ValidationError, FieldDoesNotExist):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _to_python(self, field, value):
+        if value is None or isinstance(value, (dict, list, bool)):
+            raise ValueError
+        model, names = self.model, field.lstrip('-').split('__')
+        for name in names[:-1]:
+            model = model._meta.get_field(name).related_model
+        name = names[-1]
+        model_field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+        return model_field.to_python(value)
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def _value(instance, field):
+        name = field.lstrip('-')
+        if isinstance(instance, dict):  # строка из .values()
+            return instance[name]
+        return attrgetter(name.replace('__', '.'))(instance)
+
+    @staticmethod
+    def _after(order, position):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        condition, equal = Q(), Q()
+        for field, value in zip(order, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+
+class ProductPagination(BasePagination):
+    """
+    Пагинация каталога: по умолчанию постраничная, а при ?paginate=cursor
+    (или при наличии ?cursor=...) — по курсору.
+    """
+    mode_query_param = 'paginate'
+    page_number_class = ProductPageNumberPagination
+    keyset_class = KeysetPagination
+
+    def get_paginator(self, request):
+        params = request.query_params
+        if params.get(self.mode_query_param) == 'cursor' or self.keyset_class.cursor_query_param in params:
+            return self.keyset_class()
+        return self.page_number_class()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.paginator = self.get_paginator(request)
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.paginator = self.get_paginator(request)
+        return await self.paginator.apaginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.page_number_class().get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        return self.page_number_class().get_schema_operation_parameters(view)
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.paginator, 'display_page_controls', False)
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+
+async def apaginate_queryset(paginator, queryset, request, view=None):
+    """Асинхронная пагинация; для классов без apaginate_queryset — в потоке."""
+    if hasattr(paginator, 'apaginate_queryset'):
+        return await paginator.apaginate_queryset(queryset, request, view)
+    return await sync_to_async(paginator.paginate_queryset)(queryset, request, view)
@@ -0,0 +1,159 @@
+from collections import namedtuple
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+# select_related — кортеж путей, prefetch_related — кортеж (путь, модель, вложенный план),
+# only — поля для .only() у подгружаемой модели (None — все)
+QueryPlan = namedtuple('QueryPlan', ['select_related', 'prefetch_related', 'only'], defaults=[None])
+
+
+def _relation(model, name):
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+    return field if field.is_relation else None
+
+
+def _merge(select, prefetch, plan, prefix):
+    select.extend(prefix + path for path in plan.select_related)
+    prefetch.extend((prefix + path, model, subplan) for path, model, subplan in plan.prefetch_related)
+
+
+@lru_cache(maxsize=None)
+def get_query_plan(serializer_class):
+    """
+    Строит план подгрузки связей по полям сериализатора:
+    to-one связи (в т.ч. source='brand.name') — через select_related,
+    to-many и вложенные many=True — через prefetch_related с собственным планом.
+    Дополнительно учитываются Meta.select_related / Meta.prefetch_related.
+    План считается один раз на класс сериализатора.
+    """
+    meta = getattr(serializer_class, 'Meta', None)
+    model = getattr(meta, 'model', None)
+    select = list(getattr(meta, 'select_related', ()))
+    prefetch = [(path, None, None) for path in getattr(meta, 'prefetch_related', ())]
+    if model is None:
+        return QueryPlan(tuple(select), tuple(prefetch))
+
+    for field in serializer_class().fields.values():
+        if field.write_only or field.source == '*':
+            continue
+
+        # Спускаемся по to-one связям пути source ('brand.name' -> brand)
+        current, path = model, []
+        for attr in field.source_attrs:
+            relation = _relation(current, attr)
+            if relation is None:
+                break
+            if relation.one_to_many or relation.many_to_many:
+                lookup = '__'.join(path + [attr])
+                child = getattr(field, 'child', None) or getattr(field, 'child_relation', None)
+                if isinstance(child, serializers.ModelSerializer):
+                    subplan = get_query_plan(type(child))
+                elif isinstance(child, serializers.RelatedField) and child.use_pk_only_optimization():
+                    # Нужны только pk (и FK для сопоставления с родителем)
+                    subplan = QueryPlan((), (), (relation.field.name,) if relation.one_to_many else ('pk',))
+                else:
+                    subplan = None
+                prefetch.append((lookup, relation.related_model, subplan))
+                break
+            path.append(attr)
+            current = relation.related_model
+        else:
+            if not path:
+                continue
+            lookup = '__'.join(path)
+            if isinstance(field, serializers.ModelSerializer):
+                _merge(select, prefetch, get_query_plan(type(field)), lookup + '__')
+                select.append(lookup)
+            elif not (len(path) == 1 and isinstance(field, serializers.RelatedField)
+                      and field.use_pk_only_optimization()):
+                # PrimaryKeyRelatedField на прямой FK берёт *_id без запроса
+                select.append(lookup)
+            continue
+
+        if path and len(field.source_attrs) > len(path):
+            select.append('__'.join(path))
+
+    return QueryPlan(tuple(dict.fromkeys(select)), tuple(prefetch))
+
+
+@lru_cache(maxsize=None)
+def get_only_fields(serializer_class):
+    """
+    Поля модели для .only(): столбцы, которые прочитает serializer_class
+    (в т.ч. 'brand__name' для source='brand.name' и поля вложенных to-one
+    сериализаторов), и связи из Meta.select_related. to-many связям нужен
+    только pk. None — если поле читает не столбец (source='*', свойство,
+    метод модели): тогда откладывать ничего нельзя.
+    """
+    model = serializer_class.Meta.model
+    only = []
+    for field in serializer_class().fields.values():
+        if field.write_only:
+            continue
+        if field.source == '*':
+            return None
+        current, path = model, []
+        for attr in field.source_attrs:
+            try:
+                model_field = current._meta.get_field(attr)
+            except FieldDoesNotExist:
+                return None
+            if model_field.one_to_many or model_field.many_to_many:
+                break
+            if model_field.is_relation and not model_field.concrete:
+                return None
+            path.append(attr)
+            if not model_field.is_relation:
+                break
+            current = model_field.related_model
+        if not path:
+            continue
+        lookup = '__'.join(path)
+        if isinstance(field, serializers.ModelSerializer):
+            nested = get_only_fields(type(field))
+            if nested is None:
+                return None
+            only.extend(f'{lookup}__{name}' for name in nested)
+        only.append(lookup)
+
+    for path in get_query_plan(serializer_class).select_related:
+        if not any(name == path or name.startswith(path + '__') for name in only):
+            only.append(path)
+    return tuple(dict.fromkeys(only))
+
+
+def apply_query_plan(queryset, plan):
+    if plan.select_related:
+        queryset = queryset.select_related(*plan.select_related)
+    for lookup, model, subplan in plan.prefetch_related:
+        if model is None:
+            queryset = queryset.prefetch_related(lookup)
+            continue
+        inner = model._default_manager.all()
+        if subplan is not None:
+            inner = apply_query_plan(inner, subplan)
+            if subplan.only is not None:
+                inner = inner.only(*subplan.only)
+        queryset = queryset.prefetch_related(Prefetch(lookup, queryset=inner))
+    return queryset
+
+
+def prefetch_for_serializer(queryset, serializer_class):
+    """Добавляет к queryset все связи, которые прочитает serializer_class."""
+    return apply_query_plan(queryset, get_query_plan(serializer_class))
+
+
+class PrefetchRelatedMixin:
+    """
+    Миксин для viewset'ов: queryset автоматически дополняется
+    select_related/prefetch_related по плану сериализатора, поэтому
+    число запросов не растёт вместе с числом строк.
+    """
+    def get_queryset(self):
+        return prefetch_for_serializer(super().get_queryset(), self.get_serializer_class())
@@ -0,0 +1,321 @@
+import codecs
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Brand, Cart, Category, Product
+from . import cart_totals, response_cache, stock
+from .search import get_search_backend
+
+#: Колонки фида (одни и те же для импорта и экспорта). stock в фиде — физический
+#: остаток: свободные единицы плюс забронированные в корзинах (shop/stock.py)
+COLUMNS = ('sku', 'name', 'description', 'price', 'stock', 'available', 'category', 'brand')
+UPDATE_FIELDS = (
+    'name', 'description', 'price', 'stock', 'available', 'sold_out', 'category', 'brand', 'updated_at', 'version',
+)
+FORMATS = ('csv', 'jsonl')
+PATH_SEPARATOR = ' / '
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'да'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'нет'}
+
+
+class RowError(ValueError):
+    pass
+
+
+class ImportReport:
+    """Итог импорта. Ошибок хранится не больше max_errors, но считаются все."""
+
+    def __init__(self, max_errors=1000):
+        self.created = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+        self.max_errors = max_errors
+
+    def add_error(self, line, sku, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'sku': sku, 'error': message})
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+
+def category_paths():
+    """{id: 'Родитель / Потомок'} для всех категорий (их немного)."""
+    rows = {pk: (name, parent) for pk, name, parent in Category.objects.values_list('id', 'name', 'parent_id')}
+    paths = {}
+
+    def path(pk):
+        if pk not in paths:
+            name, parent = rows[pk]
+            paths[pk] = name if parent is None else path(parent) + PATH_SEPARATOR + name
+        return paths[pk]
+
+    for pk in rows:
+        path(pk)
+    return paths
+
+
+class Lookups:
+    """
+    Справочники брендов и категорий в памяти: строка фида превращается в id
+    без запросов. Категория задаётся id, путём 'Родитель / Потомок' или
+    уникальным названием; неизвестные бренды создаются.
+    """
+
+    def __init__(self, create_brands=True):
+        self.create_brands = create_brands
+        self.brands = {brand.name.lower(): brand for brand in Brand.objects.only('id', 'name')}
+        self.category_ids = set()
+        self.categories = {}
+        for pk, path in category_paths().items():
+            self.category_ids.add(pk)
+            self.categories[path.lower()] = pk
+            name = path.rsplit(PATH_SEPARATOR, 1)[-1].lower()
+            # Одинаковые названия в разных ветках — только по пути
+            self.categories[name] = None if self.categories.get(name, pk) != pk else pk
+
+    def category(self, value):
+        value = str(value or '').strip()
+        if value.isdigit() and int(value) in self.category_ids:
+            return int(value)
+        pk = self.categories.get(value.lower())
+        if pk is None:
+            if value.lower() in self.categories:
+                raise RowError(f'Ambiguous category "{value}", use the full path')
+            raise RowError(f'Unknown category "{value}"')
+        return pk
+
+    def brand(self, value):
+        value = str(value or '').strip()
+        if not value:
+            return None
+        brand = self.brands.get(value.lower())
+        if brand is None:
+            if not self.create_brands:
+                raise RowError(f'Unknown brand "{value}"')
+            brand = self.brands[value.lower()] = Brand.objects.create(name=value)
+        return brand
+
+
+def _decimal(value):
+    try:
+        number = Decimal(str(value).strip().replace(',', '.'))
+    except InvalidOperation:
+        raise RowError(f'Invalid price "{value}"')
+    if not number.is_finite() or number < 0 or number >= Decimal('1e8'):
+        raise RowError(f'Invalid price "{value}"')
+    return number.quantize(Decimal('0.01'))
+
+
+def _int(value):
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        raise RowError(f'Invalid stock "{value}"')
+    if number < 0:
+        raise RowError(f'Invalid stock "{value}"')
+    return number
+
+
+def _bool(value):
+    if isinstance(value, bool):
+        return value
+    value = str(value if value is not None else '').strip().lower()
+    if value in TRUE_VALUES or value == '':
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise RowError(f'Invalid available "{value}"')
+
+
+def parse_row(row, lookups):
+    sku = str(row.get('sku') or '').strip()
+    if not sku:
+        raise RowError('sku is required')
+    if len(sku) > Product._meta.get_field('sku').max_length:
+        raise RowError('sku is too long')
+    name = str(row.get('name') or '').strip()
+    if not name:
+        raise RowError('name is required')
+    if len(name) > Product._meta.get_field('name').max_length:
+        raise RowError('name is too long')
+    return Product(
+        sku=sku,
+        name=name,
+        description=str(row.get('description') or ''),
+        price=_decimal(row.get('price')),
+        stock=_int(row.get('stock') or 0),
+        available=_bool(row.get('available')),
+        category_id=lookups.category(row.get('category')),
+        brand=lookups.brand(row.get('brand')),
+    )
+
+
+def read_rows(stream, format):
+    """(номер строки, dict) из текстового потока — построчно, без чтения файла целиком."""
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif format == 'jsonl':
+        for line_num, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield line_num, exc
+                continue
+            yield line_num, row if isinstance(row, dict) else ValueError('Row must be a JSON object')
+    else:
+        raise ValueError(f'Unknown format "{format}"')
+
+
+def _save_chunk(products, report):
+    """
+    Создаёт новые и обновляет существующие по SKU товары одной транзакцией.
+    Существующие строки блокируются (как при оформлении заказа — по id), у
+    них растёт version, а из физического остатка фида вычитаются брони:
+    остаток меньше забронированного — ошибка строки.
+    """
+    now = timezone.now()
+    new, changed, repriced = [], [], []
+    with transaction.atomic():
+        existing = {
+            sku: (pk, price)
+            for sku, pk, price in Product.objects.select_for_update().filter(sku__in=products).order_by('pk')
+            .values_list('sku', 'id', 'price')
+        }
+        held = stock.reserved([pk for pk, price in existing.values()])
+        for sku, (line, product) in products.items():
+            if sku not in existing:
+                product.available, product.sold_out = stock.availability(product, product.stock, product.available)
+                new.append(product)
+                continue
+            product.pk, old_price = existing[sku]
+            reserved = held.get(product.pk, 0)
+            if product.stock < reserved:
+                report.add_error(line, sku, f'stock {product.stock} is less than {reserved} reserved in carts')
+                continue
+            product.stock -= reserved
+            product.available, product.sold_out = stock.availability(product, product.stock, product.available)
+            product.version = F('version') + 1
+            product.updated_at = now
+            changed.append(product)
+            if old_price != product.price:
+                repriced.append(product.pk)
+
+        Product.objects.bulk_create(new)
+        Product.objects.bulk_update(changed, UPDATE_FIELDS)
+        if repriced:
+            # bulk_update не шлёт сигналов — пересчитываем затронутые корзины сами
+            cart_totals.recalculate(Cart.objects.filter(items__product_id__in=repriced))
+        get_search_backend().index(new + changed)
+        response_cache.invalidate(*[f'product:{product.pk}' for product in changed])
+    report.created += len(new)
+    report.updated += len(changed)
+
+
+def import_products(stream, format='csv', chunk_size=1000, create_brands=True, max_errors=1000):
+    """
+    Потоковый импорт товаров из CSV/JSONL, ключ — sku. Строки читаются по
+    одной и сохраняются пачками по chunk_size (bulk_create новых, bulk_update
+    существующих), так что память не зависит от размера файла. Ошибочные
+    строки пропускаются и попадают в отчёт с номером строки.
+    """
+    report = ImportReport(max_errors)
+    lookups = Lookups(create_brands=create_brands)
+    chunk = {}
+    for line, row in read_rows(stream, format):
+        if isinstance(row, Exception):
+            report.add_error(line, None, str(row))
+            continue
+        try:
+            product = parse_row(row, lookups)
+        except RowError as exc:
+            report.add_error(line, row.get('sku'), str(exc))
+            continue
+        chunk[product.sku] = (line, product)  # повтор SKU в пачке — побеждает последняя строка
+        if len(chunk) >= chunk_size:
+            _save_chunk(chunk, report)
+            chunk = {}
+    if chunk:
+        _save_chunk(chunk, report)
+    response_cache.invalidate('product', 'brand')
+    return report
+
+
+class _Echo:
+    """Псевдофайл для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(chunk_size=2000):
+    paths = category_paths()
+    rows = Product.objects.order_by('pk').annotate(on_hand=stock.on_hand()).values_list(
+        'sku', 'name', 'description', 'price', 'on_hand', 'available', 'category_id', 'brand__name',
+    )
+    for sku, name, description, price, on_hand, available, category_id, brand in rows.iterator(chunk_size=chunk_size):
+        yield {
+            'sku': sku or '', 'name': name, 'description': description, 'price': str(price),
+            'stock': on_hand, 'available': available, 'category': paths[category_id], 'brand': brand or '',
+        }
+
+
+def export_products(format='csv', chunk_size=2000):
+    """Генератор строк CSV/JSONL всего каталога; товары читаются через iterator()."""
+    if format == 'csv':
+        writer = csv.DictWriter(_Echo(), fieldnames=COLUMNS)
+        yield writer.writeheader()
+        for row in export_rows(chunk_size):
+            yield writer.writerow(row)
+    elif format == 'jsonl':
+        for row in export_rows(chunk_size):
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+    else:
+        raise ValueError(f'Unknown format "{format}"')
+
+
+async def aexport_products(format='csv', chunk_size=2000):
+    """
+    export_products для ASGI: синхронный генератор под ASGI Django буферизует
+    целиком. Здесь строки читаются пачками по chunk_size в потоке для работы
+    с БД (sync_to_async), а наружу отдаются по мере готовности.
+    """
+    lines = export_products(format, chunk_size)
+    next_chunk = sync_to_async(lambda: ''.join(islice(lines, chunk_size)))
+    while chunk := await next_chunk():
+        yield chunk
+
+
+def text_stream(binary, chunk_size=64 * 1024):
+    """
+    Текстовый поток поверх загруженного файла (BOM от Excel отбрасывается).
+    Импорт коммитит пачки по ходу чтения, поэтому кодировка сначала
+    проверяется по всему файлу (кусками, без чтения в память):
+    UnicodeDecodeError поднимается до первой записи в БД.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    while chunk := binary.read(chunk_size):
+        decoder.decode(chunk)
+    decoder.decode(b'', final=True)
+    binary.seek(0)
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
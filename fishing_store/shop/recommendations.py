@@ -0,0 +1,187 @@
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import CoPurchase, OrderItem, Product, ProductNeighbours, RollupState
+from . import response_cache, rollups
+
+DEFAULTS = {
+    # Сколько соседей хранить на товар
+    'TOP_K': 20,
+    # Пары, встречавшиеся реже, в рекомендации не попадают
+    'MIN_SUPPORT': 1,
+    # Заказы с большим числом разных товаров (оптовые) не учитываются: пар в них квадратично много
+    'MAX_BASKET': 50,
+    'BATCH_SIZE': 2000,
+}
+
+STATE = 'copurchase'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SHOP_RECOMMENDATIONS', {})}
+
+
+def _encode(left, right, base):
+    return left * base + right
+
+
+def count_pairs(lines, max_basket):
+    """
+    Строки (заказ, товар) -> упорядоченные пары товаров из одного заказа с
+    числом заказов, где они встретились вместе, и число заказов по товарам.
+    Пары строятся без цикла по заказам: каждая позиция повторяется по
+    размеру своего заказа и сочетается со всеми позициями этого заказа.
+    """
+    empty = np.empty((0, 2), dtype=np.int64), np.empty(0, dtype=np.int64), (np.empty(0, dtype=np.int64),) * 2
+    if not len(lines):
+        return empty
+    base = int(lines[:, 1].max()) + 1
+    # Одна строка на (заказ, товар), по порядку заказов
+    keys = np.unique(_encode(lines[:, 0], lines[:, 1], base))
+    orders, products = keys // base, keys % base
+    frequency = np.unique(products, return_counts=True)
+
+    starts, sizes = np.unique(orders, return_index=True, return_counts=True)[1:]
+    item_start, item_size = np.repeat(starts, sizes), np.repeat(sizes, sizes)
+    items = np.nonzero((item_size >= 2) & (item_size <= max_basket))[0]
+    if not len(items):
+        return empty[:2] + (frequency,)
+    repeats = item_size[items]
+    left = np.repeat(items, repeats)
+    offsets = np.arange(repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    right = np.repeat(item_start[items], repeats) + offsets
+    distinct = left != right
+
+    pairs, counts = np.unique(_encode(products[left[distinct]], products[right[distinct]], base), return_counts=True)
+    return np.stack([pairs // base, pairs % base], axis=1), counts, frequency
+
+
+def _merge_counts(pairs, counts, batch_size):
+    """Прибавляет новые пары к CoPurchase: читает текущие счётчики затронутых товаров и пишет суммы."""
+    if not len(pairs):
+        return
+    existing = np.array(list(
+        CoPurchase.objects.filter(product_id__in=np.unique(pairs[:, 0]).tolist()).values_list('product_id', 'other_id', 'count')
+    ), dtype=np.int64).reshape(-1, 3)
+    totals = counts.copy()
+    if len(existing):
+        base = int(max(pairs.max(), existing[:, :2].max())) + 1
+        old_keys = _encode(existing[:, 0], existing[:, 1], base)
+        order = np.argsort(old_keys)
+        old_keys, old_counts = old_keys[order], existing[order, 2]
+        keys = _encode(pairs[:, 0], pairs[:, 1], base)
+        position = np.minimum(np.searchsorted(old_keys, keys), len(old_keys) - 1)
+        match = old_keys[position] == keys
+        totals[match] += old_counts[position[match]]
+    CoPurchase.objects.bulk_create(
+        [CoPurchase(product_id=a, other_id=b, count=c) for (a, b), c in zip(pairs.tolist(), totals.tolist())],
+        batch_size=batch_size, update_conflicts=True, unique_fields=['product', 'other'], update_fields=['count'],
+    )
+
+
+def _merge_frequency(products, counts, batch_size):
+    existing = dict(ProductNeighbours.objects.filter(product_id__in=products.tolist()).values_list('product_id', 'order_count'))
+    ProductNeighbours.objects.bulk_create(
+        [ProductNeighbours(product_id=pk, order_count=existing.get(pk, 0) + count) for pk, count in zip(products.tolist(), counts.tolist())],
+        batch_size=batch_size, update_conflicts=True, unique_fields=['product'], update_fields=['order_count'],
+    )
+
+
+def rank(products, config=None):
+    """
+    Пересчитывает top-k соседей товаров. Оценка — косинусная мера
+    count / sqrt(заказов с A * заказов с B): популярные товары не попадают
+    в рекомендации ко всему подряд.
+    """
+    config = config or get_config()
+    for start in range(0, len(products), 500):
+        chunk = products[start:start + 500]
+        rows = np.array(list(
+            CoPurchase.objects.filter(product_id__in=chunk, count__gte=config['MIN_SUPPORT'])
+            .values_list('product_id', 'other_id', 'count')
+        ), dtype=np.int64).reshape(-1, 3)
+        known = np.unique(np.concatenate([rows[:, :2].ravel(), np.array(chunk, dtype=np.int64)]))
+        frequency = dict(ProductNeighbours.objects.filter(product_id__in=known.tolist()).values_list('product_id', 'order_count'))
+        order_count = np.array([frequency.get(pk, 0) for pk in known.tolist()], dtype=np.float64)
+
+        product, other, count = rows[:, 0], rows[:, 1], rows[:, 2]
+        norm = np.sqrt(order_count[np.searchsorted(known, product)] * order_count[np.searchsorted(known, other)])
+        score = count / np.maximum(norm, 1)
+        # По товару, внутри — по убыванию оценки; первые TOP_K в каждой группе
+        order = np.lexsort((other, -score, product))
+        product, other, score = product[order], other[order], score[order]
+        group_start = np.searchsorted(product, product, side='left')
+        keep = np.arange(len(product)) - group_start < config['TOP_K']
+
+        neighbours = {pk: ([], []) for pk in chunk}
+        for pk, neighbour, value in zip(product[keep].tolist(), other[keep].tolist(), score[keep].tolist()):
+            neighbours[pk][0].append(neighbour)
+            neighbours[pk][1].append(round(value, 4))
+        ProductNeighbours.objects.bulk_create(
+            [ProductNeighbours(product_id=pk, neighbour_ids=ids, scores=scores) for pk, (ids, scores) in neighbours.items()],
+            batch_size=config['BATCH_SIZE'], update_conflicts=True, unique_fields=['product'],
+            update_fields=['neighbour_ids', 'scores', 'updated_at'],
+        )
+
+
+def refresh(rebuild=False):
+    """
+    Добавляет в матрицу совместных покупок заказы после отметки и
+    пересчитывает соседей товаров из этих заказов. Возвращает число
+    пересчитанных товаров. rebuild=True строит всё заново.
+    """
+    config = get_config()
+    with transaction.atomic():
+        state, _ = RollupState.objects.select_for_update().get_or_create(name=STATE)
+        if rebuild:
+            CoPurchase.objects.all().delete()
+            ProductNeighbours.objects.update(order_count=0, neighbour_ids=[], scores=[])
+        orders, high_water = rollups.pending_orders(0 if rebuild else state.last_order_id)
+        if high_water is None:
+            return 0
+        lines = np.array(list(
+            OrderItem.objects.filter(order__in=orders).values_list('order_id', 'product_id')
+        ), dtype=np.int64).reshape(-1, 2)
+        pairs, counts, (products, frequency) = count_pairs(lines, config['MAX_BASKET'])
+        _merge_counts(pairs, counts, config['BATCH_SIZE'])
+        _merge_frequency(products, frequency, config['BATCH_SIZE'])
+        rank(products.tolist(), config)
+        state.last_order_id = high_water
+        state.save()
+    response_cache.invalidate('recommendations')
+    return len(products)
+
+
+def recommend(product_id, limit=8):
+    """
+    Рекомендации к товару: сначала «покупают вместе», затем, если их не
+    хватает (новый или редкий товар), популярные товары той же категории
+    и того же бренда. Возвращает [(товар, источник), ...] или None, если
+    товара нет. Три-четыре запроса по индексам.
+    """
+    source = Product.objects.filter(pk=product_id).values('category_id', 'brand_id', 'neighbours__neighbour_ids').first()
+    if source is None:
+        return None
+    available = Product.objects.filter(available=True, stock__gt=0)
+    seen = {product_id}
+    result = []
+
+    ids = [pk for pk in source['neighbours__neighbour_ids'] or [] if pk not in seen]
+    if ids:
+        found = available.in_bulk(ids[:limit * 2])
+        for pk in ids:
+            if pk in found and len(result) < limit:
+                result.append((found[pk], 'bought_together'))
+                seen.add(pk)
+
+    popular = [F('neighbours__order_count').desc(nulls_last=True), '-pk']
+    for source_name, lookup in (('category', 'category_id'), ('brand', 'brand_id')):
+        if len(result) >= limit or source[lookup] is None:
+            continue
+        fallback = available.filter(**{lookup: source[lookup]}).exclude(pk__in=seen).order_by(*popular)
+        for product in fallback[:limit - len(result)]:
+            result.append((product, source_name))
+            seen.add(product.pk)
+    return result
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import uuid
+from calendar import timegm
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+DEFAULTS = {
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SHOP_RESPONSE_CACHE', {})}
+
+
+def get_cache():
+    return caches[get_config()['ALIAS']]
+
+
+def _generation_key(tag):
+    return f'shop:gen:{tag}'
+
+
+def get_generations(tags):
+    """
+    Текущие поколения тегов. Поколение — случайная строка, а не счётчик:
+    если ключ вытеснен из кеша, новое значение не совпадёт со старым
+    и устаревшие ответы не оживут.
+    """
+    cache = get_cache()
+    keys = [_generation_key(tag) for tag in tags]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            generation = uuid.uuid4().hex
+            cache.add(key, generation, None)
+            # Победитель гонки за add; DummyCache не хранит ничего — тогда своё значение
+            generations[key] = cache.get(key) or generation
+    return [generations[key] for key in keys]
+
+
+def _bump(tags):
+    get_cache().set_many({_generation_key(tag): uuid.uuid4().hex for tag in tags}, None)
+
+
+def invalidate(*tags):
+    """Инвалидирует все закешированные ответы, зависящие от тегов."""
+    # Сразу и после коммита — чтобы не закешировать незакоммиченное состояние
+    _bump(tags)
+    transaction.on_commit(lambda: _bump(tags))
+
+
+def normalize_query(query_params):
+    return '&'.join(
+        f'{key}={value}'
+        for key in sorted(query_params)
+        for value in sorted(query_params.getlist(key))
+        if value != ''
+    )
+
+
+def _last_modified(data, field):
+    if not isinstance(data, dict) or field not in data:
+        return None
+    value = parse_datetime(str(data[field]))
+    return timegm(value.utctimetuple()) if value else None
+
+
+class CachedResponseMixin:
+    """
+    Read-through кеш GET-ответов list/retrieve. Ключ строится из действия,
+    pk, нормализованной строки запроса (фильтры, сортировка, поиск, страница)
+    и поколений тегов из cache_tags; сохранение/удаление моделей меняет
+    поколение своих тегов (см. shop/signals.py), и старые ключи просто
+    перестают использоваться. Ответы получают ETag, а detail-ответы ещё и
+    Last-Modified по last_modified_field, поэтому клиент может получить 304.
+    """
+    #: Теги для каждого действия; {pk} подставляется из URL
+    cache_tags = {}
+    last_modified_field = None
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(request, super().retrieve, *args, **kwargs)
+
+    def get_cache_key(self, request):
+        tags = [tag.format(**self.kwargs) for tag in self.cache_tags.get(self.action, ())]
+        parts = [
+            self.basename, self.action, str(self.kwargs.get(self.lookup_url_kwarg or self.lookup_field, '')),
+            request.get_host(), normalize_query(request.query_params), *get_generations(tags),
+        ]
+        return 'shop:response:' + hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+    def make_cache_entry(self, response):
+        payload = json.dumps(response.data, sort_keys=True, default=str).encode()
+        return {
+            'data': response.data,
+            'etag': '"%s"' % hashlib.md5(payload).hexdigest(),
+            'last_modified': (
+                _last_modified(response.data, self.last_modified_field) if self.last_modified_field else None
+            ),
+        }
+
+    def conditional_response(self, request, entry, response=None):
+        if response is None:
+            response = Response(entry['data'])
+        response['ETag'] = entry['etag']
+        if entry['last_modified'] is not None:
+            response['Last-Modified'] = http_date(entry['last_modified'])
+        return get_conditional_response(
+            request, etag=entry['etag'], last_modified=entry['last_modified'], response=response,
+        )
+
+    def get_cached_response(self, request, handler, *args, **kwargs):
+        cache = get_cache()
+        key = self.get_cache_key(request)
+        entry = cache.get(key)
+        if entry is not None:
+            return self.conditional_response(request, entry)
+        response = handler(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        entry = self.make_cache_entry(response)
+        cache.set(key, entry, get_config()['TIMEOUT'])
+        return self.conditional_response(request, entry, response)
+
+    async def aget_cached_response(self, request, handler, *args, **kwargs):
+        """То же для async-представлений: handler — корутина, кеш — через async API."""
+        cache = get_cache()
+        key = await sync_to_async(self.get_cache_key)(request)
+        entry = await cache.aget(key)
+        if entry is not None:
+            return self.conditional_response(request, entry)
+        response = await handler(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        entry = self.make_cache_entry(response)
+        await cache.aset(key, entry, get_config()['TIMEOUT'])
+        return self.conditional_response(request, entry, response)
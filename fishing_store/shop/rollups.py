@@ -0,0 +1,126 @@
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    DailyBrandSales, DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem, RollupDirtyDay, RollupState,
+)
+from . import response_cache
+
+STATE = 'sales'
+#: Заказы моложе LAG не берутся: транзакция с меньшим id могла ещё не закоммититься
+LAG = timedelta(seconds=60)
+#: Сколько дней пересчитывается одной транзакцией
+DAYS_PER_BATCH = 31
+
+#: Сводная таблица, поле позиции заказа, по которому она группируется, и её поле для него
+ROLLUPS = [
+    (DailySales, None, None),
+    (DailyProductSales, 'product_id', 'product_id'),
+    (DailyBrandSales, 'product__brand_id', 'brand_id'),
+    (DailyCategorySales, 'product__category_id', 'category_id'),
+]
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def _start_of(day):
+    return datetime.combine(day, time.min, tzinfo=timezone.get_current_timezone())
+
+
+def mark_dirty(days):
+    """Помечает дни для пересчёта при следующем refresh (изменились уже учтённые заказы)."""
+    RollupDirtyDay.objects.bulk_create([RollupDirtyDay(day=day) for day in set(days)], ignore_conflicts=True)
+
+
+def pending_orders(last_id):
+    """
+    Заказы после отметки last_id, которые уже можно учитывать, и новая
+    отметка (None — таких нет). Отметка не перескакивает заказ моложе LAG.
+    """
+    orders = Order.objects.filter(pk__gt=last_id)
+    young = orders.filter(created_at__gte=timezone.now() - LAG).aggregate(value=Min('pk'))['value']
+    if young is not None:
+        orders = orders.filter(pk__lt=young)
+    return orders, orders.aggregate(value=Max('pk'))['value']
+
+
+def rebuild_days(days):
+    """
+    Пересчитывает сводки за дни целиком: строки дней удаляются и заново
+    собираются GROUP BY по позициям заказов этих дней. Пересчёт идемпотентен,
+    поэтому повторный или прерванный refresh ничего не задвоит.
+    """
+    days = sorted(set(days))
+    for start in range(0, len(days), DAYS_PER_BATCH):
+        batch = days[start:start + DAYS_PER_BATCH]
+        items = OrderItem.objects.annotate(day=TruncDate('order__created_at')).filter(
+            # Диапазон по created_at — чтобы работал индекс; точный отбор — по дню
+            order__created_at__gte=_start_of(batch[0]),
+            order__created_at__lt=_start_of(batch[-1] + timedelta(days=1)),
+            day__in=batch,
+        )
+        with transaction.atomic():
+            for model, field, model_field in ROLLUPS:
+                model.objects.filter(day__in=batch).delete()
+                rows = items.values('day', 'order__status', *([field] if field else [])).order_by().annotate(
+                    total_quantity=Sum('quantity'),
+                    total_revenue=Sum(F('quantity') * F('price'), output_field=MONEY),
+                    order_count=Count('order_id', distinct=True),
+                )
+                model.objects.bulk_create([
+                    model(
+                        day=row['day'], status=row['order__status'], quantity=row['total_quantity'],
+                        revenue=row['total_revenue'], orders=row['order_count'],
+                        **({model_field: row[field]} if field else {}),
+                    )
+                    for row in rows
+                ], batch_size=1000)
+    return len(days)
+
+
+def refresh(rebuild=False):
+    """
+    Дозаполняет сводки: дни новых заказов (id больше отметки) и дни, помеченные
+    грязными после правки старых заказов. rebuild=True пересчитывает всё.
+    Возвращает число пересчитанных дней.
+    """
+    with transaction.atomic():
+        state, _ = RollupState.objects.select_for_update().get_or_create(name=STATE)
+        new_orders, high_water = pending_orders(0 if rebuild else state.last_order_id)
+        days = set()
+        if high_water is not None:
+            days.update(new_orders.annotate(day=TruncDate('created_at')).values_list('day', flat=True).distinct())
+        dirty = list(RollupDirtyDay.objects.values_list('pk', 'day'))
+        days.update(day for pk, day in dirty)
+        if rebuild:
+            for model, field, model_field in ROLLUPS:
+                model.objects.all().delete()
+
+        count = rebuild_days(days)
+        RollupDirtyDay.objects.filter(pk__in=[pk for pk, day in dirty]).delete()
+        if high_water is not None:
+            state.last_order_id = high_water
+        state.refreshed_at = timezone.now()
+        state.save()
+    if count:
+        response_cache.invalidate('order-history')
+    return count
+
+
+def covered_until():
+    """
+    Первый день, сводки которого могут быть неполными: всё раньше него уже
+    посчитано. None — сводок ещё нет.
+    """
+    state = RollupState.objects.filter(name=STATE).first()
+    if state is None or state.refreshed_at is None:
+        return None
+    first_new = Order.objects.filter(pk__gt=state.last_order_id).aggregate(value=Min('created_at'))['value']
+    until = timezone.localdate(state.refreshed_at - LAG)
+    if first_new is not None:
+        until = min(until, timezone.localdate(first_new))
+    dirty = RollupDirtyDay.objects.order_by('day').values_list('day', flat=True).first()
+    return until if dirty is None else min(until, dirty)
@@ -0,0 +1,218 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework.filters import SearchFilter
+from rest_framework.settings import api_settings
+
+from .models import Product, ProductSearchDocument
+
+FTS_TABLE = 'shop_product_fts'
+
+
+def get_terms(query):
+    return re.findall(r'\w+', query or '')
+
+
+class SearchBackend:
+    """
+    Поисковый индекс товаров по name, description и названию бренда.
+    Бэкенд выбирается настройкой SHOP_SEARCH_BACKEND (путь к классу).
+    """
+
+    def filter_queryset(self, queryset, query, ranked=True):
+        raise NotImplementedError
+
+    def index(self, products):
+        """Добавляет или обновляет товары в индексе."""
+
+    def remove(self, product_ids):
+        """Удаляет товары из индекса."""
+
+    def rebuild(self, chunk_size=2000):
+        """Пересобирает индекс целиком. Возвращает число проиндексированных товаров."""
+        return 0
+
+
+class FTS5SearchBackend(SearchBackend):
+    """
+    Индекс SQLite FTS5 (таблица создаётся миграцией). Запрос разбивается на
+    слова, каждое ищется как префикс, результаты ранжируются по bm25 с весами
+    name > brand > description.
+    """
+    weights = (10.0, 1.0, 5.0)  # name, description, brand
+
+    def match(self, query):
+        terms = get_terms(query)
+        return ' '.join('"%s"*' % term for term in terms) if terms else None
+
+    def filter_queryset(self, queryset, query, ranked=True):
+        """
+        Совпадения и ранг — подзапросами к индексу внутри основного SQL, так что
+        LIMIT/OFFSET страницы и COUNT(*) считает база, без верхней границы на
+        число найденных товаров.
+        """
+        match = self.match(query)
+        if match is None:
+            return queryset
+        queryset = queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match]))
+        if not ranked:
+            return queryset
+        product_pk = '%s.%s' % (
+            connection.ops.quote_name(Product._meta.db_table), connection.ops.quote_name(Product._meta.pk.column),
+        )
+        rank = RawSQL(
+            f'SELECT bm25({FTS_TABLE}, %s, %s, %s) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = {product_pk}',
+            [*self.weights, match],
+        )
+        return queryset.order_by(rank.asc(), 'pk')
+
+    def _write(self, rows):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, description, brand) VALUES (%s, %s, %s, %s)',
+                rows,
+            )
+
+    def index(self, products):
+        products = list(products)
+        self.remove([product.pk for product in products])
+        self._write([
+            (product.pk, product.name, product.description, product.brand.name if product.brand_id else '')
+            for product in products
+        ])
+
+    def remove(self, product_ids):
+        if not product_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', list(product_ids))
+
+    @transaction.atomic
+    def rebuild(self, chunk_size=2000):
+        # Одной транзакцией: параллельные запросы видят старый индекс, а не пустой
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        rows = Product.objects.values_list('id', 'name', 'description', 'brand__name').iterator(chunk_size=chunk_size)
+        total, chunk = 0, []
+        for pk, name, description, brand in rows:
+            chunk.append((pk, name, description, brand or ''))
+            if len(chunk) >= chunk_size:
+                self._write(chunk)
+                total, chunk = total + len(chunk), []
+        self._write(chunk)
+        return total + len(chunk)
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Полнотекстовый поиск PostgreSQL: документы товаров (SearchVector с
+    весами name > brand > description) лежат в shop_product_search под
+    GIN-индексом (таблица создаётся миграцией). Слова запроса ищутся как
+    префиксы, ранг — SearchRank; фильтр и ранг — JOIN в основном SQL, как у
+    FTS5, так что страница и COUNT(*) считаются в базе.
+    """
+    config = 'simple'  # Без стемминга: префиксы, как у FTS5
+    weights = [0.0, 0.1, 0.5, 1.0]  # D, C (description), B (brand), A (name)
+
+    def match(self, query):
+        terms = get_terms(query)
+        if not terms:
+            return None
+        return SearchQuery(' & '.join(f'{term}:*' for term in terms), search_type='raw', config=self.config)
+
+    def filter_queryset(self, queryset, query, ranked=True):
+        match = self.match(query)
+        if match is None:
+            return queryset
+        queryset = queryset.filter(search_document__document=match)
+        if not ranked:
+            return queryset
+        rank = SearchRank(F('search_document__document'), match, weights=self.weights)
+        return queryset.order_by(rank.desc(), 'pk')
+
+    def _write(self, products):
+        """INSERT ... SELECT документов товаров из queryset одним запросом. Возвращает число строк."""
+        document = (
+            SearchVector('name', weight='A', config=self.config)
+            + SearchVector('brand__name', weight='B', config=self.config)
+            + SearchVector('description', weight='C', config=self.config)
+        )
+        rows = products.order_by().annotate(document=document).values_list('pk', 'document')
+        sql, params = rows.query.get_compiler(using=rows.db).as_sql()
+        table = connection.ops.quote_name(ProductSearchDocument._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (product_id, document) {sql} '
+                f'ON CONFLICT (product_id) DO UPDATE SET document = excluded.document',
+                params,
+            )
+            return cursor.rowcount
+
+    def index(self, products):
+        ids = [product.pk for product in products]
+        if ids:
+            self._write(Product.objects.filter(pk__in=ids))
+
+    def remove(self, product_ids):
+        if product_ids:
+            ProductSearchDocument.objects.filter(pk__in=list(product_ids)).delete()
+
+    @transaction.atomic
+    def rebuild(self, chunk_size=2000):
+        # Одной транзакцией, как у FTS5: до коммита запросы видят старый индекс
+        ProductSearchDocument.objects.all().delete()
+        return self._write(Product.objects.all())
+
+
+class LikeSearchBackend(SearchBackend):
+    """
+    Запасной вариант без индекса для прочих СУБД (не SQLite и не
+    PostgreSQL): каждое слово ищется через icontains, совпадения в
+    названии поднимаются выше.
+    """
+    fields = ('name', 'description', 'brand__name')
+
+    def filter_queryset(self, queryset, query, ranked=True):
+        terms = get_terms(query)
+        if not terms:
+            return queryset
+        for term in terms:
+            queryset = queryset.filter(Q(*[(f'{field}__icontains', term) for field in self.fields], _connector=Q.OR))
+        if ranked:
+            in_name = Q(*[('name__icontains', term) for term in terms])
+            queryset = queryset.order_by(Case(When(in_name, then=Value(0)), default=Value(1)), 'pk')
+        return queryset
+
+
+VENDOR_BACKENDS = {
+    'sqlite': 'shop.search.FTS5SearchBackend',
+    'postgresql': 'shop.search.PostgresSearchBackend',
+}
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    path = getattr(settings, 'SHOP_SEARCH_BACKEND', None)
+    if path is None:
+        path = VENDOR_BACKENDS.get(connection.vendor, 'shop.search.LikeSearchBackend')
+    return import_string(path)()
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    ?search=... через поисковый индекс вместо name ILIKE '%q%'.
+    Без явного ?ordering= результаты идут по релевантности.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        ranked = not request.query_params.get(api_settings.ORDERING_PARAM)
+        return get_search_backend().filter_queryset(queryset, query, ranked=ranked)
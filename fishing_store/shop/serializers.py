@@ -1,7 +1,15 @@
+from datetime import timedelta
+from time import time
+
+from django.utils import timezone
 from rest_framework import serializers
 from .models import Brand, Category, Product, Cart, CartItem, Order, OrderItem
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .tracing import traced
+from .authentication import CLAIMS_AT
+from .images import variant_urls
+from .analytics import PERIODS, STATUSES
 
 User = get_user_model()
 
@@ -26,6 +34,7 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         token['username'] = user.username
         token['email'] = user.email
         token['is_staff'] = user.is_staff
+        token[CLAIMS_AT] = int(time())  # с этого момента claims могут устареть (см. shop/authentication.py)
 
         return token
     
@@ -36,30 +45,47 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 
         return data
     
+@traced
 class CategorySerializer(serializers.ModelSerializer):
     subcategories = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
     class Meta:
         model = Category
         fields = ['id', 'name', 'description', 'parent', 'subcategories']
   
+class ImageVariantsField(serializers.Field):
+    """URL уменьшенных копий фото: {'thumb': {'webp': url, 'jpeg': url, 'width': .., 'height': ..}, ...}."""
+    needs_request = True  # см. CompiledSerializer
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return self.represent(value, self.context.get('request'))
+
+    def represent(self, value, request):
+        return variant_urls(value, request)
+
+@traced
 class ProductSerializer(serializers.ModelSerializer):
     brand_name = serializers.CharField(source='brand.name', read_only=True)
+    image_variants = ImageVariantsField()
+    # Передаётся при правке: если товар с тех пор изменился, ответ — 409 (shop/stock.py)
+    version = serializers.IntegerField(required=False, min_value=0)
     
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'price', 'stock', 'available', 'category', 'brand', 'brand_name', 'created_at', 'updated_at', 'image']
-
-    def to_representation(self, instance):
-        """Добавляем отладочный вывод перед возвратом данных"""
-        representation = super().to_representation(instance)
-        print(f"[DEBUG] Serialized Product Data: {representation}")
-        return representation
+        fields = ['id', 'name', 'description', 'price', 'stock', 'available', 'category', 'brand', 'brand_name', 'created_at', 'updated_at', 'image', 'image_variants', 'version']
 
+@traced
 class SimpleProductSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Product
-        fields = ['id','name', 'price', 'image']  # Указываем только нужные поля
+        fields = ['id','name', 'price', 'image', 'image_variants']  # Указываем только нужные поля
 
+@traced
 class CartItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer(read_only=True)  
     product_id = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(), write_only=True)  
@@ -73,18 +99,35 @@ class CartItemSerializer(serializers.ModelSerializer):
         cart_item = CartItem.objects.create(product=product, **validated_data)  
         return cart_item
 
+class CartLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1, max_value=CartItem.MAX_QUANTITY, default=1)
+
+class CartBatchSerializer(serializers.Serializer):
+    items = CartLineSerializer(many=True, allow_empty=False)
+    mode = serializers.ChoiceField(choices=['add', 'set'], default='add')  # прибавить или заменить количество
+
+@traced
 class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
 
     class Meta:
         model = Cart
-        fields = ['id', 'user', 'items']
+        fields = ['id', 'user', 'item_count', 'quantity_total', 'subtotal', 'items']
+
+@traced
+class CartSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Cart
+        fields = ['id', 'item_count', 'quantity_total', 'subtotal']
         
+@traced
 class BrandSerializer(serializers.ModelSerializer):
     class Meta:
         model = Brand
         fields = ['id', 'name']
 
+@traced
 class OrderItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer(read_only=True)
 
@@ -92,9 +135,27 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ['id', 'product', 'quantity', 'price']
 
+@traced
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
 
     class Meta:
         model = Order
-        fields = ['id', 'user', 'created_at', 'total_amount', 'address', 'personal_info', 'status', 'items']
\ No newline at end of file
+        fields = ['id', 'user', 'created_at', 'total_amount', 'address', 'personal_info', 'status', 'items']
+
+class OrderAnalyticsQuerySerializer(serializers.Serializer):
+    # По умолчанию — последние 30 дней, включая сегодня
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    period = serializers.ChoiceField(choices=PERIODS, default='day')
+    status = serializers.MultipleChoiceField(choices=STATUSES, required=False)
+    top = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+    def validate(self, attrs):
+        attrs.setdefault('date_to', timezone.localdate())
+        attrs.setdefault('date_from', attrs['date_to'] - timedelta(days=29))
+        if attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError({'date_from': ['Must not be later than date_to.']})
+        if (attrs['date_to'] - attrs['date_from']).days > 3660:
+            raise serializers.ValidationError({'date_from': ['Range is limited to 10 years.']})
+        return attrs
@@ -0,0 +1,93 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .authentication import revoke_user
+from . import cart_totals, images, rollups
+from .category_tree import invalidate_category_tree
+from .models import Brand, Category, CustomUser, Order, OrderItem, Product
+from . import response_cache
+from .search import get_search_backend
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, instance, **kwargs):
+    # Сбрасываем сразу и ещё раз после коммита: иначе параллельный запрос
+    # мог бы успеть закешировать дерево без незакоммиченных изменений
+    invalidate_category_tree()
+    transaction.on_commit(invalidate_category_tree)
+    response_cache.invalidate('category', f'category:{instance.pk}')
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, instance, **kwargs):
+    response_cache.invalidate('product', f'product:{instance.pk}')
+
+
+@receiver([post_save, post_delete], sender=Brand)
+def brand_changed(sender, instance, **kwargs):
+    response_cache.invalidate('brand', f'brand:{instance.pk}')
+
+
+@receiver([post_save, post_delete], sender=Order)
+@receiver([post_save, post_delete], sender=OrderItem)
+def order_history_changed(sender, instance, created=False, raw=False, **kwargs):
+    # Новые заказы попадают только в текущий период, его аналитика не кешируется,
+    # а в сводки их добавит refresh по отметке id
+    if created or raw:
+        return
+    response_cache.invalidate('order-history')
+    if sender is Order:
+        created_at = instance.created_at
+    else:
+        created_at = Order.objects.filter(pk=instance.order_id).values_list('created_at', flat=True).first()
+    if created_at is not None:
+        rollups.mark_dirty([timezone.localdate(created_at)])
+
+
+@receiver(pre_save, sender=Product)
+def product_saving(sender, instance, raw=False, **kwargs):
+    # Запоминаем прежние цену и фото, чтобы после сохранения пересчитать
+    # корзины и построить уменьшенные копии
+    if not raw and not instance._state.adding:
+        instance._old_values = Product.objects.filter(pk=instance.pk).values_list('price', 'image').first()
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    get_search_backend().index([instance])
+    old_price, old_image = instance.__dict__.pop('_old_values', None) or (None, None)
+    if old_price is not None:
+        cart_totals.product_price_changed(instance.pk, old_price, instance.price)
+    if (instance.image.name or '') != (old_image or ''):
+        images.schedule_variants(instance.pk)
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleting(sender, instance, **kwargs):
+    # Позиции корзин удалятся каскадом без участия cart_totals
+    cart_totals.product_removed(instance.pk, instance.price)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
+
+
+@receiver(post_save, sender=Brand)
+def brand_saved(sender, instance, created, raw=False, **kwargs):
+    # Название бренда входит в индекс — переиндексируем его товары
+    if not created and not raw:
+        get_search_backend().index(instance.products.select_related('brand'))
+
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def user_changed(sender, instance, created=False, update_fields=None, **kwargs):
+    # Вход в админку обновляет только last_login — права от этого не меняются
+    if created or update_fields == frozenset({'last_login'}):
+        return
+    revoke_user(instance.pk)
+    transaction.on_commit(lambda: revoke_user(instance.pk))
@@ -0,0 +1,82 @@
+from functools import lru_cache
+
+from rest_framework.exceptions import ValidationError
+
+from .prefetch import get_only_fields
+
+_UNSET = object()
+
+
+@lru_cache(maxsize=None)
+def readable_fields(serializer_class):
+    return tuple(name for name, field in serializer_class().fields.items() if not field.write_only)
+
+
+@lru_cache(maxsize=None)
+def sparse_serializer(serializer_class, fields):
+    """
+    Подкласс serializer_class только с полями fields. Класс создаётся один
+    раз на набор полей, поэтому план подгрузки связей (get_query_plan) и
+    быстрый сериализатор списков (compile_serializer) тоже кешируются.
+    """
+    meta = type('Meta', (serializer_class.Meta,), {'fields': fields, 'exclude': None})
+    return type(serializer_class.__name__, (serializer_class,), {
+        'Meta': meta, '__module__': serializer_class.__module__,
+    })
+
+
+def _split(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+class SparseFieldsMixin:
+    """
+    Выборочные поля в list/retrieve: ?fields=id,name,price — только эти поля,
+    ?omit=description — все, кроме этих. Урезается и ответ, и SQL: queryset
+    читает через .only() лишь нужные столбцы, а связи отброшенных полей не
+    подгружаются. Неизвестное имя поля — 400. На запись параметры не влияют.
+    """
+
+    def get_sparse_fields(self):
+        """Кортеж оставляемых полей или None, если ответ полный."""
+        sparse = getattr(self, '_sparse_fields', _UNSET)
+        if sparse is _UNSET:
+            sparse = self._sparse_fields = self.parse_sparse_fields()
+        return sparse
+
+    def parse_sparse_fields(self):
+        request = getattr(self, 'request', None)
+        if request is None or self.action not in ('list', 'retrieve'):
+            return None
+        requested = _split(request.query_params.get('fields'))
+        omitted = _split(request.query_params.get('omit'))
+        if not requested and not omitted:
+            return None
+
+        available = readable_fields(super().get_serializer_class())
+        errors = {}
+        for param, names in (('fields', requested), ('omit', omitted)):
+            unknown = [name for name in names if name not in available]
+            if unknown:
+                errors[param] = [f'Unknown field(s): {", ".join(unknown)}. Available: {", ".join(available)}.']
+        if errors:
+            raise ValidationError(errors)
+
+        # Порядок полей — как в сериализаторе, а не как в запросе
+        kept = tuple(name for name in available if (not requested or name in requested) and name not in omitted)
+        if not kept:
+            raise ValidationError({'omit': ['At least one field must be left.']})
+        return kept if kept != available else None
+
+    def get_serializer_class(self):
+        serializer_class = super().get_serializer_class()
+        fields = self.get_sparse_fields()
+        return sparse_serializer(serializer_class, fields) if fields else serializer_class
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.get_sparse_fields():
+            only = get_only_fields(self.get_serializer_class())
+            if only is not None:
+                queryset = queryset.only(*only)
+        return queryset
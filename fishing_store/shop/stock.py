@@ -0,0 +1,224 @@
+from collections import Counter
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    BooleanField, Case, Exists, ExpressionWrapper, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import CartItem, Product, StockReservation
+from . import response_cache
+
+DEFAULTS = {
+    # Сколько секунд товар в корзине держится за покупателем
+    'RESERVATION_TTL': 15 * 60,
+    # False — остаток списывается только при оформлении заказа, как раньше
+    'RESERVE_ON_ADD': True,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SHOP_STOCK', {})}
+
+
+class StaleVersion(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Product was changed by another request'
+    default_code = 'stale_version'
+
+    def __init__(self, current):
+        super().__init__()
+        self.detail = {'detail': self.detail, 'version': current}
+
+
+class _PartialTake(Exception):
+    """Списаны не все товары — откатить точку сохранения в take()."""
+
+
+def per_product(values):
+    if len(values) == 1:
+        # Частый случай — одна позиция корзины: без CASE запрос собирается заметно быстрее
+        return Value(next(iter(values.values())), output_field=IntegerField())
+    return Case(
+        *[When(pk=pk, then=Value(value)) for pk, value in values.items()],
+        output_field=IntegerField(),
+    )
+
+
+def take(quantities):
+    """
+    Списывает остатки одним UPDATE ... WHERE stock >= нужное количество:
+    условие проверяется под блокировкой строки, поэтому параллельные
+    запросы не продадут больше, чем есть. Либо списывается всё, либо
+    ничего; возвращает, получилось ли. В том же UPDATE растёт version, а
+    распроданный товар становится недоступным с пометкой sold_out (правые
+    части SET видят старый stock).
+    """
+    needed = per_product(quantities)
+    try:
+        # Несколько товаров — в точке сохранения: если подошли не все строки,
+        # уже уменьшенные остатки откатываются, и повторная попытка не спишет их дважды
+        with transaction.atomic() if len(quantities) > 1 else nullcontext():
+            updated = Product.objects.filter(pk__in=quantities, available=True, stock__gte=needed).update(
+                stock=F('stock') - needed,
+                version=F('version') + 1,
+                available=ExpressionWrapper(Q(stock__gt=needed), output_field=BooleanField()),
+                sold_out=ExpressionWrapper(Q(stock=needed), output_field=BooleanField()),
+            )
+            if updated != len(quantities):
+                raise _PartialTake
+    except _PartialTake:
+        return False
+    _invalidate(quantities)
+    return True
+
+
+def put_back(quantities):
+    """
+    Возвращает единицы на склад. Снова доступен только товар, который снял
+    с продажи take() (sold_out), а не выключенный персоналом.
+    """
+    if not quantities:
+        return
+    returned = per_product(quantities)
+    Product.objects.filter(pk__in=quantities).update(
+        stock=F('stock') + returned,
+        version=F('version') + 1,
+        available=Case(When(sold_out=True, then=Value(True)), default=F('available')),
+        sold_out=Value(False),
+    )
+    _invalidate(quantities)
+
+
+def _invalidate(product_ids):
+    # update() не шлёт сигналов. Список каталога не сбрасывается на каждую бронь:
+    # остаток в нём может отставать до TIMEOUT кеша ответов
+    response_cache.invalidate(*[f'product:{pk}' for pk in product_ids])
+
+
+def reserved(product_ids):
+    """{product_id: единиц в бронях корзин} — они уже не входят в Product.stock."""
+    rows = StockReservation.objects.filter(product_id__in=product_ids).values('product_id').annotate(total=Sum('quantity'))
+    return {row['product_id']: row['total'] for row in rows.order_by()}
+
+
+def on_hand():
+    """Выражение физического остатка: свободный stock плюс забронированное."""
+    held = StockReservation.objects.filter(product=OuterRef('pk')).order_by().values('product').annotate(total=Sum('quantity'))
+    return ExpressionWrapper(F('stock') + Coalesce(Subquery(held.values('total')), 0), output_field=IntegerField())
+
+
+def availability(product, free, requested=None):
+    """
+    (available, sold_out) товара после правки остатка персоналом (API,
+    админка, фид) — по тем же правилам, что take()/put_back(): без свободных
+    единиц товар снят с продажи и помечен sold_out, с остатком в продажу
+    возвращается только помеченный. requested — available из правки
+    (None — не менялся).
+    """
+    on_sale = (product.available or product.sold_out) if requested is None else requested
+    return on_sale and free > 0, on_sale and free <= 0
+
+
+def lock_products(product_ids):
+    """
+    SELECT ... FOR UPDATE строк товаров в порядке id: две транзакции с
+    одними и теми же товарами блокируют их в одном порядке и не ждут друг
+    друга по кругу. Читается только цена. На SQLite блокировка — вся БД
+    (BEGIN IMMEDIATE).
+    """
+    return {
+        product.pk: product
+        for product in Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk').only('price')
+    }
+
+
+def check_version(product, expected):
+    """
+    Оптимистическая блокировка правки товара: version увеличивается, только
+    если не изменилась с момента, когда её прочитал клиент. Иначе —
+    StaleVersion (409). Вызывать в транзакции вместе с сохранением товара.
+    """
+    updated = Product.objects.filter(pk=product.pk, version=expected).update(version=F('version') + 1)
+    if not updated:
+        raise StaleVersion(Product.objects.filter(pk=product.pk).values_list('version', flat=True).first())
+    product.version = expected + 1
+
+
+def reserve(item_ids):
+    """
+    Доводит бронь позиций корзины до их количества и продлевает её срок.
+    Добавка бронируется целиком или не бронируется: тогда нехватка
+    обнаружится при оформлении. Уменьшение количества возвращает лишнее.
+    """
+    config = get_config()
+    if not config['RESERVE_ON_ADD'] or not item_ids:
+        return
+    expires_at = timezone.now() + timedelta(seconds=config['RESERVATION_TTL'])
+    with transaction.atomic(savepoint=False):
+        items = CartItem.objects.filter(pk__in=item_ids).select_related('reservation').order_by('product_id')
+        for item in items:
+            reservation = getattr(item, 'reservation', None)
+            held = reservation.quantity if reservation else 0
+            delta = item.quantity - held
+            if delta > 0 and (take({item.product_id: delta}) or (
+                release_expired([item.product_id], keep=item_ids) and take({item.product_id: delta})
+            )):
+                held += delta
+            elif delta < 0:
+                put_back({item.product_id: -delta})
+                held += delta
+            if reservation and not held:
+                reservation.delete()
+            elif reservation:
+                reservation.quantity, reservation.expires_at = held, expires_at
+                reservation.save(update_fields=['quantity', 'expires_at'])
+            elif held:
+                StockReservation.objects.create(cart_item=item, product_id=item.product_id, quantity=held, expires_at=expires_at)
+
+
+def release(reservations):
+    """Возвращает на склад брони из queryset'а и удаляет их. Возвращает число единиц."""
+    with transaction.atomic(savepoint=False):
+        rows = list(reservations.select_for_update().values_list('pk', 'product_id', 'quantity'))
+        quantities = Counter()
+        for pk, product_id, quantity in rows:
+            quantities[product_id] += quantity
+        StockReservation.objects.filter(pk__in=[pk for pk, product_id, quantity in rows]).delete()
+        put_back(dict(sorted(quantities.items())))
+    return sum(quantities.values())
+
+
+def release_expired(product_ids=None, keep=()):
+    """
+    Брони с истёкшим сроком и брони удалённых позиций корзины, кроме броней
+    позиций keep. Возвращает число вернувшихся на склад единиц.
+    """
+    orphaned = ~Exists(CartItem.objects.filter(pk=OuterRef('cart_item_id')))
+    expired = StockReservation.objects.filter(Q(expires_at__lt=timezone.now()) | orphaned)
+    if product_ids is not None:
+        expired = expired.filter(product_id__in=product_ids)
+    if keep:
+        expired = expired.exclude(cart_item__in=keep)
+    return release(expired)
+
+
+def consume(item_ids):
+    """
+    Забирает брони позиций при оформлении заказа: единицы уже списаны,
+    поэтому брони просто удаляются (включая истёкшие, но не очищенные).
+    Возвращает {product_id: забронированное количество}.
+    """
+    reservations = StockReservation.objects.filter(cart_item__in=item_ids)
+    held = Counter()
+    for product_id, quantity in reservations.values_list('product_id', 'quantity'):
+        held[product_id] += quantity
+    if held:
+        reservations.delete()
+    return held
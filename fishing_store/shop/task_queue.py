@@ -0,0 +1,184 @@
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+
+logger = logging.getLogger('shop.tasks')
+
+DEFAULTS = {
+    # True — задачи выполняются сразу после коммита в этом же процессе (разработка, тесты)
+    'EAGER': False,
+    'THREADS': 4,
+    'PROCESSES': 1,
+    'POLL_INTERVAL': 1.0,
+    # Сколько секунд задача принадлежит взявшему её воркеру; если он упал — задачу подберут другие
+    'LEASE': 300,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_BASE': 10,
+    'BACKOFF_MAX': 3600,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SHOP_TASKS', {})}
+
+
+def task(max_attempts=None):
+    """
+    Делает функцию фоновой задачей: func.enqueue(kwargs, key=...) ставит её
+    в очередь. Аргументы — только именованные и сериализуемые в JSON.
+    Задача должна быть идемпотентной: при сбое воркера она выполнится ещё раз.
+    """
+    def decorator(func):
+        func.task_name = f'{func.__module__}.{func.__qualname__}'
+        func.max_attempts = max_attempts
+        func.enqueue = lambda kwargs=None, **options: enqueue(func, kwargs, **options)
+        return func
+    return decorator
+
+
+def enqueue(func, kwargs=None, key=None, delay=0, max_attempts=None):
+    """
+    Ставит задачу в очередь. Строка пишется в текущей транзакции, поэтому
+    воркеры увидят задачу только после коммита (и не увидят при откате),
+    а запрос не ждёт её выполнения. Повторная постановка с тем же key
+    возвращает уже существующую задачу.
+    """
+    config = get_config()
+    name = func if isinstance(func, str) else func.task_name
+    defaults = {
+        'name': name,
+        'kwargs': kwargs or {},
+        'max_attempts': max_attempts or getattr(func, 'max_attempts', None) or config['MAX_ATTEMPTS'],
+        'run_at': timezone.now() + timedelta(seconds=delay),
+    }
+    if key is None:
+        task, created = Task.objects.create(**defaults), True
+    else:
+        task, created = Task.objects.get_or_create(idempotency_key=key, defaults=defaults)
+    if created and config['EAGER']:
+        transaction.on_commit(lambda: run_pending(ids=[task.pk], worker='eager'))
+    return task
+
+
+def backoff(attempt):
+    """Пауза перед повтором: экспонента от номера попытки с разбросом ±20%."""
+    config = get_config()
+    delay = min(config['BACKOFF_MAX'], config['BACKOFF_BASE'] * 2 ** (attempt - 1))
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def _ready(now):
+    # Готовые к запуску и брошенные упавшими воркерами (аренда истекла)
+    return Q(status=Task.QUEUED, run_at__lte=now) | Q(status=Task.RUNNING, locked_until__lt=now)
+
+
+def claim(worker, limit=1, ids=None):
+    """
+    Забирает до limit задач. Каждая захватывается условным UPDATE, поэтому
+    одну задачу не возьмут два воркера — ни в другом потоке, ни в другом
+    процессе или на другом сервере.
+    """
+    now = timezone.now()
+    candidates = Task.objects.filter(_ready(now)).order_by('run_at')
+    if ids is not None:
+        candidates = candidates.filter(pk__in=ids)
+    claimed = []
+    for pk in candidates.values_list('pk', flat=True)[:limit * 2]:
+        updated = Task.objects.filter(_ready(now), pk=pk).update(
+            status=Task.RUNNING,
+            locked_by=worker,
+            locked_until=now + timedelta(seconds=get_config()['LEASE']),
+            attempts=F('attempts') + 1,
+        )
+        if updated:
+            claimed.append(pk)
+            if len(claimed) == limit:
+                break
+    return list(Task.objects.filter(pk__in=claimed, locked_by=worker).order_by('run_at'))
+
+
+def execute(task):
+    """Выполняет захваченную задачу и записывает результат; при ошибке — повтор с паузой или FAILED."""
+    now = timezone.now()
+    try:
+        if task.attempts > task.max_attempts:
+            raise RuntimeError('Lease expired on the last attempt')
+        import_string(task.name)(**task.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        if task.attempts >= task.max_attempts:
+            changes = {'status': Task.FAILED, 'finished_at': timezone.now()}
+            logger.error('Task %s (%s) failed after %s attempts\n%s', task.pk, task.name, task.attempts, error)
+        else:
+            changes = {'status': Task.QUEUED, 'run_at': now + backoff(task.attempts)}
+            logger.warning('Task %s (%s) attempt %s failed, will retry', task.pk, task.name, task.attempts)
+        changes['last_error'] = error
+    else:
+        changes = {'status': Task.DONE, 'finished_at': timezone.now(), 'last_error': ''}
+    changes.update(locked_by='', locked_until=None)
+    # Если аренда истекла и задачу уже перехватили, её результат не затираем
+    Task.objects.filter(pk=task.pk, status=Task.RUNNING, attempts=task.attempts).update(**changes)
+    return changes['status']
+
+
+def run_pending(limit=None, ids=None, worker=None):
+    """Выполняет готовые задачи в текущем потоке, пока они есть (или limit штук). Возвращает их число."""
+    worker = worker or worker_name()
+    done = 0
+    while limit is None or done < limit:
+        tasks = claim(worker, ids=ids)
+        if not tasks:
+            break
+        for task in tasks:
+            execute(task)
+            done += 1
+    return done
+
+
+def worker_name(thread=None):
+    name = f'{socket.gethostname()}:{os.getpid()}'
+    return name if thread is None else f'{name}:{thread}'
+
+
+def _work(index, stop, poll_interval):
+    worker = worker_name(index)
+    while not stop.is_set():
+        try:
+            tasks = claim(worker)
+            for task in tasks:
+                execute(task)
+        except Exception:
+            logger.exception('Task worker %s error', worker)
+            tasks = []
+        finally:
+            close_old_connections()
+        if not tasks:
+            stop.wait(poll_interval)
+
+
+def serve(threads=None, poll_interval=None, stop=None):
+    """Пул потоков-воркеров до установки stop (threading.Event или multiprocessing.Event)."""
+    config = get_config()
+    threads = threads or config['THREADS']
+    poll_interval = config['POLL_INTERVAL'] if poll_interval is None else poll_interval
+    stop = stop or threading.Event()
+    pool = [
+        threading.Thread(target=_work, args=(index, stop, poll_interval), name=f'shop-tasks-{index}', daemon=True)
+        for index in range(threads)
+    ]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
@@ -1,3 +1,1980 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from asyncio import iscoroutinefunction
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import urlencode
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core import mail
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from django.urls import include, path, resolve
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import StatelessJWTAuthentication, TokenCache
+from . import cart_totals
+from .cart_items import upsert_cart_items
+from . import category_tree
+from .category_tree import get_category_tree
+from .checkout import EmptyCart, OutOfStock, place_order
+from .product_io import import_products
+from .models import (
+    Brand, Cart, CartItem, Category, CoPurchase, CustomUser, DailyCategorySales, DailyProductSales, DailySales, Order,
+    OrderItem, Product, ProductNeighbours, RollupState, StockReservation, Task,
+)
+from .fast_serializers import compile_serializer
+from .prefetch import get_query_plan
+from . import db_router, metrics, product_io, recommendations, rollups, search, stock, task_queue, tracing
+from .serializers import CartSerializer, OrderSerializer, ProductSerializer
+from .urls import build_urlpatterns
+from fishing_store import databases
+
+
+class ShopTestCase(TestCase):
+    def setUp(self):
+        # Кеш живёт между тестами, а данные в БД откатываются
+        cache.clear()
+        self.client = APIClient()
+
+
+class ProductPaginationTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Удочки')
+        cls.brand = Brand.objects.create(name='Shimano')
+        cls.other_brand = Brand.objects.create(name='Daiwa')
+        # Много одинаковых цен — курсор должен различать их по id
+        for i in range(30):
+            Product.objects.create(
+                category=cls.category,
+                brand=cls.brand if i % 2 else cls.other_brand,
+                name=f'Удочка {i}',
+                description='',
+                price=Decimal(100 + i // 4),
+                stock=5,
+            )
+
+    def walk(self, url):
+        ids, pages = [], 0
+        while url:
+            data = self.client.get(url).json()
+            ids += [item['id'] for item in data['results']]
+            url = data['next']
+            pages += 1
+        return ids, pages
+
+    def test_page_number_mode(self):
+        data = self.client.get('/api/products/', {'page_size': 10, 'page': 3}).json()
+        self.assertEqual(data['count'], 30)
+        self.assertEqual(len(data['results']), 10)
+        self.assertIsNone(data['next'])
+
+    def test_cursor_mode_visits_every_product_once_in_price_order(self):
+        ids, pages = self.walk('/api/products/?paginate=cursor&page_size=7')
+        self.assertEqual(pages, 5)
+        expected = list(Product.objects.order_by('price', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_cursor_mode_descending_and_previous_link(self):
+        first = self.client.get('/api/products/', {'paginate': 'cursor', 'page_size': 8, 'ordering': '-price'}).json()
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+        prices = [Decimal(item['price']) for item in first['results'] + second['results']]
+        self.assertEqual(prices, sorted(prices, reverse=True))
+
+    def test_cursor_mode_with_filter_and_search(self):
+        query = urlencode({'paginate': 'cursor', 'page_size': 4, 'brands': self.brand.id, 'search': '1'})
+        ids, _ = self.walk(f'/api/products/?{query}')
+        # Поиск по префиксу слова: «1» находит «Удочка 1», «Удочка 13», но не «Удочка 21»
+        expected = [
+            product.id for product in Product.objects.filter(brand=self.brand).order_by('price', 'id')
+            if product.name.split()[-1].startswith('1')
+        ]
+        self.assertEqual(ids, expected)
+
+    def test_cursor_mode_with_sparse_fields(self):
+        expected = list(Product.objects.order_by('-price', 'id').values_list('id', flat=True))
+        for fast in (True, False):
+            for params in ({'fields': 'id,name'}, {'omit': 'price'}):
+                url = '/api/products/?' + urlencode({'paginate': 'cursor', 'page_size': 7, 'ordering': '-price', **params})
+                cache.clear()
+                with self.settings(SHOP_FAST_SERIALIZERS=fast), CaptureQueriesContext(connection) as queries:
+                    ids, pages = self.walk(url)
+                self.assertEqual(ids, expected, params)
+                self.assertEqual(len(queries), pages, params)  # цена для курсора — в том же запросе
+                row = self.client.get(url).json()['results'][0]
+                self.assertNotIn('price', row)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/products/', {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+        for payload in (
+            {'p': ['100', 1]},  # без направления
+            {'p': ['дорого', 1], 'r': 0},
+            {'p': [None, 1], 'r': 0},
+            {'p': ['100', 'x'], 'r': 0},
+            {'p': ['100', 1], 'r': 'yes'},
+            {'p': '100,1', 'r': 0},
+            ['100', 1],
+        ):
+            cursor = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+            response = self.client.get('/api/products/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, payload)
+
+
+class QueryCountTests(ShopTestCase):
+    """Число запросов не должно зависеть от числа строк в ответе."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'pass', is_staff=True)
+        cls.cart = Cart.objects.create(user=cls.user)
+        cls.root = Category.objects.create(name='Снасти')
+
+    def setUp(self):
+        super().setUp()
+        self.grow()
+
+    def grow(self, count=3):
+        for _ in range(count):
+            brand = Brand.objects.create(name='Бренд')
+            category = Category.objects.create(name='Категория', parent=self.root)
+            product = Product.objects.create(
+                category=category, brand=brand, name='Товар',
+                description='', price=Decimal('10.00'), stock=10,
+            )
+            CartItem.objects.create(cart=self.cart, product=product, quantity=1)
+            order = Order.objects.create(user=self.user, address='ул. Речная', personal_info={})
+            OrderItem.objects.create(order=order, product=product, quantity=2, price=product.price)
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+
+    def assertConstantQueries(self, url, user=None):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.grow(10)
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(len(small), len(large), [q['sql'] for q in large])
+
+    def test_query_plans(self):
+        self.assertEqual(get_query_plan(ProductSerializer).select_related, ('brand',))
+        self.assertEqual([p[0] for p in get_query_plan(CartSerializer).prefetch_related], ['items'])
+        self.assertEqual(get_query_plan(OrderSerializer).prefetch_related[0][2].select_related, ('product',))
+
+    def test_products(self):
+        self.assertConstantQueries('/api/products/?page_size=100')
+
+    def test_categories(self):
+        self.assertConstantQueries('/api/categories/')
+
+    def test_subcategories(self):
+        self.assertConstantQueries(f'/api/categories/{self.root.id}/subcategories/')
+
+    def test_cart(self):
+        self.assertConstantQueries('/api/cart/', self.user)
+
+    def test_cart_items(self):
+        self.assertConstantQueries('/api/cart-items/', self.user)
+
+    def test_orders(self):
+        self.assertConstantQueries('/api/orders/', self.user)
+
+    def test_admin_orders(self):
+        self.assertConstantQueries('/api/admin/orders/', self.admin)
+
+
+class CheckoutTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        cls.other = CustomUser.objects.create_user('rival', 'rival@example.com', 'pass')
+        cls.category = Category.objects.create(name='Катушки')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def fill_cart(self, user, count, stock=5, quantity=2):
+        cart, _ = Cart.objects.get_or_create(user=user)
+        products = []
+        for i in range(count):
+            product = Product.objects.create(
+                category=self.category, name=f'Катушка {i}', description='',
+                price=Decimal('12.50'), stock=stock,
+            )
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+            products.append(product)
+        return products
+
+    def checkout(self, user=None):
+        self.client.force_authenticate(user or self.user)
+        return self.client.post('/api/orders/', {'address': 'ул. Речная', 'personal_info': {}}, format='json')
+
+    def test_checkout_creates_order_and_decrements_stock(self):
+        products = self.fill_cart(self.user, 3)
+        response = self.checkout()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['total_amount'], '75.00')
+        self.assertEqual(len(response.data['items']), 3)
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+        for product in products:
+            product.refresh_from_db()
+            self.assertEqual(product.stock, 3)
+
+    def test_checkout_query_count_does_not_depend_on_cart_size(self):
+        self.fill_cart(self.user, 2)
+        with CaptureQueriesContext(connection) as small:
+            self.checkout()
+        self.fill_cart(self.user, 20)
+        with CaptureQueriesContext(connection) as large:
+            self.checkout()
+        self.assertEqual(len(small), len(large))
+
+    def test_empty_cart(self):
+        response = self.checkout()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'detail': 'Cart is empty'})
+
+    def test_sold_out_checkout_rolls_back(self):
+        # Оформления идут друг за другом; параллельные — в ConcurrentCheckoutTests
+        [product] = self.fill_cart(self.user, 1, stock=1, quantity=1)
+        cart = Cart.objects.create(user=self.other)
+        CartItem.objects.create(cart=cart, product=product, quantity=1)
+        extra = Product.objects.create(category=self.category, name='Леска', description='', price=1, stock=9)
+        CartItem.objects.create(cart=cart, product=extra, quantity=1)
+
+        self.assertEqual(self.checkout().status_code, 201)
+        response = self.checkout(self.other)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['products'], [product.id])
+
+        # Вся транзакция откатилась: остатки и корзина не тронуты
+        product.refresh_from_db()
+        extra.refresh_from_db()
+        self.assertEqual((product.stock, extra.stock), (0, 9))
+        self.assertEqual(cart.items.count(), 2)
+        self.assertFalse(Order.objects.filter(user=self.other).exists())
+
+    def test_delivery_details_are_validated_first(self):
+        [product] = self.fill_cart(self.user, 1, stock=5, quantity=2)
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/orders/', {}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'address', 'personal_info'})
+        self.assertFalse([q['sql'] for q in queries if 'shop_product' in q['sql']])
+        response = self.client.post('/api/orders/', {'address': ' ', 'personal_info': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 5)
+        self.assertFalse(Order.objects.exists())
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """
+    Оформления в параллельных потоках. Тестовая SQLite в памяти не даёт
+    потокам ждать блокировку, поэтому тесты идут только на сервере БД
+    (SHOP_DB_PROFILE=server); на SQLite — StressStockTests.
+    """
+
+    def setUp(self):
+        if not connection.features.has_select_for_update:
+            self.skipTest('Нужна БД с SELECT ... FOR UPDATE')
+        cache.clear()
+        self.category = Category.objects.create(name='Катушки')
+
+    def product(self, stock):
+        return Product.objects.create(category=self.category, name='Катушка', description='', price='12.50', stock=stock)
+
+    def buyer(self, name, *products):
+        user = CustomUser.objects.create_user(name, f'{name}@example.com', 'pass')
+        upsert_cart_items(user, {product.pk: 1 for product in products})
+        return user
+
+    def run_concurrently(self, *users):
+        barrier = threading.Barrier(len(users))
+
+        def checkout(user):
+            try:
+                barrier.wait()
+                return place_order(user, 'ул. Речная', {})
+            except (EmptyCart, OutOfStock) as error:
+                return type(error)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(len(users)) as pool:
+            return list(pool.map(checkout, users))
+
+    def test_same_cart_is_ordered_once(self):
+        first, second = self.product(5), self.product(5)
+        user = self.buyer('buyer', first, second)
+        results = self.run_concurrently(user, user)
+        self.assertEqual(sorted(isinstance(result, Order) for result in results), [False, True])
+        self.assertIn(EmptyCart, results)
+        self.assertEqual(Order.objects.filter(user=user).count(), 1)
+        self.assertEqual(list(Product.objects.filter(pk__in=[first.pk, second.pk]).values_list('stock', flat=True)), [4, 4])
+        cart = Cart.objects.get(user=user)
+        self.assertEqual((cart.item_count, cart.quantity_total, cart.subtotal), (0, 0, 0))
+
+    def test_last_unit_is_sold_once(self):
+        with self.settings(SHOP_STOCK={'RESERVE_ON_ADD': False}):
+            product = self.product(1)
+            results = self.run_concurrently(self.buyer('buyer', product), self.buyer('rival', product))
+        self.assertEqual(sorted(result is OutOfStock for result in results), [False, True])
+        product.refresh_from_db()
+        self.assertEqual((product.stock, product.available), (0, False))
+        self.assertEqual(OrderItem.objects.filter(product=product).count(), 1)
+
+
+class CategoryTreeTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.root = Category.objects.create(name='Рыбалка')
+        cls.child = Category.objects.create(name='Удилища', parent=cls.root)
+        cls.grandchild = Category.objects.create(name='Спиннинги', parent=cls.child)
+        cls.other = Category.objects.create(name='Туризм')
+        for category in (cls.root, cls.child, cls.grandchild, cls.other):
+            Product.objects.create(category=category, name=category.name, description='', price=1, stock=1)
+
+    def product_names(self, category):
+        data = self.client.get('/api/products/', {'category': category.id}).json()
+        return sorted(item['name'] for item in data['results'])
+
+    def test_descendants(self):
+        tree = get_category_tree()
+        self.assertEqual(set(tree.get_descendant_ids(self.root.id)), {self.root.id, self.child.id, self.grandchild.id})
+        self.assertEqual(tree.get_children_ids(self.root.id), (self.child.id,))
+        self.assertEqual(tree.get_descendant_ids(-1), ())
+
+    def test_product_filter_covers_whole_subtree(self):
+        self.assertEqual(self.product_names(self.root), ['Рыбалка', 'Спиннинги', 'Удилища'])
+        self.assertEqual(self.product_names(self.child), ['Спиннинги', 'Удилища'])
+        self.assertEqual(self.product_names(self.other), ['Туризм'])
+
+    def test_tree_is_cached_and_invalidated(self):
+        get_category_tree()
+        with self.assertNumQueries(0):
+            get_category_tree()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.grandchild.parent = self.other
+            self.grandchild.save()
+        self.assertEqual(self.product_names(self.other), ['Спиннинги', 'Туризм'])
+
+    def test_tree_expires_in_other_processes(self):
+        with mock.patch.object(category_tree.get_cache(), 'set') as cache_set:
+            get_category_tree()
+        self.assertEqual(cache_set.call_args.args[2], category_tree.get_config()['TIMEOUT'])
+        with self.settings(SHOP_CATEGORY_TREE={'CACHE_ALIAS': 'tree'}, CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'tree': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tree'},
+        }):
+            get_category_tree()
+            self.assertIsNotNone(caches['tree'].get(category_tree.CACHE_KEY))
+
+    def test_subcategories_endpoint(self):
+        url = f'/api/categories/{self.root.id}/subcategories/'
+        self.assertEqual([c['id'] for c in self.client.get(url).json()], [self.child.id])
+        ids = {c['id'] for c in self.client.get(url, {'descendants': 'true'}).json()}
+        self.assertEqual(ids, {self.child.id, self.grandchild.id})
+        self.assertEqual(self.client.get('/api/categories/999/subcategories/').status_code, 404)
+
+
+class ProductSearchTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Приманки')
+        cls.brand = Brand.objects.create(name='Rapala')
+        cls.wobbler = Product.objects.create(
+            category=category, brand=cls.brand, name='Воблер плавающий', description='Для щуки', price=500, stock=1,
+        )
+        cls.spoon = Product.objects.create(
+            category=category, name='Блесна колебалка', description='Подходит вместо воблера', price=200, stock=1,
+        )
+
+    def search(self, query, **params):
+        data = self.client.get('/api/products/', {'search': query, **params}).json()
+        return [item['id'] for item in data['results']]
+
+    def test_prefix_case_insensitive_and_ranked(self):
+        # Совпадение в названии важнее совпадения в описании
+        self.assertEqual(self.search('ВОБЛ'), [self.wobbler.id, self.spoon.id])
+        self.assertEqual(self.search('ВОБЛ', ordering='price'), [self.spoon.id, self.wobbler.id])
+        self.assertEqual(self.search('щук'), [self.wobbler.id])
+        self.assertEqual(self.search('rapala блесна'), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.spoon.brand = self.brand
+        self.spoon.save()
+        self.assertEqual(self.search('rapala блесна'), [self.spoon.id])
+        self.brand.name = 'Mepps'
+        self.brand.save()
+        self.assertEqual(self.search('mepps'), [self.wobbler.id, self.spoon.id])
+        self.wobbler.delete()
+        self.assertEqual(self.search('воблер'), [self.spoon.id])
+
+    def test_rebuild_command(self):
+        Product.objects.filter(pk=self.spoon.pk).update(name='Джиг-головка')  # update() не шлёт сигналов
+        self.assertEqual(self.search('джиг'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search('джиг'), [self.spoon.id])
+
+    def test_matches_are_paginated_without_cap(self):
+        Product.objects.bulk_create([
+            Product(category=self.wobbler.category, name=f'Воблер {i}', price=100, stock=1) for i in range(1100)
+        ])
+        call_command('rebuild_search_index', stdout=StringIO())
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get('/api/products/', {'search': 'воблер', 'page_size': 100, 'page': 12}).json()
+        self.assertEqual(data['count'], 1102)
+        self.assertEqual(len(data['results']), 2)
+        self.assertFalse([q['sql'] for q in queries if 'CASE WHEN' in q['sql']])
+
+    def test_backend_follows_database_vendor(self):
+        for vendor, backend in (
+            ('sqlite', search.FTS5SearchBackend), ('postgresql', search.PostgresSearchBackend),
+            ('mysql', search.LikeSearchBackend),
+        ):
+            with mock.patch.object(search, 'connection', mock.Mock(vendor=vendor)):
+                self.assertIsInstance(search.get_search_backend.__wrapped__(), backend)
+        config, query = search.PostgresSearchBackend().match('Воблер, 5см').get_source_expressions()
+        self.assertEqual(query.value, 'Воблер:* & 5см:*')
+
+    def test_rebuild_is_atomic(self):
+        backend = search.get_search_backend()
+        with mock.patch.object(backend, '_write', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            backend.rebuild()
+        self.assertEqual(self.search('щук'), [self.wobbler.id])
+
+
+class ResponseCacheTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Лески')
+        cls.brand = Brand.objects.create(name='Sufix')
+        cls.line = Product.objects.create(
+            category=cls.category, brand=cls.brand, name='Леска 0.2', description='', price=300, stock=3,
+        )
+        cls.braid = Product.objects.create(
+            category=cls.category, brand=cls.brand, name='Шнур PE', description='', price=900, stock=3,
+        )
+
+    def test_repeated_request_hits_cache(self):
+        first = self.client.get(f'/api/products/?brands={self.brand.id}&ordering=-price')
+        with self.assertNumQueries(0):
+            second = self.client.get(f'/api/products/?ordering=-price&brands={self.brand.id}')
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_save_invalidates_only_affected_keys(self):
+        self.client.get(f'/api/products/{self.line.id}/')
+        self.client.get(f'/api/products/{self.braid.id}/')
+        self.client.get('/api/categories/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.line.price = 350
+            self.line.save()
+        self.assertEqual(self.client.get(f'/api/products/{self.line.id}/').json()['price'], '350.00')
+        with self.assertNumQueries(0):
+            self.client.get(f'/api/products/{self.braid.id}/')
+            self.client.get('/api/categories/')
+
+    def test_conditional_get(self):
+        response = self.client.get(f'/api/products/{self.line.id}/')
+        self.assertIn('Last-Modified', response)
+        not_modified = self.client.get(f'/api/products/{self.line.id}/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        since = self.client.get(f'/api/products/{self.line.id}/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(since.status_code, 304)
+
+    def test_checkout_invalidates_stock(self):
+        user = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        CartItem.objects.create(cart=Cart.objects.create(user=user), product=self.line, quantity=2)
+        self.client.get(f'/api/products/{self.line.id}/')
+        self.client.force_authenticate(user)
+        self.client.post('/api/orders/', {'address': 'ул. Речная', 'personal_info': {}}, format='json')
+        self.assertEqual(self.client.get(f'/api/products/{self.line.id}/').json()['stock'], 1)
+
+
+class FacetTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.root = Category.objects.create(name='Удилища')
+        cls.sub = Category.objects.create(name='Фидерные', parent=cls.root)
+        cls.other = Category.objects.create(name='Катушки')
+        cls.shimano = Brand.objects.create(name='Shimano')
+        cls.daiwa = Brand.objects.create(name='Daiwa')
+        for category, brand, price in [
+            (cls.root, cls.shimano, 300),
+            (cls.sub, cls.shimano, 700),
+            (cls.sub, cls.daiwa, 1200),
+            (cls.other, cls.daiwa, 20000),
+        ]:
+            Product.objects.create(category=category, brand=brand, name='Товар', description='', price=price, stock=1)
+
+    def facets(self, **params):
+        response = self.client.get('/api/products/facets/', params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return (
+            {item['name']: item['count'] for item in data['brands']},
+            {item['name']: item['count'] for item in data['categories']},
+            {item['min']: item['count'] for item in data['price'] if item['count']},
+        )
+
+    def test_unfiltered(self):
+        brands, categories, prices = self.facets()
+        self.assertEqual(brands, {'Shimano': 2, 'Daiwa': 2})
+        self.assertEqual(categories, {'Удилища': 3, 'Фидерные': 2, 'Катушки': 1})
+        self.assertEqual(prices, {'0': 1, '500': 1, '1000': 1, '10000': 1})
+
+    def test_each_facet_ignores_its_own_filter(self):
+        brands, categories, prices = self.facets(brands=str(self.shimano.id), category=self.root.id, price_max=1000)
+        self.assertEqual(brands, {'Shimano': 2})  # без фильтра брендов Daiwa за 1200 не проходит по цене
+        self.assertEqual(categories, {'Удилища': 2, 'Фидерные': 1})
+        self.assertEqual(prices, {'0': 1, '500': 1})
+
+    def test_constant_queries_and_cache(self):
+        with self.assertNumQueries(3):  # дерево категорий, GROUP BY, названия категорий
+            self.facets(category=self.root.id)
+        with self.assertNumQueries(0):
+            self.facets(category=self.root.id)
+
+    def test_invalid_params(self):
+        self.assertEqual(self.client.get('/api/products/facets/', {'price_min': 'abc'}).status_code, 400)
+
+
+class SerializationTraceTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Крючки')
+        for i in range(3):
+            Product.objects.create(category=category, name=f'Крючок {i}', description='', price=5, stock=100)
+
+    def test_trace_counts_serialized_objects(self):
+        tracing.install()
+        with tracing.collect() as trace:
+            self.client.get('/api/products/')
+        self.assertEqual(trace.as_dict()['ProductSerializer[compiled]']['objects'], 3)
+
+    def test_middleware_logs_sampled_requests(self):
+        def view(request):
+            ProductSerializer(Product.objects.all(), many=True).data
+            return HttpResponse()
+
+        with self.settings(SHOP_SERIALIZER_TRACE={'ENABLED': True, 'SAMPLE_RATE': 1.0}):
+            middleware = tracing.SerializerTraceMiddleware(view)
+        with self.assertLogs('shop.trace', 'INFO') as logs:
+            middleware(RequestFactory().get('/api/products/'))
+        self.assertIn('GET /api/products/: ProductSerializer: 3 objects', logs.output[0])
+
+    def test_middleware_disabled_by_default(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            tracing.SerializerTraceMiddleware(HttpResponse)
+
+
+class CompiledSerializerParityTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        category = Category.objects.create(name='Садки')
+        brand = Brand.objects.create(name='Salmo')
+        products = [
+            Product.objects.create(
+                category=category, brand=brand if i % 3 else None, name=f'Садок «{i}»', description='Длинное описание',
+                price=Decimal(price), stock=i, available=bool(i % 2), image='products/1.jpg' if i % 2 else '',
+            )
+            for i, price in enumerate(['0.10', '19.99', '1000', '123456.78', '5.5'])
+        ]
+        cart = Cart.objects.create(user=cls.user)
+        for product in products[:3]:
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+        for status in ('pending', 'cancelled'):
+            order = Order.objects.create(
+                user=cls.user, address='ул. Речная', personal_info={'phone': '+7 900', 'name': 'Иван'},
+                total_amount=Decimal('10.5'), status=status,
+            )
+            for product in products[1:4]:
+                OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+        Order.objects.create(user=cls.user, address='', personal_info=[])  # заказ без позиций
+
+    def assertParity(self, serializer_class, queryset):
+        request = APIRequestFactory().get('/api/')
+        compiled = compile_serializer(serializer_class)
+        self.assertIsNotNone(compiled)
+        expected = JSONRenderer().render(serializer_class(queryset, many=True, context={'request': request}).data)
+        actual = JSONRenderer().render(compiled.serialize(compiled.values(queryset), request))
+        self.assertEqual(actual, expected)
+
+    def test_product_serializer(self):
+        self.assertParity(ProductSerializer, Product.objects.order_by('id'))
+
+    def test_order_serializer(self):
+        self.assertParity(OrderSerializer, Order.objects.order_by('id'))
+
+    def test_cart_serializer(self):
+        self.assertParity(CartSerializer, Cart.objects.all())
+
+    def test_unsupported_serializer_falls_back(self):
+        from .serializers import CategorySerializer
+        self.assertIsNone(compile_serializer(CategorySerializer))
+
+    def test_endpoints_match_regular_path(self):
+        self.client.force_authenticate(self.user)
+        for url in ('/api/products/?ordering=-price', '/api/products/?paginate=cursor&page_size=2', '/api/orders/', '/api/cart/'):
+            cache.clear()
+            fast = self.client.get(url).content
+            cache.clear()
+            with self.settings(SHOP_FAST_SERIALIZERS=False):
+                regular = self.client.get(url).content
+            self.assertEqual(fast, regular, url)
+
+
+class QueryPlanTests(ShopTestCase):
+    """EXPLAIN основных запросов эндпоинтов: полный проход по таблице — ошибка."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'pass', is_staff=True)
+        cls.category = Category.objects.create(name='Эхолоты')
+        cls.brand = Brand.objects.create(name='Garmin')
+        product = Product.objects.create(category=cls.category, brand=cls.brand, name='Striker', description='', price=10, stock=5)
+        CartItem.objects.create(cart=Cart.objects.create(user=cls.user), product=product)
+        order = Order.objects.create(user=cls.user, address='ул. Речная', personal_info={})
+        OrderItem.objects.create(order=order, product=product, quantity=1, price=10)
+
+    def full_scans(self, url, user=None):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        scans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                if not query['sql'].startswith('SELECT') or 'shop_category"."parent_id" FROM' in query['sql']:
+                    continue  # дерево категорий читается целиком намеренно и кешируется
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                scans += [
+                    (row[3], query['sql']) for row in cursor.fetchall()
+                    if row[3].startswith('SCAN ') and ' USING ' not in row[3] and 'VIRTUAL TABLE' not in row[3]
+                ]
+        return scans
+
+    def test_endpoint_queries_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Разбор плана рассчитан на SQLite')
+        for url, user in [
+            ('/api/products/', None),
+            ('/api/products/?ordering=-price', None),
+            (f'/api/products/?category={self.category.id}', None),
+            (f'/api/products/?brands={self.brand.id}', None),
+            ('/api/products/?price_min=5&price_max=50', None),
+            ('/api/products/?paginate=cursor&page_size=1', None),
+            ('/api/products/?search=striker', None),
+            ('/api/cart/', self.user),
+            ('/api/cart-items/', self.user),
+            ('/api/orders/', self.user),
+            ('/api/admin/orders/', self.admin),
+            ('/api/admin/orders/?status=pending', self.admin),
+        ]:
+            cache.clear()
+            self.assertEqual(self.full_scans(url, user), [], url)
+
+
+class AsyncURLConf:
+    urlpatterns = [path('api/', include(build_urlpatterns(use_async=True)))]
+
+
+@override_settings(ROOT_URLCONF=AsyncURLConf)
+class AsyncViewTests(ShopTestCase):
+    """Async-маршруты (как под ASGI) отдают то же, что и синхронные."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        parent = Category.objects.create(name='Снасти')
+        cls.category = Category.objects.create(name='Катушки', parent=parent)
+        cls.brand = Brand.objects.create(name='Shimano')
+        cls.products = [
+            Product.objects.create(
+                category=cls.category, brand=cls.brand, name=f'Катушка {i}', description='',
+                price=Decimal(100 + i), stock=i, image='products/1.jpg' if i % 2 else '',
+            )
+            for i in range(5)
+        ]
+        cart = Cart.objects.create(user=cls.user)
+        CartItem.objects.create(cart=cart, product=cls.products[0], quantity=2)
+
+    def setUp(self):
+        super().setUp()
+        self.async_client = AsyncClient()
+        self.auth = f'Bearer {AccessToken.for_user(self.user)}'
+
+    def get_sync(self, url, **headers):
+        # Синхронный путь — те же view без async-обёртки
+        with self.settings(ROOT_URLCONF='fishing_store.urls'):
+            cache.clear()
+            return self.client.get(url, headers=headers)
+
+    async def get_async(self, url, **headers):
+        await cache.aclear()
+        return await self.async_client.get(url, headers=headers)
+
+    def test_read_routes_are_async(self):
+        for url, expected in (
+            ('/api/products/', True), ('/api/cart/', True), ('/api/cart/summary/', True), ('/api/brands/1/', True),
+            ('/api/orders/', False), (f'/api/categories/{self.category.id}/subcategories/', False),
+        ):
+            self.assertEqual(iscoroutinefunction(resolve(url).func), expected, url)
+
+    async def test_matches_sync_path(self):
+        for url in (
+            '/api/products/',
+            '/api/products/?ordering=-price&page_size=2&page=2',
+            '/api/products/?paginate=cursor&page_size=2',
+            f'/api/products/?category={self.category.id}&search=катушка',
+            f'/api/products/{self.products[1].id}/',
+            '/api/products/?fields=id,name,price,image_variants',
+            f'/api/products/{self.products[1].id}/?omit=description,brand_name',
+            '/api/categories/',
+            f'/api/categories/{self.category.id}/',
+            '/api/brands/',
+            f'/api/brands/{self.brand.id}/',
+        ):
+            expected = await sync_to_async(self.get_sync)(url)
+            response = await self.get_async(url)
+            self.assertEqual(response.status_code, expected.status_code, url)
+            self.assertEqual(response.content, expected.content, url)
+
+    async def test_cart_uses_jwt(self):
+        expected = await sync_to_async(self.get_sync)('/api/cart/', Authorization=self.auth)
+        response = await self.get_async('/api/cart/', Authorization=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response.json()[0]['items'][0]['quantity'], 2)
+        expected = await sync_to_async(self.get_sync)('/api/cart/summary/', Authorization=self.auth)
+        response = await self.get_async('/api/cart/summary/', Authorization=self.auth)
+        self.assertEqual(response.content, expected.content)
+
+        self.assertEqual((await self.get_async('/api/cart/')).status_code, 401)
+        response = await self.get_async('/api/cart/', Authorization='Bearer invalid')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+
+    async def test_missing_object_and_invalid_page(self):
+        self.assertEqual((await self.get_async('/api/products/999999/')).status_code, 404)
+        self.assertEqual((await self.get_async('/api/products/?page=99')).status_code, 404)
+
+    async def test_conditional_get(self):
+        url = f'/api/products/{self.products[0].id}/'
+        response = await self.get_async(url)
+        cached = await self.async_client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(cached.status_code, 304)
+
+    async def test_writes_use_sync_views(self):
+        response = await self.async_client.post(
+            '/api/cart-items/', {'product_id': self.products[1].id, 'quantity': 1},
+            content_type='application/json', headers={'Authorization': self.auth},
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(await CartItem.objects.filter(cart__user=self.user).acount(), 2)
+
+
+class StatelessJWTAuthTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'pass', is_staff=True)
+        Cart.objects.create(user=cls.user)
+
+    def setUp(self):
+        super().setUp()
+        StatelessJWTAuthentication.token_cache.clear()
+
+    def login(self, user):
+        response = self.client.post('/api/token/', {'username': user.username, 'password': 'pass'})
+        self.assertEqual(response.status_code, 200)
+        return {'Authorization': f'Bearer {response.data["access"]}'}
+
+    def user_queries(self, url, headers, status=200):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, headers=headers).status_code, status)
+        return [q['sql'] for q in queries if 'shop_customuser' in q['sql']]
+
+    def test_reads_skip_user_query(self):
+        headers = self.login(self.user)
+        self.assertEqual(self.user_queries('/api/cart/', headers), [])
+        self.assertEqual(self.user_queries('/api/orders/', headers), [])
+        response = self.client.get('/api/cart/', headers=headers)
+        self.assertEqual(response.data[0]['user'], self.user.id)
+
+    def test_tokens_without_claims_use_database(self):
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        self.assertEqual(len(self.user_queries('/api/cart/', headers)), 1)
+        self.assertEqual(self.user_queries('/api/cart/', headers), [])  # дальше — из LRU
+
+    def test_claims_expire_after_max_age(self):
+        headers = self.login(self.user)
+        with self.settings(SHOP_JWT_AUTH={'MAX_CLAIMS_AGE': -1}):
+            self.assertEqual(len(self.user_queries('/api/cart/', headers)), 1)
+
+    def test_demoted_admin_loses_access(self):
+        headers = self.login(self.admin)
+        self.assertEqual(self.client.get('/api/admin/orders/', headers=headers).status_code, 200)
+        self.admin.is_staff = False
+        self.admin.save()
+        self.assertEqual(self.client.get('/api/admin/orders/', headers=headers).status_code, 403)
+        self.assertEqual(self.client.post('/api/brands/', {'name': 'X'}, headers=headers).status_code, 403)
+
+    def test_deactivated_and_deleted_users_are_rejected(self):
+        headers = self.login(self.user)
+        self.assertEqual(self.client.get('/api/cart/', headers=headers).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/cart/', headers=headers).status_code, 401)
+        self.user.delete()
+        self.assertEqual(self.client.get('/api/cart/', headers=headers).status_code, 401)
+
+    def test_lru_is_bounded(self):
+        tokens = TokenCache(2)
+        for key in ('a', 'b', 'c'):
+            tokens.set(key, key)
+        tokens.get('b')
+        tokens.set('d', 'd')
+        self.assertEqual(list(tokens.entries), ['b', 'd'])
+
+
+class CartTotalsTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        category = Category.objects.create(name='Воблеры')
+        cls.cheap = Product.objects.create(category=category, name='Минноу', description='', price=Decimal('99.90'), stock=50)
+        cls.pricey = Product.objects.create(category=category, name='Крэнк', description='', price=Decimal('750.00'), stock=50)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def totals(self):
+        cart = Cart.objects.get(user=self.user)
+        return cart.item_count, cart.quantity_total, cart.subtotal
+
+    def assertTotals(self, expected):
+        self.assertEqual(self.totals(), expected)
+        cart_totals.recalculate()  # инкрементальные итоги совпадают с полным пересчётом
+        self.assertEqual(self.totals(), expected)
+
+    def add(self, product, quantity):
+        response = self.client.post('/api/cart-items/', {'product_id': product.id, 'quantity': quantity})
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def test_item_changes_update_totals(self):
+        cheap = self.add(self.cheap, 2)
+        pricey = self.add(self.pricey, 1)
+        self.assertTotals((2, 3, Decimal('949.80')))
+
+        self.assertEqual(self.client.patch(f'/api/cart-items/{cheap}/', {'quantity': 5}).status_code, 200)
+        self.assertTotals((2, 6, Decimal('1249.50')))
+
+        self.assertEqual(self.client.delete(f'/api/cart-items/{pricey}/').status_code, 204)
+        self.assertTotals((1, 5, Decimal('499.50')))
+
+    def test_price_change_fans_out_to_carts(self):
+        self.add(self.cheap, 3)
+        other = CustomUser.objects.create_user('other', 'other@example.com', 'pass')
+        self.client.force_authenticate(other)
+        self.add(self.cheap, 1)
+
+        self.cheap.price = Decimal('120.00')
+        with CaptureQueriesContext(connection) as queries:
+            self.cheap.save()
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE "shop_cart"')]), 1)
+        self.assertEqual(Cart.objects.get(user=other).subtotal, Decimal('120.00'))
+        self.assertTotals((1, 3, Decimal('360.00')))
+
+    def test_product_delete_and_checkout(self):
+        self.add(self.cheap, 1)
+        self.add(self.pricey, 2)
+        self.pricey.delete()
+        self.assertTotals((1, 1, Decimal('99.90')))
+
+        response = self.client.post('/api/orders/', {'address': 'ул. Речная', 'personal_info': {}}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTotals((0, 0, Decimal('0.00')))
+
+    def test_summary_is_single_query(self):
+        self.add(self.pricey, 2)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/cart/summary/')
+        self.assertEqual(response.data['item_count'], 1)
+        self.assertEqual(response.data['quantity_total'], 2)
+        self.assertEqual(response.data['subtotal'], '1500.00')
+
+        self.client.force_authenticate(CustomUser.objects.create_user('new', 'new@example.com', 'pass'))
+        self.assertEqual(self.client.get('/api/cart/summary/').data['item_count'], 0)
+
+
+class StressStockTests(SimpleTestCase):
+    """
+    manage.py stress_stock на отдельной файловой SQLite: потоки покупателей
+    и «администратора» ждут друг друга на настоящих блокировках БД, чего
+    не даёт тестовая БД в памяти.
+    """
+
+    def manage(self, *args, env):
+        return subprocess.run(
+            [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), *args],
+            env=env, capture_output=True, text=True, timeout=300,
+        )
+
+    def test_no_oversell_under_concurrent_checkouts(self):
+        with tempfile.TemporaryDirectory() as directory:
+            env = {
+                **os.environ, 'SHOP_DB_PROFILE': 'sqlite', 'SHOP_SQLITE_WAL': '1',
+                'DB_NAME': os.path.join(directory, 'stress.sqlite3'),
+            }
+            migrate = self.manage('migrate', '-v0', env=env)
+            self.assertEqual(migrate.returncode, 0, migrate.stderr)
+            result = self.manage('stress_stock', '--threads', '8', '--operations', '25', '--stock', '20', env=env)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('no oversell', result.stdout)
+        self.assertRegex(result.stdout, r'checkout [1-9]')
+
+
+class CartUpsertTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        category = Category.objects.create(name='Лески')
+        cls.line = Product.objects.create(category=category, name='Моно', description='', price=Decimal('300.00'), stock=10)
+        cls.braid = Product.objects.create(category=category, name='Плетёнка', description='', price=Decimal('1200.00'), stock=10)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def lines(self):
+        return dict(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity'))
+
+    def test_repeated_add_increments_quantity(self):
+        for _ in range(3):
+            response = self.client.post('/api/cart-items/', {'product_id': self.line.id, 'quantity': 2})
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['quantity'], 6)
+        self.assertEqual(self.lines(), {self.line.id: 6})
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual((cart.item_count, cart.quantity_total, cart.subtotal), (1, 6, Decimal('1800.00')))
+
+    def test_add_is_single_write(self):
+        self.client.post('/api/cart-items/', {'product_id': self.line.id})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/api/cart-items/', {'product_id': self.line.id})
+        writes = [q['sql'] for q in queries if q['sql'].startswith(('INSERT INTO "shop_cartitem"', 'UPDATE "shop_cartitem"'))]
+        self.assertEqual(len(writes), 1, writes)
+        self.assertIn('ON CONFLICT', writes[0])
+
+    def test_batch_add_and_set(self):
+        response = self.client.post('/api/cart-items/batch/', {'items': [
+            {'product_id': self.line.id, 'quantity': 1},
+            {'product_id': self.braid.id, 'quantity': 2},
+            {'product_id': self.line.id, 'quantity': 3},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['item_count'], 2)
+        self.assertEqual(response.data['subtotal'], '3600.00')
+        self.assertEqual(self.lines(), {self.line.id: 4, self.braid.id: 2})
+
+        self.client.post('/api/cart-items/batch/', {
+            'items': [{'product_id': self.line.id, 'quantity': 1}], 'mode': 'set',
+        }, format='json')
+        self.assertEqual(self.lines(), {self.line.id: 1, self.braid.id: 2})
+
+    def test_upsert_updates_totals_incrementally(self):
+        def totals():
+            return Cart.objects.filter(user=self.user).values_list('item_count', 'quantity_total', 'subtotal').get()
+
+        with mock.patch.object(cart_totals, 'recalculate', side_effect=AssertionError):
+            self.client.post('/api/cart-items/', {'product_id': self.line.id, 'quantity': 2})
+            self.client.post('/api/cart-items/batch/', {'items': [
+                {'product_id': self.line.id, 'quantity': 1}, {'product_id': self.braid.id, 'quantity': 2},
+            ]}, format='json')
+            self.client.post('/api/cart-items/batch/', {'items': [
+                {'product_id': self.braid.id, 'quantity': 1}, {'product_id': self.line.id, 'quantity': 5},
+            ], 'mode': 'set'}, format='json')
+        self.assertEqual(totals(), (2, 6, Decimal('2700.00')))
+        cart_totals.recalculate()
+        self.assertEqual(totals(), (2, 6, Decimal('2700.00')))
+
+    def test_subtotal_holds_maximum_quantities(self):
+        Product.objects.filter(pk__in=[self.line.pk, self.braid.pk]).update(price=Decimal('99999999.99'))
+        self.client.post('/api/cart-items/batch/', {'items': [
+            {'product_id': self.line.id, 'quantity': CartItem.MAX_QUANTITY},
+            {'product_id': self.braid.id, 'quantity': CartItem.MAX_QUANTITY},
+        ]}, format='json')
+        response = self.client.get('/api/cart/summary/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.data['subtotal']), 2 * CartItem.MAX_QUANTITY * Decimal('99999999.99'))
+
+    def test_batch_is_atomic(self):
+        response = self.client.post('/api/cart-items/batch/', {'items': [
+            {'product_id': self.line.id, 'quantity': 1},
+            {'product_id': 999999, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.lines(), {})
+        self.assertEqual(self.client.post('/api/cart-items/batch/', {'items': []}, format='json').status_code, 400)
+
+    def test_quantity_is_bounded(self):
+        response = self.client.post('/api/cart-items/', {'product_id': self.line.id, 'quantity': 10 ** 11})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('quantity', response.data)
+        response = self.client.post('/api/cart-items/batch/', {'items': [
+            {'product_id': self.line.id, 'quantity': 10 ** 12},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        # Сумма повторных добавлений тоже ограничена — и ничего не меняет
+        self.client.post('/api/cart-items/', {'product_id': self.line.id, 'quantity': CartItem.MAX_QUANTITY})
+        self.assertEqual(self.client.post('/api/cart-items/', {'product_id': self.line.id}).status_code, 400)
+        response = self.client.post('/api/cart-items/batch/', {'items': [
+            {'product_id': self.braid.id, 'quantity': CartItem.MAX_QUANTITY},
+            {'product_id': self.braid.id, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.lines(), {self.line.id: CartItem.MAX_QUANTITY})
+        item = CartItem.objects.get(cart__user=self.user)
+        self.assertEqual(self.client.patch(f'/api/cart-items/{item.id}/', {'quantity': 10 ** 11}).status_code, 400)
+        self.assertEqual(self.client.get('/api/cart/summary/').status_code, 200)
+
+    def test_anonymous_cannot_add(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.post('/api/cart-items/', {'product_id': self.line.id}).status_code, 401)
+
+
+class ProductImportExportTests(ShopTestCase):
+    CSV = (
+        'sku,name,description,price,stock,available,category,brand\n'
+        'A-1,Катушка Stradic,Безынерционная,"12990,00",5,1,Снасти / Катушки,Shimano\n'
+        'A-2,Катушка Ninja,,4500,0,нет,Катушки,Daiwa\n'
+        'A-3,Шнур,,abc,1,1,Катушки,Daiwa\n'
+        ',Без артикула,,100,1,1,Катушки,\n'
+        'A-4,Садок,,300,1,1,Садки,\n'
+        'A-1,Катушка Stradic FL,Безынерционная,12990,7,1,{reels},shimano\n'
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'pass', is_staff=True)
+        cls.user = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        root = Category.objects.create(name='Снасти')
+        cls.reels = Category.objects.create(name='Катушки', parent=root)
+        cls.shimano = Brand.objects.create(name='Shimano')
+
+    def import_csv(self, text, **kwargs):
+        return import_products(StringIO(text), 'csv', **kwargs)
+
+    def test_import_creates_products_and_reports_errors(self):
+        # A-1 повторяется в третьей пачке — создаётся, потом обновляется
+        report = self.import_csv(self.CSV.format(reels=self.reels.id), chunk_size=2)
+        self.assertEqual((report.created, report.updated), (2, 1))
+        self.assertEqual(
+            [(error['line'], error['sku']) for error in report.errors],
+            [(4, 'A-3'), (5, ''), (6, 'A-4')],
+        )
+        stradic = Product.objects.get(sku='A-1')
+        self.assertEqual((stradic.name, stradic.stock, stradic.brand, stradic.category), ('Катушка Stradic FL', 7, self.shimano, self.reels))
+        ninja = Product.objects.get(sku='A-2')
+        self.assertEqual((ninja.price, ninja.available, ninja.brand.name), (Decimal('4500.00'), False, 'Daiwa'))
+        self.assertEqual(self.client.get('/api/products/', {'search': 'ninja'}).data['count'], 1)
+
+    def test_reimport_updates_by_sku(self):
+        self.import_csv(self.CSV.format(reels=self.reels.id))
+        user = CustomUser.objects.create_user('cart', 'cart@example.com', 'pass')
+        CartItem.objects.create(cart=Cart.objects.create(user=user), product=Product.objects.get(sku='A-2'), quantity=2)
+        report = self.import_csv('sku,name,price,stock,category\nA-2,Катушка Ninja LT,5000,3,Катушки\n')
+        self.assertEqual((report.created, report.updated, report.error_count), (0, 1, 0))
+        self.assertEqual(Product.objects.get(sku='A-2').name, 'Катушка Ninja LT')
+        self.assertEqual(Cart.objects.get(user=user).subtotal, Decimal('10000.00'))
+
+    def test_jsonl_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', encoding='utf-8', delete=False) as feed:
+            feed.write(json.dumps({'sku': 'J-1', 'name': 'Эхолот', 'price': 25000, 'stock': 2, 'category': self.reels.id}) + '\n')
+            feed.write('{broken\n')
+        self.addCleanup(os.remove, feed.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_products', feed.name, stdout=out, stderr=err)
+        self.assertIn('Created 1, updated 0, errors 1', out.getvalue())
+        self.assertIn('"line": 2', err.getvalue())
+
+    def test_api_import_and_export_round_trip(self):
+        upload = BytesIO(('\ufeff' + self.CSV.format(reels=self.reels.id)).encode())
+        upload.name = 'feed.csv'
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.post('/api/products/import/', {'file': upload}).status_code, 403)
+        self.assertEqual(self.client.get('/api/products/export/').status_code, 403)
+
+        self.client.force_authenticate(self.admin)
+        upload.seek(0)
+        response = self.client.post('/api/products/import/', {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 2)
+
+        response = self.client.get('/api/products/export/')
+        self.assertTrue(response.streaming)
+        exported = b''.join(response.streaming_content).decode()
+        self.assertIn('Снасти / Катушки', exported)
+        report = self.import_csv(exported)
+        self.assertEqual((report.created, report.updated, report.error_count), (0, 2, 0))
+
+        response = self.client.get('/api/products/export/', {'fmt': 'jsonl'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(sorted(row['sku'] for row in rows), ['A-1', 'A-2'])
+
+    def test_api_import_rejects_non_utf8_file(self):
+        upload = BytesIO(self.CSV.format(reels=self.reels.id).encode('cp1251'))
+        upload.name = 'feed.csv'
+        self.client.force_authenticate(self.admin)
+        response = self.client.post('/api/products/import/', {'file': upload})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('file', response.data)
+
+        # Плохой байт в конце большого файла: пачки по одной строке не успевают закоммититься
+        rows = ''.join(f'B-{i},Катушка {i},{"д" * 100},100,1,1,Катушки,\n' for i in range(200))
+        upload = BytesIO(('sku,name,description,price,stock,available,category,brand\n' + rows).encode() + b'\xff\n')
+        upload.name = 'feed.csv'
+        import_products = product_io.import_products
+        with mock.patch.object(product_io, 'import_products', lambda stream, fmt: import_products(stream, fmt, chunk_size=1)):
+            response = self.client.post('/api/products/import/', {'file': upload})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Product.objects.filter(sku__startswith='B-').exists())
+
+    def test_text_stream_decodes_across_chunks(self):
+        stream = product_io.text_stream(BytesIO('\ufeffsku,name\nБ-1,Щука\n'.encode()), chunk_size=3)
+        self.assertEqual(stream.read(), 'sku,name\nБ-1,Щука\n')
+
+    async def test_asgi_export_streams_async_iterator(self):
+        await sync_to_async(self.import_csv)(self.CSV.format(reels=self.reels.id))
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.admin)}'}
+        response = await AsyncClient().get('/api/products/export/', {'fmt': 'jsonl'}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(sorted(json.loads(line)['sku'] for line in content.splitlines()), ['A-1', 'A-2'])
+
+
+def make_image(size=(800, 600), color='navy', fmt='PNG'):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+class ImageVariantTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'pass', is_staff=True)
+        cls.category = Category.objects.create(name='Эхолоты')
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings = self.settings(MEDIA_ROOT=media, SHOP_IMAGES={'ASYNC': False})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def upload(self, name='Эхолот', content=None):
+        self.client.force_authenticate(self.admin)
+        response = self.client.post('/api/products/', {
+            'name': name, 'description': 'Описание', 'price': '100.00', 'stock': 1, 'category': self.category.id,
+            'image': SimpleUploadedFile('photo.png', content or make_image(), content_type='image/png'),
+        })
+        self.assertEqual(response.status_code, 201, response.data)
+        return Product.objects.get(pk=response.data['id'])
+
+    def test_upload_builds_variants(self):
+        product = self.upload()
+        self.assertEqual(set(product.image_variants), {'thumb', 'card', 'large'})
+        thumb = product.image_variants['thumb']
+        self.assertEqual((thumb['width'], thumb['height']), (160, 120))
+        storage = Product._meta.get_field('image').storage
+        with storage.open(thumb['webp']) as stored:
+            self.assertEqual(Image.open(stored).format, 'WEBP')
+
+        data = self.client.get(f'/api/products/{product.id}/').data
+        self.assertEqual(data['image_variants']['card']['jpeg'], 'http://testserver/media/' + product.image_variants['card']['jpeg'])
+
+    def test_names_are_content_hashed(self):
+        content = make_image(color='olive')
+        first, second = self.upload(content=content), self.upload(content=content)
+        self.assertEqual(first.image_variants, second.image_variants)
+        self.assertNotEqual(self.upload(content=make_image(color='red')).image_variants, first.image_variants)
+
+    def test_list_matches_regular_serializer(self):
+        self.upload()
+        fast = self.client.get('/api/products/').content
+        cache.clear()
+        with self.settings(SHOP_FAST_SERIALIZERS=False):
+            self.assertEqual(self.client.get('/api/products/').content, fast)
+
+    def test_async_mode_runs_after_commit(self):
+        with self.settings(SHOP_IMAGES={'ASYNC': True}):
+            with self.captureOnCommitCallbacks() as callbacks:
+                product = self.upload()
+        self.assertEqual(len([c for c in callbacks if 'schedule_variants' in c.__qualname__]), 1)
+        self.assertEqual(product.image_variants, {})
+
+    def test_backfill_command(self):
+        product = self.upload()
+        Product.objects.filter(pk=product.pk).update(image_variants={})
+        out = StringIO()
+        call_command('backfill_image_variants', workers=1, stdout=out)
+        self.assertIn('Built variants for 1 products, failed 0', out.getvalue())
+        product.refresh_from_db()
+        self.assertIn('thumb', product.image_variants)
+
+
+FLAKY_CALLS = []
+
+
+@task_queue.task(max_attempts=2)
+def flaky_task(fail):
+    FLAKY_CALLS.append(fail)
+    if fail:
+        raise ValueError('boom')
+
+
+class TaskQueueTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        category = Category.objects.create(name='Подсаки')
+        cls.product = Product.objects.create(name='Подсак', description='', price='1500.00', stock=5, category=category)
+
+    def setUp(self):
+        super().setUp()
+        FLAKY_CALLS.clear()
+
+    def test_order_confirmation_runs_in_worker(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/orders/', {'address': 'Пирс 1', 'personal_info': {}}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(mail.outbox, [])  # ответ не ждёт письма
+
+        task = Task.objects.get(idempotency_key=f'order-confirmation:{response.data["id"]}')
+        self.assertEqual(task.name, 'shop.checkout.send_order_confirmation')
+        self.assertEqual(task_queue.run_pending(), 1)
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.DONE)
+        self.assertEqual(mail.outbox[0].to, ['buyer@example.com'])
+        self.assertIn('Подсак x 2', mail.outbox[0].body)
+
+    def test_idempotency_key(self):
+        first = flaky_task.enqueue({'fail': False}, key='once')
+        second = flaky_task.enqueue({'fail': False}, key='once')
+        self.assertEqual(first.pk, second.pk)
+        task_queue.run_pending()
+        self.assertEqual(FLAKY_CALLS, [False])
+
+    def test_retry_with_backoff_then_fail(self):
+        task = flaky_task.enqueue({'fail': True})
+        with self.assertLogs('shop.tasks', 'WARNING'):
+            self.assertEqual(task_queue.run_pending(), 1)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.QUEUED, 1))
+        self.assertGreater(task.run_at, task.created_at)
+        self.assertIn('ValueError: boom', task.last_error)
+        self.assertEqual(task_queue.run_pending(), 0)  # пауза ещё не прошла
+
+        Task.objects.filter(pk=task.pk).update(run_at=task.created_at)
+        with self.assertLogs('shop.tasks', 'ERROR'):
+            task_queue.run_pending()
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.FAILED, 2))
+        self.assertEqual(FLAKY_CALLS, [True, True])
+
+    def test_expired_lease_is_reclaimed(self):
+        task = flaky_task.enqueue({'fail': False})
+        self.assertEqual([claimed.pk for claimed in task_queue.claim('crashed')], [task.pk])
+        self.assertEqual(task_queue.claim('other'), [])  # аренда действует
+
+        Task.objects.filter(pk=task.pk).update(locked_until=task.created_at)
+        self.assertEqual(task_queue.run_pending(worker='other'), 1)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.DONE, 2))
+
+    def test_eager_mode_runs_after_commit(self):
+        with self.settings(SHOP_TASKS={'EAGER': True}):
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    flaky_task.enqueue({'fail': False})
+                    self.assertEqual(FLAKY_CALLS, [])
+        self.assertEqual(FLAKY_CALLS, [False])
+        self.assertEqual(Task.objects.get().status, Task.DONE)
+
+
+class OrderAnalyticsTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'pass', is_staff=True)
+        cls.user = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        category = Category.objects.create(name='Воблеры')
+        brand = Brand.objects.create(name='Rapala')
+        cls.wobbler = Product.objects.create(name='Воблер', description='', price='500.00', stock=10, category=category, brand=brand)
+        cls.spoon = Product.objects.create(name='Блесна', description='', price='150.50', stock=10, category=category)
+
+        def order(day, status, *lines):
+            created = Order.objects.create(user=cls.user, address='-', personal_info={}, status=status)
+            Order.objects.filter(pk=created.pk).update(created_at=f'{day}T10:00:00Z')
+            for product, quantity in lines:
+                OrderItem.objects.create(order=created, product=product, quantity=quantity, price=product.price)
+            return created
+
+        # 1 и 2 января — понедельник и вторник одной недели, 8 января — следующая неделя
+        cls.first = order('2024-01-01', 'completed', (cls.wobbler, 2), (cls.spoon, 1))
+        order('2024-01-02', 'completed', (cls.spoon, 4))
+        order('2024-01-08', 'cancelled', (cls.wobbler, 1))
+        order('2024-02-09', 'completed', (cls.wobbler, 1))  # вне диапазона
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.admin)
+
+    def get(self, **params):
+        return self.client.get('/api/admin/orders/analytics/', {'date_from': '2024-01-01', 'date_to': '2024-01-31', **params})
+
+    def test_breakdowns(self):
+        data = self.get().data
+        self.assertEqual(data['totals'], {'revenue': '2252.50', 'units': 8, 'orders': 3, 'average_basket': '750.83'})
+        self.assertEqual(
+            [(row['period'], row['revenue'], row['orders']) for row in data['timeline']],
+            [('2024-01-01', '1150.50', 1), ('2024-01-02', '602.00', 1), ('2024-01-08', '500.00', 1)],
+        )
+        self.assertEqual(
+            [(row['name'], row['revenue'], row['units'], row['orders']) for row in data['products']],
+            [('Воблер', '1500.00', 3, 2), ('Блесна', '752.50', 5, 2)],
+        )
+        self.assertEqual([(row['name'], row['revenue']) for row in data['brands']], [('Rapala', '1500.00'), (None, '752.50')])
+        self.assertEqual([(row['name'], row['units']) for row in data['categories']], [('Воблеры', 8)])
+        self.assertEqual(
+            [(row['status'], row['revenue'], row['orders']) for row in data['statuses']],
+            [('completed', '1752.50', 2), ('cancelled', '500.00', 1)],
+        )
+
+    def test_periods_and_status_filter(self):
+        weeks = self.get(period='week').data['timeline']
+        self.assertEqual([(row['period'], row['revenue']) for row in weeks], [('2024-01-01', '1752.50'), ('2024-01-08', '500.00')])
+        months = self.get(period='month', status='completed', date_to='2024-02-29').data
+        self.assertEqual([(row['period'], row['revenue']) for row in months['timeline']], [('2024-01-01', '1752.50'), ('2024-02-01', '500.00')])
+        self.assertEqual(months['totals']['orders'], 3)
+
+    def test_closed_period_is_cached_until_history_changes(self):
+        self.get()
+        with self.assertNumQueries(3):  # только названия товаров, брендов и категорий
+            self.get()
+        order = Order.objects.get(pk=self.first.pk)
+        order.status = 'cancelled'
+        order.save()
+        statuses = {row['status']: row['revenue'] for row in self.get().data['statuses']}
+        self.assertEqual(statuses, {'completed': '602.00', 'cancelled': '1650.50'})
+
+    def test_validation_and_permissions(self):
+        self.assertEqual(self.get(date_from='2024-02-01').status_code, 400)
+        self.assertEqual(self.get(period='year').status_code, 400)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.get().status_code, 403)
+
+
+class SalesRollupTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        cls.user = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        cls.category = Category.objects.create(name='Кормушки')
+        cls.feeder = Product.objects.create(name='Кормушка', description='', price='200.00', stock=10, category=cls.category)
+        cls.first = cls.order('2024-03-01', (cls.feeder, 2))
+        cls.order('2024-03-01', (cls.feeder, 1))
+        cls.order('2024-03-02', (cls.feeder, 5))
+
+    @classmethod
+    def order(cls, day, *lines, status='completed'):
+        order = Order.objects.create(user=cls.user, address='-', personal_info={}, status=status)
+        Order.objects.filter(pk=order.pk).update(created_at=f'{day}T09:00:00Z')
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, quantity=quantity, price=product.price) for product, quantity in lines
+        )
+        return order
+
+    def product_rows(self):
+        return list(DailyProductSales.objects.order_by('day', 'status').values_list('day', 'status', 'quantity', 'revenue', 'orders'))
+
+    def test_refresh_is_incremental(self):
+        self.assertEqual(rollups.refresh(), 2)
+        self.assertEqual([(str(day), status, quantity, str(revenue), orders) for day, status, quantity, revenue, orders in self.product_rows()], [
+            ('2024-03-01', 'completed', 3, '600.00', 2),
+            ('2024-03-02', 'completed', 5, '1000.00', 1),
+        ])
+        self.assertEqual(DailyCategorySales.objects.get(day='2024-03-01').category, self.category)
+        self.assertEqual(RollupState.objects.get().last_order_id, Order.objects.latest('pk').pk)
+
+        self.assertEqual(rollups.refresh(), 0)
+        self.order('2024-03-02', (self.feeder, 1))
+        self.assertEqual(rollups.refresh(), 1)
+        self.assertEqual(DailySales.objects.get(day='2024-03-02').orders, 2)
+
+    def test_young_orders_wait_for_the_lag(self):
+        rollups.refresh()
+        Order.objects.create(user=self.user, address='-', personal_info={})
+        self.assertEqual(rollups.refresh(), 0)
+        self.assertLess(RollupState.objects.get().last_order_id, Order.objects.latest('pk').pk)
+
+    def test_cancellation_recomputes_the_day(self):
+        rollups.refresh()
+        order = Order.objects.get(pk=self.first.pk)
+        order.status = 'cancelled'
+        order.save()
+        self.assertEqual(rollups.refresh(), 1)
+        self.assertEqual([row[:3] for row in self.product_rows()][:2], [
+            (date(2024, 3, 1), 'cancelled', 2), (date(2024, 3, 1), 'completed', 1),
+        ])
+
+    def test_analytics_reads_rollups(self):
+        self.client.force_authenticate(self.admin)
+        params = {'date_from': '2024-03-01', 'date_to': '2024-03-31'}
+        raw = self.client.get('/api/admin/orders/analytics/', params).data
+        rollups.refresh()
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/admin/orders/analytics/', params).data, raw)
+        self.assertFalse([query for query in queries if 'shop_orderitem' in query['sql']])
+
+        self.client.force_login(self.admin)
+        response = self.client.get('/admin/shop/dailyproductsales/')
+        self.assertContains(response, 'Кормушка')
+
+
+class RecommendationTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        floats = Category.objects.create(name='Поплавки')
+        hooks = Category.objects.create(name='Крючки')
+        brand = Brand.objects.create(name='Owner')
+
+        def product(name, category=floats, **extra):
+            return Product.objects.create(name=name, description='', price='50.00', stock=10, category=category, **extra)
+
+        cls.a, cls.b, cls.c, cls.d = (product(name) for name in 'ABCD')
+        cls.cold = product('E', brand=brand)
+        cls.same_brand = product('F', category=hooks, brand=brand)
+        product('G', available=False)
+        for lines in ([cls.a, cls.b], [cls.a, cls.b, cls.c], [cls.a, cls.d], [cls.d]):
+            cls.order(lines)
+
+    @classmethod
+    def order(cls, products):
+        order = Order.objects.create(user=cls.user, address='-', personal_info={})
+        Order.objects.filter(pk=order.pk).update(created_at='2024-05-01T12:00:00Z')
+        OrderItem.objects.bulk_create(OrderItem(order=order, product=product, quantity=1, price=product.price) for product in products)
+
+    def neighbours(self, product):
+        return ProductNeighbours.objects.get(product=product)
+
+    def test_refresh_builds_top_neighbours(self):
+        self.assertEqual(recommendations.refresh(), 4)
+        neighbours = self.neighbours(self.a)
+        self.assertEqual(neighbours.order_count, 3)
+        # B: 2/sqrt(3*2), C: 1/sqrt(3*1), D: 1/sqrt(3*2)
+        self.assertEqual(neighbours.neighbour_ids, [self.b.pk, self.c.pk, self.d.pk])
+        self.assertEqual(neighbours.scores, [0.8165, 0.5774, 0.4082])
+        self.assertEqual(CoPurchase.objects.get(product=self.b, other=self.a).count, 2)
+
+    def test_incremental_refresh_matches_rebuild(self):
+        recommendations.refresh()
+        self.order([self.b, self.c])
+        self.assertEqual(recommendations.refresh(), 2)
+        self.assertEqual(recommendations.refresh(), 0)
+        self.assertEqual(CoPurchase.objects.get(product=self.c, other=self.b).count, 2)
+        incremental = list(ProductNeighbours.objects.order_by('pk').values_list('product', 'order_count', 'neighbour_ids'))
+        self.assertEqual(self.neighbours(self.c).neighbour_ids, [self.b.pk, self.a.pk])
+
+        recommendations.refresh(rebuild=True)
+        rebuilt = list(ProductNeighbours.objects.order_by('pk').values_list('product', 'order_count', 'neighbour_ids'))
+        self.assertEqual([row[:2] for row in rebuilt], [row[:2] for row in incremental])
+        self.assertEqual(self.neighbours(self.c).neighbour_ids, [self.b.pk, self.a.pk])
+
+    def test_large_baskets_are_skipped(self):
+        lines = np.array([[1, 10], [1, 11], [1, 12], [2, 10], [2, 11]])
+        pairs, counts, (products, frequency) = recommendations.count_pairs(lines, max_basket=2)
+        self.assertEqual(pairs.tolist(), [[10, 11], [11, 10]])
+        self.assertEqual(counts.tolist(), [1, 1])
+        self.assertEqual(frequency.tolist(), [2, 2, 1])
+
+    def test_endpoint_with_fallbacks(self):
+        recommendations.refresh()
+        data = self.client.get(f'/api/products/{self.a.pk}/recommendations/', {'limit': 5}).data
+        self.assertEqual([(row['name'], row['source']) for row in data], [
+            ('B', 'bought_together'), ('C', 'bought_together'), ('D', 'bought_together'), ('E', 'category'),
+        ])
+        with self.assertNumQueries(0):  # закешировано
+            self.client.get(f'/api/products/{self.a.pk}/recommendations/', {'limit': 5})
+
+        # Новый товар без продаж: популярные в категории, затем тот же бренд
+        data = self.client.get(f'/api/products/{self.cold.pk}/recommendations/', {'limit': 6}).data
+        self.assertEqual([(row['name'], row['source']) for row in data], [
+            ('A', 'category'), ('D', 'category'), ('B', 'category'), ('C', 'category'), ('F', 'brand'),
+        ])
+        self.assertEqual(self.client.get('/api/products/999999/recommendations/').status_code, 404)
+        self.assertEqual(self.client.get('/api/products/abc/recommendations/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/products/{self.a.pk}/recommendations/', {'limit': 'x'}).status_code, 400)
+
+
+class MetricsTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'pass', is_staff=True)
+        category = Category.objects.create(name='Грузила')
+        cls.product = Product.objects.create(name='Грузило', description='', price='10.00', stock=100, category=category)
+
+    def setUp(self):
+        super().setUp()
+        metrics.registry.reset()
+
+    def histogram(self, name, view, action):
+        return metrics.registry.histograms[(name, (view, action, 'GET'))]
+
+    def test_records_per_view_and_action(self):
+        with self.settings(SHOP_METRICS={'SERIALIZER_TIME': True}):
+            self.client.get('/api/products/')
+            self.client.get(f'/api/products/{self.product.pk}/')
+            self.client.get('/api/products/999999/')
+
+        retrieve = ('ProductViewSet', 'retrieve')
+        self.assertEqual(metrics.registry.requests[(*retrieve, 'GET', '200')], 1)
+        self.assertEqual(metrics.registry.requests[(*retrieve, 'GET', '404')], 1)
+        self.assertGreater(self.histogram('shop_request_db_queries', *retrieve).sum, 0)
+        self.assertGreater(self.histogram('shop_request_serializer_seconds', *retrieve).sum, 0)
+        self.assertGreater(self.histogram('shop_request_serializer_seconds', 'ProductViewSet', 'list').sum, 0)
+        self.assertGreater(self.histogram('shop_response_size_bytes', 'ProductViewSet', 'list').sum, 100)
+
+    def test_prometheus_endpoint_is_admin_only(self):
+        self.client.get('/api/products/')
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 401)
+
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        text = response.content.decode()
+        self.assertIn('shop_requests_total{view="ProductViewSet",action="list",method="GET",status="200"} 1', text)
+        self.assertIn('# TYPE shop_request_duration_seconds histogram', text)
+        self.assertIn('shop_request_db_queries_bucket{view="ProductViewSet",action="list",method="GET",le="+Inf"} 1', text)
+
+    def test_slow_requests_are_logged_with_queries(self):
+        with self.settings(SHOP_METRICS={'SLOW_REQUEST_MS': 0, 'SLOW_TOP_QUERIES': 1}):
+            with self.assertLogs('shop.metrics', 'WARNING') as logs:
+                self.client.get(f'/api/products/{self.product.pk}/')
+        self.assertIn('(ProductViewSet.retrieve) 200', logs.output[0])
+        self.assertEqual(logs.output[0].count('ms: SELECT'), 1)
+
+    def test_serializer_time_is_off_by_default(self):
+        self.client.get('/api/products/')
+        self.assertNotIn(('shop_request_serializer_seconds', ('ProductViewSet', 'list', 'GET')), metrics.registry.histograms)
+        self.assertGreater(self.histogram('shop_request_db_queries', 'ProductViewSet', 'list').sum, 0)
+
+    @override_settings(ROOT_URLCONF=AsyncURLConf)
+    async def test_async_requests_are_measured_without_thread_hop(self):
+        async def view(request):
+            return HttpResponse()
+        self.assertTrue(iscoroutinefunction(metrics.MetricsMiddleware(view)))
+        self.assertTrue(iscoroutinefunction(db_router.PinPrimaryMiddleware(view)))
+
+        # Соединение тестовой БД открыто до загрузки middleware (в процессе сервера
+        # соединения потоков запросов открываются позже и получают обёртку по сигналу)
+        await sync_to_async(lambda: metrics.install_query_recorder(connection))()
+        response = await AsyncClient().get('/api/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(metrics.registry.requests[('ProductViewSet', 'list', 'GET', '200')], 1)
+        self.assertGreater(self.histogram('shop_request_db_queries', 'ProductViewSet', 'list').sum, 0)
+
+    def test_disabled(self):
+        with self.settings(SHOP_METRICS={'ENABLED': False}):
+            with self.assertRaises(MiddlewareNotUsed):
+                metrics.MetricsMiddleware(HttpResponse)
+
+
+class ApiBenchmarkTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.timings = os.path.join(directory, 'timings.local.json')
+
+    def run_bench(self, baseline, **options):
+        out = StringIO()
+        call_command(
+            'bench_api', scale='tiny', iterations=3, warmup=1, baseline=baseline, timings=self.timings, stdout=out, **options,
+        )
+        return out.getvalue()
+
+    def test_baseline_round_trip_and_regression(self):
+        baseline = os.path.join(os.path.dirname(self.timings), 'baseline.json')
+        self.run_bench(baseline, update_baseline=True)
+        with open(baseline, encoding='utf-8') as file:
+            recorded = json.load(file)
+        self.assertEqual(set(recorded['scenarios']), {'browse', 'detail', 'search', 'filter', 'add_to_cart', 'checkout'})
+        self.assertGreater(recorded['scenarios']['checkout']['queries'], 0)
+        # В репозиторий — только число запросов, время остаётся в локальном файле
+        self.assertNotIn('p90_ms', recorded['scenarios']['checkout'])
+        with open(self.timings, encoding='utf-8') as file:
+            self.assertIn('p90_ms', json.load(file)['scenarios']['checkout'])
+        # Данные бенчмарка откатываются
+        self.assertFalse(Product.objects.exists())
+
+        self.assertIn('No regressions', self.run_bench(baseline, tolerance=1000))
+
+        recorded['scenarios']['detail']['queries'] = 0
+        with open(baseline, 'w', encoding='utf-8') as file:
+            json.dump(recorded, file)
+        with self.assertRaisesMessage(CommandError, 'detail: 1 queries per request, baseline 0'):
+            self.run_bench(baseline, tolerance=1000, scenarios='detail')
+
+    def test_local_timings_are_written_on_first_run(self):
+        missing = os.path.join(os.path.dirname(self.timings), 'missing.json')
+        self.assertIn('Timings of this machine written', self.run_bench(missing, scenarios='detail'))
+        self.assertIn('No regressions', self.run_bench(missing, scenarios='detail', tolerance=1000))
+        with self.assertRaisesMessage(CommandError, 'detail: p90'):
+            self.run_bench(missing, scenarios='detail', tolerance=-1)
+
+    def test_unknown_scenario(self):
+        with self.assertRaisesMessage(CommandError, 'Unknown scenarios: nope'):
+            self.run_bench('unused.json', scenarios='browse,nope')
+
+
+class DatabaseProfileTests(SimpleTestCase):
+    databases = {'default'}
+
+    def test_sqlite_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    def test_sqlite_wal_is_opt_in(self):
+        # WAL переписывает заголовок файла БД — только по явному SHOP_SQLITE_WAL=1
+        with mock.patch.dict(os.environ, {'SHOP_DB_PROFILE': 'sqlite', 'SHOP_SQLITE_WAL': '0'}):
+            self.assertNotIn('journal_mode', databases.build(settings.BASE_DIR)['default']['OPTIONS']['init_command'])
+        with mock.patch.dict(os.environ, {'SHOP_DB_PROFILE': 'sqlite', 'SHOP_SQLITE_WAL': '1'}):
+            init_command = databases.build(settings.BASE_DIR)['default']['OPTIONS']['init_command']
+        self.assertIn('PRAGMA journal_mode=WAL', init_command)
+        self.assertIn('PRAGMA synchronous=NORMAL', init_command)
+
+    def test_server_profile(self):
+        env = {'SHOP_DB_PROFILE': 'server', 'DB_HOST': 'db', 'DB_POOL': '1', 'DB_REPLICA_HOSTS': 'r1, r2:5433'}
+        with mock.patch.dict(os.environ, env):
+            config = databases.build(None)
+        self.assertEqual(list(config), ['default', 'replica_0', 'replica_1'])
+        self.assertEqual(config['default']['CONN_MAX_AGE'], 0)
+        self.assertTrue(config['default']['CONN_HEALTH_CHECKS'])
+        self.assertEqual(config['default']['OPTIONS']['pool']['max_size'], 20)
+        self.assertEqual((config['replica_1']['HOST'], config['replica_1']['PORT']), ('r2', '5433'))
+        self.assertEqual(config['replica_0']['TEST'], {'MIRROR': 'default'})
+
+        with mock.patch.dict(os.environ, {'SHOP_DB_PROFILE': 'server'}):
+            self.assertEqual(databases.build(None)['default']['CONN_MAX_AGE'], 60)
+        with mock.patch.dict(os.environ, {'SHOP_DB_PROFILE': 'oracle'}), self.assertRaises(ValueError):
+            databases.build(None)
+
+    @override_settings(SHOP_DATABASE_ROUTING={'REPLICAS': ['replica_0']})
+    def test_catalogue_reads_go_to_replicas(self):
+        router = db_router.ReplicaRouter()
+        self.assertEqual(router.db_for_read(Product), 'replica_0')
+        self.assertEqual(router.db_for_read(Cart), 'default')
+        self.assertEqual(router.db_for_write(Product), 'default')
+        self.assertFalse(router.allow_migrate('replica_0', 'shop'))
+        # Связанные объекты — из той же БД, что и исходный
+        item = CartItem()
+        item._state.db = 'default'
+        self.assertEqual(router.db_for_read(Product, instance=item), 'default')
+
+        with db_router.use_primary():
+            self.assertEqual(router.db_for_read(Product), 'default')
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(Product), 'default')
+        self.assertEqual(router.db_for_read(Product), 'replica_0')
+
+    def test_without_replicas_everything_uses_default(self):
+        self.assertEqual(db_router.ReplicaRouter().db_for_read(Product), 'default')
+
+
+class StockReservationTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'pass', is_staff=True)
+        cls.user = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        cls.rival = CustomUser.objects.create_user('rival', 'rival@example.com', 'pass')
+        cls.category = Category.objects.create(name='Блёсны')
+
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(category=self.category, name='Колебалка', description='', price='150.00', stock=5)
+
+    def add(self, user, quantity):
+        self.client.force_authenticate(user)
+        return self.client.post('/api/cart-items/', {'product_id': self.product.id, 'quantity': quantity})
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.stock, self.product.available
+
+    def test_cart_holds_stock_until_checkout(self):
+        item_id = self.add(self.user, 2).data['id']
+        self.assertEqual(self.stock(), (3, True))
+        self.assertEqual(StockReservation.objects.get().quantity, 2)
+
+        self.client.patch(f'/api/cart-items/{item_id}/', {'quantity': 1})
+        self.assertEqual(self.stock(), (4, True))
+
+        response = self.client.post('/api/orders/', {'address': '-', 'personal_info': {}}, format='json')
+        self.assertEqual(response.status_code, 201)
+        # Забронированное не списывается второй раз
+        self.assertEqual(self.stock(), (4, True))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_removing_item_returns_stock_and_sold_out_product_becomes_available_again(self):
+        item_id = self.add(self.user, 5).data['id']
+        self.assertEqual(self.stock(), (0, False))
+        self.client.delete(f'/api/cart-items/{item_id}/')
+        self.assertEqual(self.stock(), (5, True))
+
+    def test_expired_reservation_goes_to_the_next_buyer(self):
+        self.add(self.user, 4)
+        self.add(self.rival, 3)
+        # Не хватило: позиция в корзине есть, брони нет
+        self.assertEqual(StockReservation.objects.count(), 1)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        response = self.client.post('/api/orders/', {'address': '-', 'personal_info': {}}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stock(), (2, True))
+        self.assertFalse(StockReservation.objects.exists())
+
+        # Опоздавший покупатель получает 409, его корзина не тронута
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/orders/', {'address': '-', 'personal_info': {}}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.stock(), (2, True))
+
+    def test_partial_take_is_rolled_back_before_retry(self):
+        plenty = Product.objects.create(category=self.category, name='Поводок', description='', price='20.00', stock=10)
+        self.add(self.rival, 5)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=plenty, quantity=2)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+
+        # Первая попытка списывает поводок, но не блесну (остаток 0) — поводок не должен уйти дважды
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/orders/', {'address': '-', 'personal_info': {}}, format='json')
+        self.assertEqual(response.status_code, 201)
+        plenty.refresh_from_db()
+        self.assertEqual(plenty.stock, 8)
+        self.assertEqual(self.stock(), (4, True))
+
+    def test_release_expired_and_orphaned(self):
+        self.add(self.user, 2)
+        self.add(self.rival, 1)
+        CartItem.objects.filter(cart__user=self.rival).delete()
+        self.assertEqual(stock.release_expired(), 1)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(stock.release_expired(), 2)
+        self.assertEqual(self.stock(), (5, True))
+
+    def test_stale_admin_edit_is_rejected(self):
+        self.client.force_authenticate(self.admin)
+        version = self.client.get(f'/api/products/{self.product.id}/').data['version']
+        self.add(self.user, 1)  # Бронь меняет остаток и версию
+
+        self.client.force_authenticate(self.admin)
+        url = f'/api/products/{self.product.id}/'
+        response = self.client.patch(url, {'stock': 10, 'version': version}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['version'], version + 1)
+        self.assertEqual(self.stock(), (4, True))
+
+        response = self.client.patch(url, {'stock': 10, 'version': version + 1}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['version'], version + 2)
+        self.assertEqual(self.stock(), (9, True))  # 10 на складе, 1 из них в корзине
+
+    def test_api_stock_edit_counts_reserved_units(self):
+        self.add(self.user, 4)
+        self.client.force_authenticate(self.admin)
+        url = f'/api/products/{self.product.id}/'
+        response = self.client.patch(url, {'stock': 3}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('stock', response.data)
+
+        self.assertEqual(self.client.patch(url, {'stock': 10}, format='json').status_code, 200)
+        self.assertEqual(self.stock(), (6, True))
+        self.assertIn(',10,', ''.join(product_io.export_products('csv')))
+
+        # Без свободных единиц товар снят с продажи и возвращается, когда они появятся
+        self.assertEqual(self.client.patch(url, {'stock': 4}, format='json').status_code, 200)
+        self.assertEqual(self.stock(), (0, False))
+        self.assertEqual(self.client.patch(url, {'stock': 7}, format='json').status_code, 200)
+        self.assertEqual(self.stock(), (3, True))
+
+    def test_put_back_keeps_products_disabled_by_staff(self):
+        self.add(self.user, 5)
+        self.assertEqual(self.stock(), (0, False))
+        self.client.force_authenticate(self.admin)
+        self.client.patch(f'/api/products/{self.product.id}/', {'available': False}, format='json')
+        stock.put_back({self.product.pk: 2})
+        self.assertEqual(self.stock(), (2, False))
+
+    def test_import_export_and_admin_count_reserved_units(self):
+        from django.contrib.admin.sites import site
+        from .admin import ProductAdmin, ProductAdminForm
+
+        Product.objects.filter(pk=self.product.pk).update(sku='B-1')
+        self.add(self.user, 2)
+        version = Product.objects.get(pk=self.product.pk).version
+
+        # В фиде — физический остаток: 10 на складе, из них 2 в корзине
+        feed = f'sku,name,price,stock,category\nB-1,Колебалка,150,{{stock}},{self.category.id}\n'
+        report = import_products(StringIO(feed.format(stock=10)), 'csv')
+        self.assertEqual(report.error_count, 0)
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.stock, product.version), (8, version + 1))
+        report = import_products(StringIO(feed.format(stock=1)), 'csv')
+        self.assertEqual((report.updated, report.errors[0]['line']), (0, 2))
+        self.assertEqual(self.stock(), (8, True))
+        exported = ''.join(product_io.export_products('csv'))
+        self.assertIn(',150.00,10,', exported)
+
+        form = ProductAdminForm(instance=product)
+        self.assertEqual(form.initial['stock'], 10)
+        data = {
+            'name': product.name, 'description': 'Описание', 'price': '150.00', 'stock': 1, 'available': True,
+            'category': self.category.id, 'brand': Brand.objects.create(name='Mepps').id, 'expected_version': product.version,
+        }
+        form = ProductAdminForm(data, instance=product)
+        self.assertIn('stock', form.errors)
+        data['stock'] = 6
+        form = ProductAdminForm(data, instance=product)
+        self.assertTrue(form.is_valid(), form.errors)
+        ProductAdmin(Product, site).save_model(RequestFactory().post('/'), form.instance, form, change=True)
+        product.refresh_from_db()
+        self.assertEqual((product.stock, product.version), (4, version + 2))
+
+    def test_stale_admin_form_is_rejected(self):
+        from .admin import ProductAdminForm
+
+        opened = ProductAdminForm(instance=self.product)
+        data = {
+            'name': self.product.name, 'description': 'Описание', 'price': '150.00', 'stock': 7, 'available': True,
+            'category': self.category.id, 'expected_version': opened.fields['expected_version'].initial,
+        }
+        self.add(self.user, 1)
+
+        form = ProductAdminForm(data, instance=Product.objects.get(pk=self.product.pk))
+        self.assertFalse(form.is_valid())
+        self.assertIn('Откройте его заново', str(form.non_field_errors()))
+        data['expected_version'] += 1
+        form = ProductAdminForm(data, instance=Product.objects.get(pk=self.product.pk))
+        form.is_valid()
+        self.assertFalse(form.non_field_errors())
+
+
+class SparseFieldsTests(ShopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        cls.category = Category.objects.create(name='Воблеры', description='Плавающие и тонущие')
+        brand = Brand.objects.create(name='Rapala')
+        cls.product = Product.objects.create(
+            category=cls.category, brand=brand, name='Shad Rap', description='Очень длинное описание ' * 50,
+            price=Decimal('990.00'), stock=3, image='products/1.jpg',
+        )
+        order = Order.objects.create(user=cls.user, address='ул. Речная', personal_info={'name': 'Иван'}, status='pending')
+        OrderItem.objects.create(order=order, product=cls.product, quantity=1, price=cls.product.price)
+
+    def get(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, ' '.join(query['sql'] for query in queries)
+
+    def test_fields_trim_output_and_columns(self):
+        full = self.client.get('/api/products/').data['results'][0]
+        for fast in (True, False):
+            with self.settings(SHOP_FAST_SERIALIZERS=fast):
+                response, sql = self.get('/api/products/?fields=name,id,price,image,image_variants')
+            self.assertEqual(response.status_code, 200)
+            row = response.data['results'][0]
+            self.assertEqual(list(row), ['id', 'name', 'price', 'image', 'image_variants'])
+            self.assertEqual(row, {name: full[name] for name in row})
+            self.assertNotIn('"description"', sql)
+            self.assertNotIn('shop_brand', sql)  # brand_name не запрошен — без JOIN
+
+    def test_omit_on_detail(self):
+        url = f'/api/products/{self.product.id}/'
+        full = self.client.get(url).data
+        response, sql = self.get(url + '?omit=description,updated_at')
+        self.assertEqual(response.data, {name: value for name, value in full.items() if name not in ('description', 'updated_at')})
+        self.assertNotIn('"description"', sql)
+        self.assertIn('shop_brand', sql)
+        self.assertNotIn('Last-Modified', response)
+        # Полный ответ не берётся из кеша урезанного
+        self.assertEqual(self.client.get(url).data, full)
+
+    def test_orders_and_categories(self):
+        self.client.force_authenticate(self.user)
+        response, sql = self.get('/api/orders/?fields=id,status,total_amount')
+        self.assertEqual([list(row) for row in response.data], [['id', 'total_amount', 'status']])
+        self.assertNotIn('personal_info', sql)
+        self.assertNotIn('shop_orderitem', sql)
+
+        response, sql = self.get(f'/api/categories/{self.category.id}/?omit=description')
+        self.assertEqual(response.data, {'id': self.category.id, 'name': 'Воблеры', 'parent': None, 'subcategories': []})
+        self.assertNotIn('"description"', sql)
+
+    def test_invalid_names_and_writes(self):
+        response = self.client.get('/api/products/?fields=id,sku')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sku', str(response.data['fields']))
+        self.assertEqual(self.client.get('/api/categories/?omit=id,name,description,parent,subcategories').status_code, 400)
+
+        # На запись параметры не влияют: ответ полный, description сохраняется
+        self.client.force_authenticate(CustomUser.objects.create_user('admin', 'admin@example.com', 'pass', is_staff=True))
+        response = self.client.patch(f'/api/products/{self.product.id}/?fields=id', {'stock': 4}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('description', response.data)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.description[:5]), (4, 'Очень'))
@@ -0,0 +1,143 @@
+import logging
+import random
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+logger = logging.getLogger('shop.trace')
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.01,
+}
+
+_current = ContextVar('shop_serialization_trace', default=None)
+_registry = []
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SHOP_SERIALIZER_TRACE', {})}
+
+
+class SerializationTrace:
+    """Сколько объектов и за какое время сериализовал каждый сериализатор за запрос."""
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.seconds = defaultdict(float)
+        # Время сериализаторов верхнего уровня: вложенные уже входят в него
+        self.total = 0.0
+        self.depth = 0
+
+    def add(self, name, seconds, objects=1):
+        self.counts[name] += objects
+        self.seconds[name] += seconds
+
+    @contextmanager
+    def span(self, name, objects=1):
+        start = perf_counter()
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            elapsed = perf_counter() - start
+            self.add(name, elapsed, objects)
+            if not self.depth:
+                self.total += elapsed
+
+    def as_dict(self):
+        return {
+            name: {'objects': self.counts[name], 'ms': round(self.seconds[name] * 1000, 3)}
+            for name in self.counts
+        }
+
+    def __str__(self):
+        return ', '.join(
+            f'{name}: {stats["objects"]} objects in {stats["ms"]:.1f} ms'
+            for name, stats in self.as_dict().items()
+        ) or 'nothing serialized'
+
+
+@contextmanager
+def collect():
+    """Собирает трассу для всего, что сериализуется внутри блока (вложенный collect() пишет в ту же трассу)."""
+    trace = _current.get()
+    if trace is not None:
+        yield trace
+        return
+    trace = SerializationTrace()
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def _instrument(cls):
+    if '_untraced_to_representation' in cls.__dict__:
+        return
+    if 'to_representation' in cls.__dict__:
+        original = cls.__dict__['to_representation']
+    else:
+        # Не оборачиваем повторно уже инструментированный метод родителя
+        original = getattr(cls, '_untraced_to_representation', cls.to_representation)
+    name = cls.__name__
+
+    def to_representation(self, instance):
+        trace = _current.get()
+        if trace is None:
+            return original(self, instance)
+        with trace.span(name):
+            return original(self, instance)
+
+    cls._untraced_to_representation = original
+    cls.to_representation = to_representation
+
+
+def traced(cls):
+    """
+    Декоратор сериализатора. Пока трассировка выключена, класс остаётся
+    нетронутым — никаких накладных расходов на объект.
+    """
+    _registry.append(cls)
+    if get_config()['ENABLED']:
+        _instrument(cls)
+    return cls
+
+
+def install():
+    """Включает замеры во всех сериализаторах, помеченных @traced."""
+    for cls in _registry:
+        _instrument(cls)
+
+
+class SerializerTraceMiddleware:
+    """
+    Для доли запросов SAMPLE_RATE пишет в лог 'shop.trace' число объектов и
+    время сериализации по каждому сериализатору. При ENABLED=False Django
+    исключает middleware из цепочки.
+    """
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        install()
+        self.get_response = get_response
+        self.sample_rate = config['SAMPLE_RATE']
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+        with collect() as trace:
+            response = self.get_response(request)
+        logger.info(
+            '%s %s: %s', request.method, request.path, trace,
+            extra={'serialization': trace.as_dict()},
+        )
+        return response
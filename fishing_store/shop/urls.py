@@ -1,7 +1,10 @@
-from django.urls import path, include
+from django.conf import settings
+from django.urls import URLPattern, path, include
 from rest_framework.routers import DefaultRouter
 from .views import AdminOrderViewSet, BrandViewSet, CartItemViewSet, CartViewSet, CategoryViewSet, OrderViewSet, ProductViewSet, UserOrdersViewSet, UserRegistrationView, CustomTokenObtainPairView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from .async_views import async_viewset_view
+from .metrics import MetricsView
 
 
 router = DefaultRouter()
@@ -13,10 +16,18 @@ router.register(r'brands', BrandViewSet, basename='brands')
 router.register(r'admin/orders', AdminOrderViewSet, basename='admin-orders')  # Роут для админов
 router.register(r'orders', OrderViewSet, basename='orders')  # Роут для пользователей
 
-urlpatterns = [
-    path('', include(router.urls)),
-	path('register/', UserRegistrationView.as_view(), name='user-register'),
-	path('token/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
-    path('categories/<int:pk>/subcategories/', CategoryViewSet.as_view({'get': 'get_subcategories'}), name='category-subcategories'),  # Новый путь
-]
+def build_urlpatterns(use_async=False):
+    # Под ASGI (SHOP_ASYNC_VIEWS) чтение каталога и корзины обслуживают async-представления
+    routes = router.urls
+    if use_async:
+        routes = [URLPattern(route.pattern, async_viewset_view(route.callback), route.default_args, route.name) for route in routes]
+    return [
+        path('', include(routes)),
+        path('register/', UserRegistrationView.as_view(), name='user-register'),
+        path('token/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
+        path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+        path('metrics/', MetricsView.as_view(), name='metrics'),  # Prometheus, только для администраторов
+        path('categories/<int:pk>/subcategories/', CategoryViewSet.as_view({'get': 'get_subcategories'}), name='category-subcategories'),  # Новый путь
+    ]
+
+urlpatterns = build_urlpatterns(settings.SHOP_ASYNC_VIEWS)
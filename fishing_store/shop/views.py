@@ -1,73 +1,165 @@
 from rest_framework import viewsets, generics
+from rest_framework.decorators import action
 from .models import Order, OrderItem
 from rest_framework.permissions import AllowAny
 from rest_framework_simplejwt.views import TokenObtainPairView
-from .models import Brand, Category, Order, Product, Cart, CartItem
-from .serializers import BrandSerializer, CategorySerializer, OrderSerializer, ProductSerializer, UserRegistrationSerializer, CustomTokenObtainPairSerializer, CartSerializer, CartItemSerializer
+from .models import Brand, Category, Order, Product, Cart, CartItem, StockReservation
+from .serializers import BrandSerializer, CategorySerializer, OrderSerializer, ProductSerializer, UserRegistrationSerializer, CustomTokenObtainPairSerializer, CartSerializer, CartItemSerializer, CartSummarySerializer, CartLineSerializer, CartBatchSerializer, OrderAnalyticsQuerySerializer, SimpleProductSerializer
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from django.contrib.auth import get_user_model
 from rest_framework.response import Response
+from django.db import transaction
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.parsers import MultiPartParser
 from .permissions import IsAdminOrReadOnly  # Импортируем новый класс прав
+from .pagination import ProductPagination
+from .prefetch import PrefetchRelatedMixin, prefetch_for_serializer
+from .checkout import place_order
+from .analytics import order_analytics
+from .recommendations import recommend
+from . import cart_totals, stock
+from .cart_items import merge_lines, upsert_cart_items
+from . import product_io
+from .category_tree import get_category_tree
+from .search import ProductSearchFilter
+from .filters import ProductFilter
+from .facets import get_facets
+from .response_cache import CachedResponseMixin
+from .fast_serializers import FastListMixin
+from .sparse_fields import SparseFieldsMixin
+from .async_views import AsyncReadMixin
 from django_filters.rest_framework import DjangoFilterBackend  # Импортируем DjangoFilterBackend
-from django_filters import rest_framework as filters  # Импортируем фильтры
 from rest_framework import filters as drf_filters  # Импортируем фильтры из DRF
-from django.db.models import Sum
-from django.db.models import F
 
 User = get_user_model()  # Получаем модель пользователя
 
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(CachedResponseMixin, AsyncReadMixin, SparseFieldsMixin, PrefetchRelatedMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAdminOrReadOnly]
+    cache_tags = {'list': ['category'], 'retrieve': ['category']}
     def get_subcategories(self, request, pk=None):
-        try:
-            category = self.get_object()  # Получаем категорию по ID (pk)
-            subcategories = category.subcategories.all()  # Получаем подкатегории
-            serializer = CategorySerializer(subcategories, many=True)  # Сериализуем подкатегории
-            return Response(serializer.data)  # Возвращаем данные подкатегорий
-        except Category.DoesNotExist:
+        tree = get_category_tree()
+        if pk not in tree:
             return Response({"detail": "Category not found."}, status=404)
+        # ?descendants=true — всё поддерево, иначе только прямые подкатегории
+        if request.query_params.get('descendants') in ('1', 'true'):
+            ids = tree.get_descendant_ids(pk)[1:]
+        else:
+            ids = tree.get_children_ids(pk)
+        subcategories = prefetch_for_serializer(Category.objects.filter(id__in=ids), CategorySerializer)
+        serializer = CategorySerializer(subcategories, many=True)  # Сериализуем подкатегории
+        return Response(serializer.data)  # Возвращаем данные подкатегорий
 
-class ProductFilter(filters.FilterSet):
-    price_min = filters.NumberFilter(field_name="price", lookup_expr='gte')
-    price_max = filters.NumberFilter(field_name="price", lookup_expr='lte')
-    brands = filters.BaseInFilter(field_name='brand__id', lookup_expr='in')
-    category = filters.NumberFilter(field_name='category__id')
-    
-    class Meta:
-        model = Product
-        fields = ['price_min', 'price_max', 'brands', 'category']
-
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(CachedResponseMixin, AsyncReadMixin, FastListMixin, SparseFieldsMixin, PrefetchRelatedMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAdminOrReadOnly]
-    filter_backends = [DjangoFilterBackend, drf_filters.OrderingFilter, drf_filters.SearchFilter]
+    cache_tags = {
+        'list': ['product', 'brand', 'category'],
+        'retrieve': ['product:{pk}', 'brand'],
+        'facets': ['product', 'brand', 'category'],
+        'recommendations': ['product', 'recommendations'],
+    }
+    last_modified_field = 'updated_at'
+    filter_backends = [DjangoFilterBackend, drf_filters.OrderingFilter, ProductSearchFilter]
     filterset_class = ProductFilter
+    pagination_class = ProductPagination
     ordering_fields = ['price']
     ordering = ['price']
-    search_fields = ['name']
+    search_fields = ['name', 'description', 'brand__name']  # Что попадает в поисковый индекс
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        category_id = self.request.query_params.get('category')
-
-        if category_id:
-            try:
-                category = Category.objects.get(id=category_id)
-                if category.parent is None:
-                    subcategory_ids = category.subcategories.values_list('id', flat=True)
-                    all_category_ids = [category.id] + list(subcategory_ids)
-                    queryset = queryset.filter(category__id__in=all_category_ids)
-                else:
-                    queryset = queryset.filter(category=category)
-            except Category.DoesNotExist:
-                return Product.objects.none()
-
-        return queryset
+    def perform_create(self, serializer):
+        data = serializer.validated_data
+        data.pop('version', None)
+        available, sold_out = stock.availability(Product(), data['stock'], data.get('available'))
+        serializer.save(available=available, sold_out=sold_out)
+
+    def perform_update(self, serializer):
+        # Правка на основе устаревших данных (version из ответа, по которому правили) — 409, а не затирание
+        product, data = serializer.instance, serializer.validated_data
+        expected = data.pop('version', product.version)
+        with transaction.atomic():
+            stock.lock_products([product.pk])
+            stock.check_version(product, expected)
+            free = product.stock
+            if 'stock' in data:
+                # В правке stock — физический остаток, как в админке и фиде: брони корзин вычитаются
+                reserved = stock.reserved([product.pk]).get(product.pk, 0)
+                if data['stock'] < reserved:
+                    raise ValidationError({'stock': [f'Ensure this value is greater than or equal to {reserved} (reserved in carts).']})
+                free = data['stock'] = data['stock'] - reserved
+            available, sold_out = stock.availability(product, free, data.get('available'))
+            serializer.save(available=available, sold_out=sold_out)
+
+    @action(detail=False)
+    def facets(self, request):
+        # Счётчики для фильтров каталога: /api/products/facets/?brands=1,2&price_min=100
+        return self.get_cached_response(request, self.get_facets)
+
+    @action(detail=True)
+    def recommendations(self, request, pk=None):
+        # «Покупают вместе» с подстановкой из категории и бренда: /api/products/5/recommendations/?limit=8
+        return self.get_cached_response(request, self.get_recommendations)
+
+    def get_recommendations(self, request):
+        try:
+            product_id = int(self.kwargs['pk'])
+        except ValueError:
+            raise NotFound()
+        try:
+            limit = min(max(int(request.query_params.get('limit', 8)), 1), 50)
+        except ValueError:
+            raise ValidationError({'limit': ['A valid integer is required.']})
+        recommended = recommend(product_id, limit)
+        if recommended is None:
+            raise NotFound()
+        data = SimpleProductSerializer([product for product, source in recommended], many=True, context={'request': request}).data
+        for row, (product, source) in zip(data, recommended):
+            row['source'] = source
+        return Response(data)
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsAdminUser], parser_classes=[MultiPartParser])
+    def import_products(self, request):
+        # multipart: file=<feed.csv|feed.jsonl>, fmt=csv|jsonl (по умолчанию — по расширению)
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': ['This field is required.']})
+        fmt = request.data.get('fmt') or upload.name.rsplit('.', 1)[-1].lower()
+        if fmt not in product_io.FORMATS:
+            raise ValidationError({'fmt': [f'Expected one of: {", ".join(product_io.FORMATS)}.']})
+        try:
+            stream = product_io.text_stream(upload.file)
+        except UnicodeDecodeError:
+            raise ValidationError({'file': ['File must be UTF-8 encoded.']})
+        report = product_io.import_products(stream, fmt)
+        return Response(report.as_dict())
+
+    @action(detail=False, url_path='export', permission_classes=[IsAdminUser])
+    def export_products(self, request):
+        # Весь каталог потоком: /api/products/export/?fmt=jsonl
+        fmt = request.query_params.get('fmt', 'csv')
+        if fmt not in product_io.FORMATS:
+            raise ValidationError({'fmt': [f'Expected one of: {", ".join(product_io.FORMATS)}.']})
+        # Под ASGI нужен async-итератор, иначе Django соберёт весь ответ в памяти
+        if isinstance(request._request, ASGIRequest):
+            content = product_io.aexport_products(fmt)
+        else:
+            content = product_io.export_products(fmt)
+        response = StreamingHttpResponse(
+            content,
+            content_type='text/csv; charset=utf-8' if fmt == 'csv' else 'application/jsonl; charset=utf-8',
+        )
+        response['Content-Disposition'] = f'attachment; filename="products.{fmt}"'
+        return response
+
+    def get_facets(self, request):
+        queryset = ProductSearchFilter().filter_queryset(request, self.get_queryset(), self)
+        return Response(get_facets(queryset, request.query_params))
 
 class UserRegistrationView(generics.CreateAPIView):
     queryset = User.objects.all()
@@ -96,87 +188,121 @@ class CustomTokenObtainPairView(TokenObtainPairView):
             'is_staff': user.is_staff,
         })
         
-class CartViewSet(viewsets.ModelViewSet):
+class CartViewSet(AsyncReadMixin, FastListMixin, PrefetchRelatedMixin, viewsets.ModelViewSet):
+    queryset = Cart.objects.all()
     serializer_class = CartSerializer
+    permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user)
+        return super().get_queryset().filter(user_id=self.request.user.pk)
 
     def create(self, request, *args, **kwargs):
-        cart, created = Cart.objects.get_or_create(user=request.user)
+        cart, created = Cart.objects.get_or_create(user_id=request.user.pk)
+        cart = self.get_queryset().get(pk=cart.pk)  # Корзина вместе с товарами
         return Response(CartSerializer(cart).data)
 
-class CartItemViewSet(viewsets.ModelViewSet):
+    @action(detail=False)
+    def summary(self, request):
+        # Бейдж корзины: одна выборка по уникальному user_id, без позиций
+        cart = Cart.objects.filter(user_id=request.user.pk).only(*CartSummarySerializer.Meta.fields).first()
+        return Response(CartSummarySerializer(cart or Cart()).data)
+
+    async def asummary(self, request):
+        cart = await Cart.objects.filter(user_id=request.user.pk).only(*CartSummarySerializer.Meta.fields).afirst()
+        return Response(CartSummarySerializer(cart or Cart()).data)
+
+class CartItemViewSet(PrefetchRelatedMixin, viewsets.ModelViewSet):
     queryset = CartItem.objects.all()
     serializer_class = CartItemSerializer
+    permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return CartItem.objects.filter(cart__user=self.request.user)
+        return super().get_queryset().filter(cart__user_id=self.request.user.pk)
 
-    def perform_create(self, serializer):
-        cart, created = Cart.objects.get_or_create(user=self.request.user)
-        serializer.save(cart=cart)
+    def create(self, request, *args, **kwargs):
+        # Повторное добавление того же товара увеличивает количество, а не плодит строки
+        line = CartLineSerializer(data=request.data)
+        line.is_valid(raise_exception=True)
+        ids = upsert_cart_items(request.user, merge_lines([line.validated_data]))
+        item = self.get_queryset().get(pk=ids[0])
+        return Response(self.get_serializer(item).data, status=201)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        # {"items": [{"product_id": 1, "quantity": 2}, ...], "mode": "add" | "set"} — одной транзакцией
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        mode = serializer.validated_data['mode']
+        upsert_cart_items(request.user, merge_lines(serializer.validated_data['items'], mode), mode)
+        cart = prefetch_for_serializer(Cart.objects.filter(user_id=request.user.pk), CartSerializer).get()
+        return Response(CartSerializer(cart).data)
+
+    def perform_update(self, serializer):
+        old_quantity, old_price = serializer.instance.quantity, serializer.instance.product.price
+        with transaction.atomic():
+            item = serializer.save()
+            cart_totals.item_changed(item, old_quantity, old_price)
+            stock.reserve([item.pk])
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            stock.release(StockReservation.objects.filter(cart_item=instance))
+            instance.delete()
+            cart_totals.item_removed(instance)
         
-class BrandViewSet(viewsets.ModelViewSet):
+class BrandViewSet(CachedResponseMixin, AsyncReadMixin, viewsets.ModelViewSet):
     queryset = Brand.objects.all()
     serializer_class = BrandSerializer
     permission_classes = [IsAdminOrReadOnly]  # Или другая политика, которую вы используете
+    cache_tags = {'list': ['brand'], 'retrieve': ['brand:{pk}']}
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(FastListMixin, SparseFieldsMixin, PrefetchRelatedMixin, viewsets.ModelViewSet):
+    queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        return super().get_queryset().filter(user_id=self.request.user.pk).order_by('-created_at')
 
     def create(self, request, *args, **kwargs):
-        cart = request.user.cart
-        cart_items = cart.items.all()
-
-        if not cart_items.exists(): 
-            return Response({"detail": "Cart is empty"}, status=400)
-
-        # Используем корректный импорт F
-        total_amount = cart_items.aggregate(
-            total=Sum(F('quantity') * F('product__price'))
-        )['total']
-
-        # Создаем заказ
-        order = Order.objects.create(
+        order = place_order(
             user=request.user,
-            total_amount=total_amount,
             address=request.data.get('address'),
             personal_info=request.data.get('personal_info'),
         )
-
-        # Создаем позиции заказа
-        for item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-                price=item.product.price,
-            )
-
-        # Очищаем корзину
-        cart_items.delete()
-
+        order = self.get_queryset().get(pk=order.pk)  # Заказ вместе с позициями
         return Response(OrderSerializer(order).data, status=201)
 
-class AdminOrderViewSet(viewsets.ModelViewSet):
+class AdminOrderViewSet(FastListMixin, PrefetchRelatedMixin, viewsets.ModelViewSet):
     queryset = Order.objects.all()  # Получаем все заказы
     serializer_class = OrderSerializer
     permission_classes = [IsAdminUser]  # Доступ только для администраторов
+    filterset_fields = ['status']
 
     def get_queryset(self):
         # Администратор может получить все заказы
-        return Order.objects.all()
+        return super().get_queryset().order_by('-created_at')
+
+    @action(detail=False)
+    def analytics(self, request):
+        # /api/admin/orders/analytics/?date_from=2024-01-01&date_to=2024-03-31&period=week&status=completed&top=10
+        query = OrderAnalyticsQuerySerializer(data={
+            **request.query_params.dict(),
+            'status': [value for value in request.query_params.getlist('status') for value in value.split(',') if value],
+        })
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        return Response(order_analytics(
+            params['date_from'], params['date_to'], params['period'], sorted(params.get('status') or ()), params['top'],
+        ))
 
 class UserOrdersViewSet(viewsets.ViewSet):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
 
     def list(self, request):
-        orders = Order.objects.filter(user=self.request.user)
+        orders = prefetch_for_serializer(
+            Order.objects.filter(user_id=self.request.user.pk).order_by('-created_at'), self.serializer_class,
+        )
         serializer = self.serializer_class(orders, many=True)
         return Response(serializer.data)
\ No newline at end of file